@@ -0,0 +1,343 @@
+"""
+准入控制
+
+对话轮次、模型调用和MCP工具调用默认都不限制并发，突发流量下所有会话同时请求DeepSeek和高德，
+结果是所有请求一起变慢、一起超时。这里为三类调用分别设置闸门（Gate）：
+
+- turns: 同时执行的对话轮次（process_query）
+- llm: 同时进行的模型调用（ModelSwitch / RoutedModel）
+- tool:<服务器名>: 每个MCP服务器同时执行的工具调用，上限可由config.json中的max_concurrency覆盖
+
+闸门满时请求按先来先到排队，可通过on_queue回调得到当前排队位置；排队人数超过队列深度，
+或排队时间超过最长等待时间时立即拒绝（AdmissionRejected），而不是让所有请求一起超时。
+闸门用线程锁实现，可在不同线程、不同事件循环（Streamlit各会话、后台任务、MCP运行时）之间共享。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+
+# 排队时间超过该值（秒）后拒绝
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+# 排队时检查排队位置变化的间隔（秒）
+ADMISSION_POLL_INTERVAL = 0.5
+
+# 闸门名称（或前缀）-> (并发上限, 队列深度)；并发上限为0表示不限制
+DEFAULT_LIMITS = {
+    "turns": (
+        int(os.getenv("AGENT_MAX_CONCURRENT_TURNS", "4")),
+        int(os.getenv("AGENT_TURN_QUEUE_DEPTH", "16")),
+    ),
+    "llm": (
+        int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        int(os.getenv("LLM_QUEUE_DEPTH", "64")),
+    ),
+    "tool": (
+        int(os.getenv("MCP_TOOL_MAX_CONCURRENCY", "8")),
+        int(os.getenv("MCP_TOOL_QUEUE_DEPTH", "32")),
+    ),
+}
+
+# 用于计算排队时间分位数的最近样本数
+WAIT_SAMPLES = 1000
+
+
+class AdmissionRejected(RuntimeError):
+    """闸门已满（队列已满或排队超时）"""
+
+    def __init__(self, gate: str, reason: str):
+        super().__init__(f"{gate}: {reason}")
+        self.gate = gate
+        self.reason = reason
+
+
+class _Waiter:
+    """排队中的一个请求；被放行时由release()在持有锁的情况下调用grant()"""
+
+    __slots__ = ("granted", "_loop", "_future", "_event")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False
+        self._loop = loop
+        self._future = loop.create_future() if loop is not None else None
+        self._event = threading.Event() if loop is None else None
+
+    def grant(self):
+        self.granted = True
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+        else:
+            self._event.set()
+
+    async def wait_async(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.granted
+
+    def wait_sync(self, timeout: float) -> bool:
+        self._event.wait(timeout)
+        return self.granted
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Gate:
+    """
+    带队列深度限制的并发闸门（线程安全）
+
+    Args:
+        name (str): 闸门名称
+        limit (int): 最大并发数，0表示不限制
+        max_queue (int): 最多排队的请求数，超过时立即拒绝
+        max_wait (float): 最长排队时间（秒），超过时拒绝
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float = ADMISSION_MAX_WAIT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters: deque = deque()
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._waits: deque = deque(maxlen=WAIT_SAMPLES)
+
+    def configure(self, limit: Optional[int] = None, max_queue: Optional[int] = None,
+                  max_wait: Optional[float] = None):
+        """修改闸门参数，并发上限提高时立即放行排队中的请求"""
+        with self._lock:
+            if limit is not None:
+                self.limit = limit
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if max_wait is not None:
+                self.max_wait = max_wait
+            while self._waiters and self._has_capacity():
+                self._active += 1
+                self._waiters.popleft().grant()
+
+    def _has_capacity(self) -> bool:
+        return self.limit <= 0 or self._active < self.limit
+
+    def _enter(self, waiter_factory: Callable[[], _Waiter]):
+        """持有锁时调用: 直接放行返回None，需要排队时返回waiter，队列已满时抛出AdmissionRejected"""
+        if not self._waiters and self._has_capacity():
+            self._active += 1
+            self._admitted += 1
+            self._waits.append(0.0)
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self._rejected += 1
+            raise AdmissionRejected(self.name, f"排队请求已达上限（{self.max_queue}）")
+        waiter = waiter_factory()
+        self._waiters.append(waiter)
+        self._queued += 1
+        return waiter
+
+    def _position(self, waiter: _Waiter) -> int:
+        """排队位置（从1开始），已放行时为0"""
+        with self._lock:
+            if waiter.granted:
+                return 0
+            try:
+                return self._waiters.index(waiter) + 1
+            except ValueError:
+                return 0
+
+    def _cancel(self, waiter: _Waiter):
+        """排队时被取消: 已被放行则归还名额，否则从队列中移除"""
+        with self._lock:
+            if waiter.granted:
+                self._release_locked()
+            else:
+                self._waiters.remove(waiter)
+
+    def _timeout(self, waiter: _Waiter, started: float):
+        """排队超时: 恰好在超时时被放行则照常占用名额，否则从队列中移除并拒绝"""
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                self._rejected += 1
+                raise AdmissionRejected(self.name, f"排队超过 {self.max_wait:g} 秒")
+        self._admitted_after(started)
+
+    def _admitted_after(self, started: float):
+        with self._lock:
+            self._admitted += 1
+            self._waits.append(time.monotonic() - started)
+
+    def try_acquire(self) -> bool:
+        """不排队: 有空闲名额时占用并返回True，否则返回False"""
+        with self._lock:
+            if self._waiters or not self._has_capacity():
+                return False
+            self._active += 1
+            self._admitted += 1
+            self._waits.append(0.0)
+            return True
+
+    async def acquire(self, on_queue: Optional[Callable[[int], Any]] = None):
+        """
+        异步占用一个名额
+
+        Args:
+            on_queue: 需要排队时以当前排队位置（从1开始）调用，位置变化时再次调用
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiter = self._enter(lambda: _Waiter(loop))
+        if waiter is None:
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        position = None
+        try:
+            while True:
+                current = self._position(waiter)
+                if current and current != position and on_queue is not None:
+                    position = current
+                    on_queue(current)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if await waiter.wait_async(min(ADMISSION_POLL_INTERVAL, remaining)):
+                    self._admitted_after(started)
+                    return
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        self._timeout(waiter, started)
+
+    def acquire_sync(self, on_queue: Optional[Callable[[int], Any]] = None):
+        """同步版本的acquire()"""
+        with self._lock:
+            waiter = self._enter(_Waiter)
+        if waiter is None:
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        position = None
+        while True:
+            current = self._position(waiter)
+            if current and current != position and on_queue is not None:
+                position = current
+                on_queue(current)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if waiter.wait_sync(min(ADMISSION_POLL_INTERVAL, remaining)):
+                self._admitted_after(started)
+                return
+        self._timeout(waiter, started)
+
+    def _release_locked(self):
+        if self._waiters and self._has_capacity_after_release():
+            # 名额直接交给队首的请求，_active不变
+            self._waiters.popleft().grant()
+        else:
+            self._active -= 1
+
+    def _has_capacity_after_release(self) -> bool:
+        return self.limit <= 0 or self._active - 1 < self.limit
+
+    def release(self):
+        with self._lock:
+            self._release_locked()
+
+    @asynccontextmanager
+    async def slot(self, on_queue: Optional[Callable[[int], Any]] = None):
+        """async with gate.slot(): ...  在占用名额期间执行"""
+        await self.acquire(on_queue)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def hold(self, on_queue: Optional[Callable[[int], Any]] = None):
+        """with gate.hold(): ...  同步版本的slot()"""
+        self.acquire_sync(on_queue)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "limit": self.limit,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "waiting": len(self._waiters),
+                "admitted": self._admitted,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "wait_p50": round(_percentile(waits, 0.5), 3),
+                "wait_p99": round(_percentile(waits, 0.99), 3),
+            }
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class AdmissionController:
+    """进程内共享的闸门集合，按名称创建，参数取DEFAULT_LIMITS中同名或同前缀（tool:xxx）的配置"""
+
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None):
+        self.limits = dict(limits or DEFAULT_LIMITS)
+        self._gates: Dict[str, Gate] = {}
+        self._lock = threading.Lock()
+
+    def defaults(self, name: str) -> tuple:
+        """闸门的默认(并发上限, 队列深度)"""
+        return self.limits.get(name) or self.limits.get(name.split(":", 1)[0], (0, 0))
+
+    def gate(self, name: str) -> Gate:
+        with self._lock:
+            gate = self._gates.get(name)
+            if gate is None:
+                gate = self._gates[name] = Gate(name, *self.defaults(name))
+            return gate
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            gates = dict(self._gates)
+        return {name: gate.snapshot() for name, gate in sorted(gates.items())}
+
+
+controller = AdmissionController()
+
+
+def turn_gate() -> Gate:
+    return controller.gate("turns")
+
+
+def llm_gate() -> Gate:
+    return controller.gate("llm")
+
+
+def tool_gate(server: str, limit: Optional[int] = None) -> Gate:
+    """MCP服务器的工具调用闸门，limit不为None时覆盖默认并发上限，为None时恢复默认值"""
+    name = f"tool:{server}"
+    gate = controller.gate(name)
+    gate.configure(limit=limit if limit is not None else controller.defaults(name)[0])
+    return gate
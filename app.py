@@ -1,9 +1,12 @@
 import streamlit as st
 import asyncio
 import nest_asyncio
+import copy
 import json
 import os
 import platform
+import time
+import uuid
 # ----- 1. 页面和CSS美化 -----
 
 if platform.system() == "Windows":
@@ -18,16 +21,98 @@ if "event_loop" not in st.session_state:
     st.session_state.event_loop = loop
     asyncio.set_event_loop(loop)
 
-from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from utils import astream_graph, random_uuid
-from langchain_core.messages.ai import AIMessageChunk
-from langchain_core.messages.tool import ToolMessage
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.runnables import RunnableConfig
-from langchain_deepseek import ChatDeepSeek
+
+# ----- 延迟导入 -----
+# LangGraph / LangChain / DeepSeek 相关模块导入耗时数秒，且Streamlit每次交互都会重新执行本脚本。
+# 这些模块只在首次需要时通过下面的访问函数导入（之后由 sys.modules 缓存），
+# 使页面框架在它们加载完成之前就能渲染出来。
+
+
+def stream_utils():
+    """Returns the utils module (event stream helpers)."""
+    import utils
+
+    return utils
+
+
+@st.cache_resource
+def get_mcp_runtime():
+    """
+    Returns the process-wide MCP runtime.
+
+    The runtime keeps one long-lived session per MCP server on a background event loop and
+    watches config.json, so servers survive reruns and only changed servers are restarted.
+    """
+    from mcp_runtime import McpRuntime
+
+    runtime = McpRuntime()
+    runtime.watch(CONFIG_FILE_PATH, float(os.getenv("MCP_CONFIG_WATCH_INTERVAL", "2")))
+    return runtime
+
+
+@st.cache_resource
+def get_job_queue():
+    """
+    Returns the process-wide background job queue.
+
+    Jobs run on worker threads independent of the browser session and store their streamed events
+    in SQLite, so a page can re-attach to a job after a rerun, reload or in another tab.
+    """
+    from job_queue import JobQueue
+
+    return JobQueue()
+
+
+def react_agent_factory():
+    """Returns langgraph's create_react_agent."""
+    from langgraph.prebuilt import create_react_agent
+
+    return create_react_agent
+
+
+def checkpointer_class():
+    """Returns the in-memory checkpointer class (stores each message payload once, by content hash)."""
+    from checkpoint_dedup import DedupMemorySaver
+
+    return DedupMemorySaver
+
+
+def human_message(content):
+    """Builds a HumanMessage for the given user input."""
+    from langchain_core.messages import HumanMessage
+
+    return HumanMessage(content=content)
+
+
+def get_chat_model(model_name):
+    """
+    Returns a routed model runnable for the agent, defaulting to the given model.
+
+    Clients come from the process-wide registry in model_registry, which reuses one instance per
+    model and parameters and shares pooled HTTP connections. The selected model can be switched
+    through config["configurable"]["model"] without rebuilding the agent, and model_router sends
+    tool-dispatch steps to the fast model according to the rules in model_config.json.
+    """
+    from model_router import RouteStats, RoutedModel, load_routing_policy
+
+    if "route_stats" not in st.session_state:
+        st.session_state.route_stats = RouteStats()
+    return RoutedModel(
+        default_model=model_name,
+        policy=load_routing_policy(),
+        stats=st.session_state.route_stats,
+    )
+
+
+def get_system_prompt():
+    """Returns the agent's system prompt as a SystemMessage, built once per session."""
+    if "system_prompt" not in st.session_state:
+        from langchain_core.messages import SystemMessage
+
+        st.session_state.system_prompt = SystemMessage(content=SYSTEM_PROMPT)
+    return st.session_state.system_prompt
+
 
 # Load environment variables (get API keys and settings from .env file)
 load_dotenv(override=True)
@@ -35,6 +120,12 @@ load_dotenv(override=True)
 # config.json file path setting
 CONFIG_FILE_PATH = "config.json"
 
+# 对话历史每页显示的消息数（更早的消息点击按钮后分页加载）
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+
+# 后台任务模式下页面读取任务进度的间隔（秒）
+JOB_POLL_INTERVAL = float(os.getenv("AGENT_JOB_POLL_INTERVAL", "1"))
+
 
 # 从 JSON 文件中加载设置
 def load_config_from_json():
@@ -42,9 +133,14 @@ def load_config_from_json():
     Loads settings from config.json file.
     Creates a file with default settings if it doesn't exist.
 
+    The file is parsed by config_schema and cached by its modification time, so repeated calls
+    only copy the cached settings instead of reading and decoding the JSON again.
+
     Returns:
-        dict: Loaded settings
+        dict: Loaded settings (a copy that may be modified freely)
     """
+    from config_schema import load_config
+
     default_config = {
         "get_current_time": {
             "command": "python",
@@ -52,18 +148,43 @@ def load_config_from_json():
             "transport": "stdio"
         }
     }
-    
-    try:
-        if os.path.exists(CONFIG_FILE_PATH):
-            with open(CONFIG_FILE_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-        else:
-            # Create file with default settings if it doesn't exist
-            save_config_to_json(default_config)
-            return default_config
-    except Exception as e:
-        st.error(f"Error loading settings file: {str(e)}")
+
+    snapshot = load_config(CONFIG_FILE_PATH)
+    if snapshot.stamp is None:
+        # Create file with default settings if it doesn't exist
+        save_config_to_json(default_config)
         return default_config
+    if snapshot.file_error:
+        st.error(f"Error loading settings file: {snapshot.file_error}")
+        return default_config
+    return copy.deepcopy(snapshot.raw)
+
+
+def set_pending_config(config):
+    """
+    Sets the pending MCP settings and parses them into validated server specs.
+
+    The parsed specs are kept in session_state so sidebar reruns do not re-validate the config.
+
+    Args:
+        config (dict): MCP server settings (server name -> settings)
+    """
+    from config_schema import parse_config
+
+    st.session_state.pending_mcp_config = config
+    st.session_state.pending_specs = parse_config(config)
+
+
+def sync_config_from_disk():
+    """
+    Loads config.json as both the pending and the applied settings.
+
+    Any unapplied sidebar edits are discarded.
+    """
+    config = load_config_from_json()
+    set_pending_config(config)
+    st.session_state.applied_mcp_config = copy.deepcopy(config)
+    st.session_state.config_changed_on_disk = False
 
 # 将设置保存到 JSON 文件
 def save_config_to_json(config):
@@ -79,6 +200,9 @@ def save_config_to_json(config):
     try:
         with open(CONFIG_FILE_PATH, "w", encoding="utf-8") as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
+        # 保存后磁盘上的配置即为当前会话已应用的配置
+        st.session_state.applied_mcp_config = copy.deepcopy(config)
+        st.session_state.config_changed_on_disk = False
         return True
     except Exception as e:
         st.error(f"Error saving settings file: {str(e)}")
@@ -307,7 +431,9 @@ if "session_initialized" not in st.session_state:
     st.session_state.session_initialized = False  
     st.session_state.agent = None  
     st.session_state.history = []  
-    st.session_state.mcp_client = None  
+    # 对话历史每次追加或替换时加一，history_base_revision为当前列表创建时的revision（见transcript_entries）
+    st.session_state.history_revision = 0
+    st.session_state.history_base_revision = 0
     st.session_state.timeout_seconds = (
         120  
     )
@@ -317,144 +443,216 @@ if "session_initialized" not in st.session_state:
     st.session_state.recursion_limit = 100  # 递归调用限制，默认100
 
 if "thread_id" not in st.session_state:
-    st.session_state.thread_id = random_uuid()
+    st.session_state.thread_id = str(uuid.uuid4())
 
 
 # --- 工具函数定义 ---
-async def cleanup_mcp_client():
+def append_history(*items):
     """
-    Safely terminates the existing MCP client.
+    Appends items to the chat history and bumps its revision.
 
-    Properly releases resources if an existing client exists.
+    Args:
+        items: History items ({"role": ..., ...})
     """
-    if "mcp_client" in st.session_state and st.session_state.mcp_client is not None:
-        try:
-            # 新版本不需要手动调用__aexit__，直接设置为None即可
-            st.session_state.mcp_client = None
-        except Exception as e:
-            import traceback
-            st.error(f"清理MCP客户端时出错: {str(e)}")
-            st.session_state.mcp_client = None
+    st.session_state.history.extend(items)
+    st.session_state.history_revision += 1
+
+
+def replace_history(items=()):
+    """
+    Replaces the chat history; display caches built from the previous list are rebuilt.
+
+    Args:
+        items: The new history items
+    """
+    st.session_state.history = list(items)
+    st.session_state.history_revision += 1
+    st.session_state.history_base_revision = st.session_state.history_revision
+
+
+def transcript_entries():
+    """
+    Returns the chat history grouped into display entries, updated incrementally.
+
+    Each assistant message is merged with the tool calls that follow it. Entries are cached in the
+    session state, so on a rerun only history items appended since the last render are processed.
+    The cache is keyed on the history's revision counters: it is rebuilt when the history list is
+    replaced (e.g. after resetting the conversation) and left untouched when nothing was appended.
+
+    Returns:
+        list: Entries of {"role", "content", "tool_calls", "tool_markdown"}
+    """
+    history = st.session_state.history
+    if st.session_state.get("transcript_base") != st.session_state.history_base_revision:
+        st.session_state.transcript = []
+        st.session_state.transcript_processed = 0
+        st.session_state.transcript_base = st.session_state.history_base_revision
+    entries = st.session_state.transcript
+    if st.session_state.get("transcript_revision") == st.session_state.history_revision:
+        return entries
+
+    for message in history[st.session_state.transcript_processed:]:
+        if message["role"] == "assistant_tool":
+            if entries and entries[-1]["role"] == "assistant":
+                entries[-1]["tool_calls"] = message["tool_calls"]
+        else:
+            entries.append({
+                "role": message["role"],
+                "content": message["content"],
+                "tool_calls": None,
+                "tool_markdown": None,
+            })
+    st.session_state.transcript_processed = len(history)
+    st.session_state.transcript_revision = st.session_state.history_revision
+    return entries
+
+
+def show_older_messages():
+    """Button callback: reveals one more page of older messages."""
+    st.session_state.history_visible = (
+        st.session_state.get("history_visible", HISTORY_PAGE_SIZE) + HISTORY_PAGE_SIZE
+    )
+
 
 def print_message():
     """
     Displays chat history on the screen.
 
-    Distinguishes between user and assistant messages on the screen,
-    and displays tool call information within the assistant message container.
+    Only the most recent HISTORY_PAGE_SIZE messages are rendered; older ones are loaded a page at
+    a time on demand. Tool call details are rendered only after their toggle is switched on, and
+    their markdown is formatted once and cached in the transcript entry.
     """
-    i = 0
-    while i < len(st.session_state.history):
-        message = st.session_state.history[i]
-        if message["role"] == "user":
-            st.chat_message("user").markdown(message["content"])
-            i += 1
-        elif message["role"] == "assistant":
-            # 创建助手消息容器
-            with st.chat_message("assistant"):
-                # 显示助手消息内容
-                st.markdown(message["content"])
-
-                # 检查下一个消息是否是工具调用信息
-                if (
-                    i + 1 < len(st.session_state.history)
-                    and st.session_state.history[i + 1]["role"] == "assistant_tool"
-                ):
-                    # 在同一个容器中显示工具调用信息
-                    with st.expander("工具调用信息", expanded=False):
-                        st.markdown(st.session_state.history[i + 1]["content"])
-                    i += 2  # 递增2，因为我们处理了两个消息
-                else:
-                    i += 1  # 递增1，因为我们只处理了一个常规消息
-        else:
-            # 跳过助手工具消息，因为它们已经在上面处理了
-            i += 1
+    entries = transcript_entries()
+    visible = st.session_state.get("history_visible", HISTORY_PAGE_SIZE)
+    hidden = max(0, len(entries) - visible)
+    if hidden:
+        st.button(
+            f"加载更早的消息（还有 {hidden} 条）",
+            key="load_older_messages",
+            on_click=show_older_messages,
+            use_container_width=True,
+        )
+
+    for index in range(hidden, len(entries)):
+        entry = entries[index]
+        if entry["role"] == "user":
+            st.chat_message("user").markdown(entry["content"])
+            continue
+
+        # 创建助手消息容器
+        with st.chat_message("assistant"):
+            st.markdown(entry["content"])
+            tool_calls = entry["tool_calls"]
+            if tool_calls:
+                # 工具调用信息只在打开开关后才渲染
+                label = f"工具调用信息（{len(tool_calls)}）"
+                if st.toggle(label, key=f"show_tools_{st.session_state.thread_id}_{index}"):
+                    if entry["tool_markdown"] is None:
+                        entry["tool_markdown"] = format_tool_calls(tool_calls)
+                    with st.container(border=True):
+                        st.markdown(entry["tool_markdown"])
+
+
+def format_tool_calls(tool_calls):
+    """
+    Formats assembled tool calls as markdown.
+
+    Args:
+        tool_calls: List of {"id", "name", "args", "result"} dicts
+
+    Returns:
+        str: Markdown with one block per tool call
+    """
+    parts = []
+    for tool_call in tool_calls:
+        parts.append(f"**{tool_call['name']}**")
+        parts.append("```json\n" + json.dumps(tool_call["args"], indent=2, ensure_ascii=False) + "\n```")
+        if tool_call.get("result") is not None:
+            parts.append("```\n" + tool_call["result"] + "\n```")
+    return "\n\n".join(parts)
 
 
 def get_streaming_callback(text_placeholder, tool_placeholder):
     """
-    Creates a streaming callback function.
+    Creates a streaming event handler.
 
-    This function creates a callback function to display responses generated from the LLM in real-time.
+    This function creates a handler that consumes the events yielded by astream_graph
+    (in combined "messages" + "updates" mode) and displays responses generated from the LLM in real-time.
     It displays text responses and tool call information in separate areas.
+    Tool call argument fragments are assembled per call, so the tool area is re-rendered
+    only when a call completes or receives its result.
 
     Args:
         text_placeholder: Streamlit component to display text responses
         tool_placeholder: Streamlit component to display tool call information
 
     Returns:
-        callback_func: Streaming callback function
+        callback_func: Event handler function
         accumulated_text: List to store accumulated text responses
-        accumulated_tool: List to store accumulated tool call information
+        tool_assembler: ToolCallAssembler holding the assembled tool calls
     """
+    utils = stream_utils()
     accumulated_text = []
-    accumulated_tool = []
-
-    def callback_func(message: dict):
-        nonlocal accumulated_text, accumulated_tool
-        message_content = message.get("content", None)
-
-        if isinstance(message_content, AIMessageChunk):
-            content = message_content.content
-            if (
-                hasattr(message_content, "tool_calls")
-                and message_content.tool_calls
-                and len(message_content.tool_calls[0]["name"]) > 0
-            ):
-                tool_call_info = message_content.tool_calls[0]
-                accumulated_tool.append("\n```json\n" + str(tool_call_info) + "\n```\n")
-                with tool_placeholder.expander(
-                    "工具调用信息", expanded=True
-                ):
-                    st.markdown("".join(accumulated_tool))
-            # 如果内容是字符串类型
-            elif isinstance(content, str):
-                accumulated_text.append(content)
-                text_placeholder.markdown("".join(accumulated_text))
-            # 如果存在无效的工具调用信息
-            elif (
-                hasattr(message_content, "invalid_tool_calls")
-                and message_content.invalid_tool_calls
-            ):
-                tool_call_info = message_content.invalid_tool_calls[0]
-                accumulated_tool.append("\n```json\n" + str(tool_call_info) + "\n```\n")
-                with tool_placeholder.expander(
-                    "工具调用信息 (无效)", expanded=True
-                ):
-                    st.markdown("".join(accumulated_tool))
-            # 如果tool_call_chunks属性存在
-            elif (
-                hasattr(message_content, "tool_call_chunks")
-                and message_content.tool_call_chunks
-            ):
-                tool_call_chunk = message_content.tool_call_chunks[0]
-                accumulated_tool.append(
-                    "\n```json\n" + str(tool_call_chunk) + "\n```\n"
-                )
-                with tool_placeholder.expander(
-                    "工具调用信息", expanded=True
-                ):
-                    st.markdown("".join(accumulated_tool))
-            # 如果tool_calls存在additional_kwargs中（支持各种模型兼容性）
-            elif (
-                hasattr(message_content, "additional_kwargs")
-                and "tool_calls" in message_content.additional_kwargs
-            ):
-                tool_call_info = message_content.additional_kwargs["tool_calls"][0]
-                accumulated_tool.append("\n```json\n" + str(tool_call_info) + "\n```\n")
-                with tool_placeholder.expander(
-                    "工具调用信息", expanded=True
-                ):
-                    st.markdown("".join(accumulated_tool))
-        # 如果消息是工具消息（工具响应）
-        elif isinstance(message_content, ToolMessage):
-            accumulated_tool.append(
-                "\n```json\n" + str(message_content.content) + "\n```\n"
-            )
+    tool_assembler = utils.ToolCallAssembler()
+
+    def callback_func(event):
+        if isinstance(event, utils.TokenEvent):
+            accumulated_text.append(event.text)
+            text_placeholder.markdown("".join(accumulated_text))
+        elif tool_assembler.feed(event):
             with tool_placeholder.expander("工具调用信息", expanded=True):
-                st.markdown("".join(accumulated_tool))
+                st.markdown(format_tool_calls(tool_assembler.to_list()))
+
+    return callback_func, accumulated_text, tool_assembler
+
+
+def trace_recorder():
+    """
+    Returns the conversation's trace recorder, or None when AGENT_TRACE_DIR is not set.
+
+    Model responses and tool I/O of every turn are appended to <AGENT_TRACE_DIR>/<thread_id>.jsonl,
+    which benchmarks/replay.py can replay offline.
+    """
+    trace_dir = os.getenv("AGENT_TRACE_DIR")
+    if not trace_dir:
         return None
-    return callback_func, accumulated_text, accumulated_tool
+    from trace_replay import TraceRecorder, trace_path
+
+    path = trace_path(st.session_state.thread_id, trace_dir)
+    recorder = st.session_state.get("trace_recorder")
+    if recorder is None or recorder.path != path:
+        recorder = st.session_state.trace_recorder = TraceRecorder(path)
+    return recorder
+
+
+def agent_config(query=None):
+    """
+    Builds the config passed to the agent for one turn.
+
+    Args:
+        query: The user's question; when tracing is enabled it starts a new turn in the trace
+
+    Returns:
+        dict: Recursion limit, thread/model selection and tracing metadata
+    """
+    config = {
+        "recursion_limit": st.session_state.recursion_limit,
+        "configurable": {
+            "thread_id": st.session_state.thread_id,
+            "model": st.session_state.selected_model,
+        },
+        # 提示词前缀哈希写入追踪元数据，前缀变化会导致DeepSeek上下文缓存失效
+        "metadata": {
+            "prompt_prefix_hash": st.session_state.get("prompt_prefix_hash"),
+        },
+    }
+    recorder = trace_recorder() if query is not None else None
+    if recorder is not None:
+        recorder.start_turn(
+            query, get_mcp_runtime().tools, st.session_state.get("prompt_prefix_hash"), config
+        )
+        config["callbacks"] = [recorder]
+    return config
 
 
 async def process_query(query, text_placeholder, tool_placeholder, timeout_seconds=60):
@@ -464,6 +662,10 @@ async def process_query(query, text_placeholder, tool_placeholder, timeout_secon
     This function passes the user's question to the agent and streams the response in real-time.
     Returns a timeout error if the response is not completed within the specified time.
 
+    The turn first takes a slot from the admission controller's "turns" gate. While the gate is
+    full the user sees their queue position; when the queue is full (or the wait exceeds
+    ADMISSION_MAX_WAIT) the turn is rejected immediately instead of timing out with everyone else.
+
     Args:
         query: Text of the question entered by the user
         text_placeholder: Streamlit component to display text responses
@@ -473,87 +675,261 @@ async def process_query(query, text_placeholder, tool_placeholder, timeout_secon
     Returns:
         response: Agent's response object
         final_text: Final text response
-        final_tool: Final tool call information
+        final_tool: Final tool call information (list of assembled tool calls)
     """
     try:
         if st.session_state.agent:
-            streaming_callback, accumulated_text_obj, accumulated_tool_obj = (
+            streaming_callback, accumulated_text_obj, tool_assembler = (
                 get_streaming_callback(text_placeholder, tool_placeholder)
             )
+
+            utils = stream_utils()
+            from usage_tracker import get_tracker, turn_usage, usage_callback
+
+            # 本轮所有模型调用（含被丢弃的升级前调用）和工具调用的结果，超时或出错时同样计入用量
+            usage_recorder = usage_callback()
+            config = agent_config(query)
+            config["callbacks"] = [*config.get("callbacks", []), usage_recorder]
+
+            async def consume_events():
+                done = None
+                async for event in utils.astream_graph(
+                    st.session_state.agent,
+                    {"messages": [human_message(query)]},
+                    config=config,
+                    stream_mode=["messages", "updates"],
+                ):
+                    if isinstance(event, utils.DoneEvent):
+                        done = event
+                    streaming_callback(event)
+                return done
+
+            def record_usage(seconds):
+                # 本轮所有模型调用的token用量（含DeepSeek缓存命中的token数）、工具输出token数和费用
+                model = st.session_state.selected_model
+                usage = turn_usage(usage_recorder.messages, model)
+                get_tracker().record(st.session_state.thread_id, usage, model, seconds)
+                st.session_state.last_turn_usage = usage
+                return usage
+
+            from admission import AdmissionRejected, turn_gate
+
+            def show_queue_position(position):
+                text_placeholder.markdown(f"⏳ 当前请求较多，正在排队（第 {position} 位）...")
+
             try:
-                response = await asyncio.wait_for(
-                    astream_graph(
-                        st.session_state.agent,
-                        {"messages": [HumanMessage(content=query)]},
-                        callback=streaming_callback,
-                        config=RunnableConfig(
-                            recursion_limit=st.session_state.recursion_limit,
-                            thread_id=st.session_state.thread_id,
-                        ),
-                    ),
-                    timeout=timeout_seconds,
-                )
+                async with turn_gate().slot(on_queue=show_queue_position):
+                    text_placeholder.empty()
+                    started = time.monotonic()
+                    try:
+                        done = await asyncio.wait_for(consume_events(), timeout=timeout_seconds)
+                    finally:
+                        usage = record_usage(time.monotonic() - started)
+            except AdmissionRejected as e:
+                error_msg = f"系统繁忙（{e.reason}）. 请稍后再试."
+                return {"error": error_msg}, error_msg, []
             except asyncio.TimeoutError:
                 error_msg = f"请求时间超过 {timeout_seconds} 秒. 请稍后再试."
-                return {"error": error_msg}, error_msg, ""
+                return {"error": error_msg}, error_msg, []
 
+            response = {"node": done.node, "content": done.content, "usage": usage}
             final_text = "".join(accumulated_text_obj)
-            final_tool = "".join(accumulated_tool_obj)
+            final_tool = tool_assembler.to_list()
             return response, final_text, final_tool
         else:
             return (
                 {"error": "🚫 代理未初始化."},
                 "🚫 代理未初始化.",
-                "",
+                [],
             )
     except Exception as e:
         import traceback
 
         error_msg = f"❌ 查询处理时发生错误: {str(e)}\n{traceback.format_exc()}"
-        return {"error": error_msg}, error_msg, ""
+        return {"error": error_msg}, error_msg, []
+
+
+def submit_job(query):
+    """
+    Submits a question to the background job queue and attaches the page to the job.
+
+    Args:
+        query: Text of the question entered by the user
+    """
+    job_id = get_job_queue().submit(
+        st.session_state.agent,
+        query,
+        agent_config(query),
+        inputs={"messages": [human_message(query)]},
+    )
+    attach_job(job_id)
+
+
+def attach_job(job_id):
+    """
+    Attaches the page to a background job; its progress is shown until it finishes.
+
+    The job id is also kept in the URL, so reloading the page re-attaches to the job.
+
+    Args:
+        job_id: Id returned by JobQueue.submit
+    """
+    st.session_state.active_job = job_id
+    st.session_state.job_view = None
+    st.query_params["job"] = job_id
+
+
+def detach_job():
+    """Stops showing the active background job (the job itself keeps running)."""
+    st.session_state.pop("active_job", None)
+    st.session_state.pop("job_view", None)
+    st.query_params.pop("job", None)
+
+
+def record_job(job):
+    """
+    Appends a finished job's question and answer to the chat history (once per job).
+
+    A job started in another conversation (e.g. re-attached after a page reload, which starts a
+    new session and thread_id, or submitted before the conversation was reset) ran against that
+    conversation's memory, not this one. Its answer is shown read-only instead of being added to
+    the history, so the history never claims context the agent does not have.
+
+    Args:
+        job: Job dict from the job store
+    """
+    recorded = st.session_state.setdefault("recorded_jobs", set())
+    if job["id"] in recorded:
+        return
+    recorded.add(job["id"])
+    if job["status"] != "succeeded":
+        return
+    if job["thread_id"] != st.session_state.thread_id:
+        st.session_state.setdefault("reattached_jobs", []).append(job)
+        return
+    result = job["result"]
+    items = [
+        {"role": "user", "content": job["query"]},
+        {"role": "assistant", "content": result["text"], "usage": result.get("usage")},
+    ]
+    if result["tool_calls"]:
+        items.append({"role": "assistant_tool", "tool_calls": result["tool_calls"]})
+    append_history(*items)
+    st.session_state.last_turn_usage = result.get("usage")
+
+
+def show_reattached_jobs():
+    """Shows the read-only answers of finished jobs that belong to another conversation."""
+    for job in st.session_state.get("reattached_jobs", []):
+        result = job["result"]
+        st.chat_message("user").markdown(job["query"])
+        with st.chat_message("assistant"):
+            if result["tool_calls"]:
+                with st.expander("工具调用信息", expanded=False):
+                    st.markdown(format_tool_calls(result["tool_calls"]))
+            st.markdown(result["text"])
+            st.caption(f"后台任务 `{job['id']}` 属于另一个对话，结果仅供查看，未加入当前对话的上下文")
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_active_job():
+    """
+    Shows the progress of the attached background job.
+
+    Runs as a fragment that re-executes every JOB_POLL_INTERVAL seconds and only reads the events
+    stored since the previous run, so the rest of the page stays responsive while the job runs.
+    When the job finishes, its answer is moved into the chat history.
+    """
+    from job_queue import FINISHED, replay_events
+
+    job_queue = get_job_queue()
+    job_id = st.session_state.active_job
+    job = job_queue.get(job_id)
+    if job is None:
+        st.warning(f"后台任务 {job_id} 不存在或已被清理.")
+        detach_job()
+        return
+
+    view = st.session_state.get("job_view")
+    view = replay_events(job_queue.events(job_id, view["seq"] if view else 0), view)
+    st.session_state.job_view = view
+
+    if job["status"] in FINISHED:
+        record_job(job)
+        detach_job()
+        if job["status"] != "succeeded":
+            st.session_state.job_error = f"后台任务{job['status']}: {job['error']}"
+        st.rerun(scope="app")
+
+    st.chat_message("user").markdown(job["query"])
+    with st.chat_message("assistant"):
+        if view["tool_calls"]:
+            with st.expander("工具调用信息", expanded=True):
+                st.markdown(format_tool_calls(view["tool_calls"]))
+        st.markdown(view["text"] or "…")
+        status_text = "排队中" if job["status"] == "queued" else "执行中"
+        col1, col2 = st.columns([8, 2])
+        col1.caption(f"后台任务 `{job_id}` {status_text}，关闭页面后任务会继续执行，可通过当前链接重新查看")
+        if col2.button("取消任务", key=f"cancel_job_{job_id}", use_container_width=True):
+            job_queue.cancel(job_id)
+
+
+def build_agent(runtime):
+    """
+    Builds the agent from the runtime's current tool registry.
+
+    The checkpointer is created once per session and reused, so rebuilding the agent after a
+    configuration change keeps the conversation memory.
+
+    Args:
+        runtime: McpRuntime providing the tools
+    """
+    # 工具按名称排序，提示词前缀（系统提示词 + 工具定义）在每次初始化时保持一致
+    tools = runtime.tools
+    st.session_state.tool_count = len(tools)
+
+    if "checkpointer" not in st.session_state:
+        st.session_state.checkpointer = checkpointer_class()()
+
+    from prompt_cache import prefix_hash
+
+    st.session_state.prompt_prefix_hash = prefix_hash(SYSTEM_PROMPT, tools)
+    st.session_state.agent = react_agent_factory()(
+        get_chat_model(st.session_state.selected_model),
+        tools,
+        checkpointer=st.session_state.checkpointer,
+        prompt=get_system_prompt(),
+    )
+    st.session_state.tools_version = runtime.version
 
 
 async def initialize_session(mcp_config=None):
     """
     Initializes MCP session and agent.
 
+    The configuration is reconciled against the running servers: only added, removed or changed
+    servers are started or stopped, then the agent is rebuilt with the new tool registry.
+
     Args:
-        mcp_config: MCP tool configuration information (JSON). Uses default settings if None
+        mcp_config: MCP tool configuration, either raw settings (JSON) or specs already parsed
+            by config_schema.parse_config. Uses the settings in config.json if None
 
     Returns:
         bool: Initialization success status
     """
     try:
         with st.spinner("连接到MCP服务器..."):
-            # 首先安全地清理现有的客户端
-            await cleanup_mcp_client()
-
             if mcp_config is None:
                 # 从config.json文件加载设置
                 mcp_config = load_config_from_json()
-            
-            # 使用新的API方式创建客户端
-            client = MultiServerMCPClient(mcp_config)
-            
-            # 方法1: 直接获取工具
-            tools = await client.get_tools()
-            st.session_state.tool_count = len(tools)
-            st.session_state.mcp_client = client
 
-            # 根据选择初始化适当的模型
-            selected_model = st.session_state.selected_model
+            runtime = get_mcp_runtime()
+            result = await runtime.areconcile(mcp_config)
+            st.session_state.last_reconcile = result.to_dict()
+            for server_name, error in result.errors.items():
+                st.warning(f"MCP服务器 {server_name} 启动失败: {error}")
 
-            model = ChatDeepSeek(
-                model=selected_model,
-                temperature=0.1,
-            )
-            agent = create_react_agent(
-                model,
-                tools,
-                checkpointer=MemorySaver(),
-                prompt=SYSTEM_PROMPT,
-            )
-            st.session_state.agent = agent
+            build_agent(runtime)
             st.session_state.session_initialized = True
             return True
             
@@ -573,16 +949,9 @@ with st.sidebar:
 
     # MCP 工具添加界面
     with st.expander("添加 MCP 工具", expanded=st.session_state.mcp_tools_expander):
-        # 从config.json文件加载设置
-        loaded_config = load_config_from_json()
-        default_config_text = json.dumps(loaded_config, indent=2, ensure_ascii=False)
-        
-        # 根据现有的mcp_config_text创建pending config
+        # 从config.json文件加载设置，创建pending config
         if "pending_mcp_config" not in st.session_state:
-            try:
-                st.session_state.pending_mcp_config = loaded_config
-            except Exception as e:
-                st.error(f"Failed to set initial pending config: {e}")
+            sync_config_from_disk()
 
         # 添加单个工具的UI
         st.markdown("**添加新工具**")
@@ -634,44 +1003,35 @@ with st.sidebar:
                     if len(parsed_tool) == 0:
                         st.error("Please enter at least one tool.")
                     else:
+                        from config_schema import ConfigError, parse_server
+
                         # 处理所有工具
                         success_tools = []
                         for tool_name, tool_config in parsed_tool.items():
                             # 检查URL字段并设置transport
-                            if "url" in tool_config:
-                                # 如果URL存在，则设置transport为"sse"
+                            if isinstance(tool_config, dict) and "url" in tool_config and "transport" not in tool_config:
+                                # 如果URL存在且transport未指定，则设置transport为"sse"
                                 tool_config["transport"] = "sse"
                                 st.info(
                                     f"URL detected in '{tool_name}' tool, setting transport to 'sse'."
                                 )
-                            elif "transport" not in tool_config:
+                            elif isinstance(tool_config, dict) and "transport" not in tool_config:
                                 # 如果URL不存在且transport未指定，则设置默认值"stdio"
                                 tool_config["transport"] = "stdio"
 
-                            # 检查必需字段
-                            if (
-                                "command" not in tool_config
-                                and "url" not in tool_config
-                            ):
-                                st.error(
-                                    f"'{tool_name}' tool configuration requires either 'command' or 'url' field."
-                                )
-                            elif "command" in tool_config and "args" not in tool_config:
-                                st.error(
-                                    f"'{tool_name}' tool configuration requires 'args' field."
-                                )
-                            elif "command" in tool_config and not isinstance(
-                                tool_config["args"], list
-                            ):
-                                st.error(
-                                    f"'args' field in '{tool_name}' tool must be an array ([]) format."
-                                )
+                            # 按与运行时相同的规则校验配置
+                            try:
+                                parse_server(tool_name, tool_config)
+                            except ConfigError as e:
+                                st.error(f"'{tool_name}' 工具配置无效: {e}")
                             else:
                                 # 将工具添加到pending_mcp_config
                                 st.session_state.pending_mcp_config[tool_name] = (
                                     tool_config
                                 )
                                 success_tools.append(tool_name)
+                        if success_tools:
+                            set_pending_config(st.session_state.pending_mcp_config)
 
                         # 成功消息
                         if success_tools:
@@ -706,6 +1066,7 @@ with st.sidebar:
     with st.expander("已注册的MCP服务器", expanded=True):
         try:
             pending_config = st.session_state.pending_mcp_config
+            pending_specs = st.session_state.pending_specs
         except Exception as e:
             st.error("不是一个有效的MCP工具配置.")
         else:
@@ -799,76 +1160,39 @@ with st.sidebar:
             if not pending_config:
                 st.info("当前系统中没有已注册的MCP服务器。请通过上方的'添加MCP工具'功能添加您需要的MCP服务器配置，然后点击'应用设置'按钮来激活这些工具。MCP服务器将为您的智能代理提供各种专业功能，如文件操作、网络请求、数据处理等能力。")
             else:
-                # 获取已初始化的工具详情
-                available_tools = []
-                if st.session_state.session_initialized and st.session_state.mcp_client:
-                    try:
-                        tools = st.session_state.event_loop.run_until_complete(
-                            st.session_state.mcp_client.get_tools()
-                        )
-                        available_tools = [tool.name for tool in tools]
-                    except Exception as e:
-                        st.error(f"获取工具列表失败: {str(e)}")
+                # 获取已初始化的工具详情（来自MCP运行时的工具注册表，不会重新连接服务器）
+                runtime_tools = {}
+                runtime_errors = {}
+                runtime_health = {}
+                if st.session_state.session_initialized:
+                    runtime = get_mcp_runtime()
+                    runtime_tools = runtime.server_tools()
+                    runtime_snapshot = runtime.snapshot()
+                    runtime_errors = runtime_snapshot["errors"]
+                    runtime_health = runtime_snapshot["health"]
                 
                 # 遍历pending config中的键（MCP服务器名称）
                 for i, server_name in enumerate(list(pending_config.keys())):
-                    # 获取服务器配置
-                    server_config = pending_config[server_name]
                     description = tool_descriptions.get(server_name, f"{server_name} MCP服务器 - 这是一个Model Context Protocol工具服务器，为系统提供特定功能和工具集成能力")
                     
-                    # 服务器配置预览
-                    config_info = []
-                    if "command" in server_config:
-                        config_info.append(f"命令: {server_config['command']}")
-                    if "transport" in server_config:
-                        config_info.append(f"传输: {server_config['transport']}")
-                    if "url" in server_config:
-                        config_info.append(f"URL: {server_config['url']}")
+                    # 服务器配置预览（来自解析后的服务器配置）
+                    spec = pending_specs.servers.get(server_name)
+                    config_error = pending_specs.errors.get(server_name)
                     
-                    # 获取此服务器提供的工具 - 改进匹配逻辑
-                    server_tools = []
-                    if available_tools:
-                        # 动态获取实际工具列表而不是使用硬编码
-                        # 根据工具名称模式智能分组
-                        def get_tools_for_server(server_name, all_tools):
-                            """根据服务器名称和工具特征智能分组工具"""
-                            tools_list = []
-                            
-                            # 基于服务器名称的工具模式匹配
-                            patterns = {
-                                "amap_geocoding": ["geocoding", "reverse_geocoding", "poi_search", "weather_query", "route_planning", "distance_calculation"],
-                                "get_current_time": ["get_current_time"],
-                                "github": lambda name: "github" in name.lower() or any(keyword in name.lower() for keyword in ["repo", "issue", "pull", "commit", "branch"]),
-                                "filesystem": lambda name: any(keyword in name.lower() for keyword in ["read_file", "write_file", "list_directory", "create_directory", "delete_file", "get_file", "search_files"]),
-                                "shell": lambda name: any(keyword in name.lower() for keyword in ["shell", "command", "exec", "run"]),
-                                "context7": lambda name: any(keyword in name.lower() for keyword in ["resolve", "get-library", "library"]),
-                                "edgeone-pages-mcp-server": lambda name: any(keyword in name.lower() for keyword in ["deploy", "edge", "pages"]),
-                                "browser-tools-mcp": lambda name: any(keyword in name.lower() for keyword in ["browser", "navigate", "click", "screenshot"]),
-                                "sequential-thinking": lambda name: any(keyword in name.lower() for keyword in ["thinking", "sequential"]),
-                            }
-                            
-                            if server_name in patterns:
-                                pattern = patterns[server_name]
-                                if isinstance(pattern, list):
-                                    # 精确匹配列表
-                                    tools_list = [tool for tool in all_tools if tool in pattern]
-                                elif callable(pattern):
-                                    # 使用函数匹配
-                                    tools_list = [tool for tool in all_tools if pattern(tool)]
-                            
-                            return tools_list
-                        
-                        # 使用新的智能分组函数
-                        server_tools = get_tools_for_server(server_name, available_tools)
-                    
-                    # 如果仍然没有找到工具，显示空列表而不是所有工具
-                    # 这避免了将所有86个工具分配给每个服务器的问题
-                    if not server_tools:
-                        server_tools = []
+                    # 此服务器提供的工具
+                    tools = runtime_tools.get(server_name, [])
+                    server_tools = [tool.name for tool in tools]
                     
                     # 创建状态标识
                     status_color = "#28a745" if st.session_state.session_initialized else "#6c757d"
-                    if st.session_state.session_initialized and server_tools:
+                    health = runtime_health.get(server_name, {})
+                    if config_error:
+                        status_text = "配置无效"
+                    elif health.get("state") == "restarting":
+                        status_text = "重启中"
+                    elif server_name in runtime_errors:
+                        status_text = "启动失败"
+                    elif st.session_state.session_initialized and server_tools:
                         status_text = f"已激活 • {len(server_tools)}个工具"
                     elif st.session_state.session_initialized:
                         status_text = "已激活"
@@ -884,8 +1208,17 @@ with st.sidebar:
                         st.markdown(f'<p style="color: #666; font-size: 0.9em; margin-top: -10px; margin-bottom: 8px;">{description}</p>', unsafe_allow_html=True)
                         
                         # 配置信息
-                        if config_info:
-                            st.markdown(f'<p style="color: #888; font-size: 0.8em; margin-top: -5px; margin-bottom: 8px;">{" | ".join(config_info)}</p>', unsafe_allow_html=True)
+                        if spec is not None:
+                            st.markdown(f'<p style="color: #888; font-size: 0.8em; margin-top: -5px; margin-bottom: 8px;">{spec.preview}</p>', unsafe_allow_html=True)
+
+                        if config_error:
+                            st.caption(f"配置错误: {config_error}")
+                        elif server_name in runtime_errors:
+                            st.caption(f"错误: {runtime_errors[server_name]}")
+                        if health.get("restarts") or health.get("failovers"):
+                            st.caption(
+                                f"自动重启 {health['restarts']} 次，切换备用进程 {health['failovers']} 次"
+                            )
                         
                         # 工具列表 - 使用真实的工具描述
                         if server_tools and st.session_state.session_initialized:
@@ -917,16 +1250,15 @@ with st.sidebar:
                         if st.button("删除", key=f"delete_{server_name}", type="secondary", use_container_width=True):
                             # 从pending config中删除服务器并立即保存
                             del st.session_state.pending_mcp_config[server_name]
+                            set_pending_config(st.session_state.pending_mcp_config)
                             
                             # 立即保存到配置文件
                             save_result = save_config_to_json(st.session_state.pending_mcp_config)
                             if save_result:
                                 st.success(f"{server_name} 服务器已成功删除并保存!")
-                                # 重新初始化会话以应用更改
-                                st.session_state.session_initialized = False
-                                st.session_state.agent = None
+                                # 只停止被删除的服务器，其余服务器保持运行
                                 success = st.session_state.event_loop.run_until_complete(
-                                    initialize_session(st.session_state.pending_mcp_config)
+                                    initialize_session(st.session_state.pending_specs)
                                 )
                                 if success:
                                     st.success("设置已自动重新应用!")
@@ -952,6 +1284,38 @@ with st.sidebar:
     **可用工具**: {tool_count}个
     """)
 
+    # 当前对话的累计token用量和费用
+    from usage_tracker import get_tracker, load_pricing
+
+    usage_tracker = get_tracker()
+    thread_usage = usage_tracker.thread_summary(st.session_state.thread_id)
+    if thread_usage["turns"]:
+        currency = load_pricing().get("currency", "")
+        with st.expander(f"Token用量（{thread_usage['turns']}轮，{thread_usage['cost']:.4f} {currency}）"):
+            col_in, col_out = st.columns(2)
+            col_in.metric("输入token", thread_usage["input_tokens"])
+            col_out.metric("输出token", thread_usage["output_tokens"])
+            col_cache, col_context = st.columns(2)
+            col_cache.metric("缓存命中", thread_usage["cache_read_tokens"])
+            col_context.metric("当前上下文", thread_usage["context_tokens"])
+            st.caption(
+                f"模型调用 {thread_usage['calls']} 次，工具调用 {thread_usage['tool_calls']} 次，"
+                f"工具输出约 {thread_usage['tool_output_tokens']} tokens"
+            )
+            if thread_usage["tools"]:
+                st.caption(
+                    "工具输出token（估算）: "
+                    + "，".join(f"{name} {tokens}" for name, tokens in list(thread_usage["tools"].items())[:5])
+                )
+            last_turn = usage_tracker.turns(st.session_state.thread_id, limit=1)[0]
+            st.caption(
+                f"上一轮: 输入 {last_turn['input_tokens']}，输出 {last_turn['output_tokens']}，"
+                f"{last_turn['cost']:.4f} {currency}"
+            )
+        context_alert = usage_tracker.alert(st.session_state.thread_id)
+        if context_alert:
+            st.warning(context_alert)
+
     # 应用设置按钮 - 根据初始化状态显示不同文本
     button_text = "重新应用设置" if st.session_state.session_initialized else "应用设置"
     if st.button(
@@ -966,11 +1330,6 @@ with st.sidebar:
             st.warning("正在应用配置更改，重新初始化MCP服务器连接，请稍候等待完成...")
             progress_bar = st.progress(0)
 
-            # 保存设置
-            st.session_state.mcp_config_text = json.dumps(
-                st.session_state.pending_mcp_config, indent=2, ensure_ascii=False
-            )
-
             # 将设置保存到config.json文件
             save_result = save_config_to_json(st.session_state.pending_mcp_config)
             if not save_result:
@@ -978,16 +1337,13 @@ with st.sidebar:
             
             progress_bar.progress(15)
 
-            # 准备会话初始化
-            st.session_state.session_initialized = False
-            st.session_state.agent = None
-
+            # 与正在运行的服务器比较，只启动/停止/重启有变化的服务器
             # 更新进度
             progress_bar.progress(30)
 
             # 运行初始化
             success = st.session_state.event_loop.run_until_complete(
-                initialize_session(st.session_state.pending_mcp_config)
+                initialize_session(st.session_state.pending_specs)
             )
 
             # 更新进度
@@ -1005,17 +1361,61 @@ with st.sidebar:
         st.rerun()
 
     st.markdown("---")
-    
+
+    # 模型选择：每次调用时通过config传给代理，切换模型无需重新初始化
+    st.markdown("### 模型设置")
+    available_models = os.getenv("DEEPSEEK_MODELS", "deepseek-chat,deepseek-reasoner").split(",")
+    available_models = [name.strip() for name in available_models if name.strip()]
+    if st.session_state.selected_model not in available_models:
+        available_models.insert(0, st.session_state.selected_model)
+    st.session_state.selected_model = st.selectbox(
+        "对话模型",
+        available_models,
+        index=available_models.index(st.session_state.selected_model),
+        help="切换后从下一条消息开始生效，不会重新连接MCP服务器",
+    )
+
+    st.markdown("---")
+
+    # 后台任务：问题提交后在后台执行，不受单轮超时限制，关闭页面后继续运行
+    st.markdown("### 后台任务")
+    st.toggle(
+        "后台任务模式",
+        key="background_jobs",
+        help="开启后问题作为后台任务提交，页面按间隔读取进度；适合需要多次调用工具的耗时任务",
+    )
+    if st.session_state.background_jobs or st.session_state.get("active_job"):
+        recent_jobs = get_job_queue().store.recent(5, thread_id=st.session_state.thread_id)
+        status_labels = {
+            "queued": "排队中",
+            "running": "执行中",
+            "succeeded": "已完成",
+            "failed": "失败",
+            "cancelled": "已取消",
+            "interrupted": "已中断",
+        }
+        for job in recent_jobs:
+            col1, col2 = st.columns([7, 3])
+            col1.caption(f"{status_labels.get(job['status'], job['status'])} · {job['query'][:20]}")
+            if job["status"] in ("queued", "running") and job["id"] != st.session_state.get("active_job"):
+                col2.button("查看", key=f"attach_job_{job['id']}", on_click=attach_job, args=(job["id"],))
+
+    st.markdown("---")
+
     # 操作按钮部分
     st.markdown("### 快捷操作")
 
     # 重置对话按钮
     if st.button("重置对话", use_container_width=True, type="primary"):
-        # 重置thread_id
-        st.session_state.thread_id = random_uuid()
+        # 释放旧对话的记忆（后台任务仍在使用时保留），然后重置thread_id
+        if "checkpointer" in st.session_state and not st.session_state.get("active_job"):
+            st.session_state.checkpointer.delete_thread(st.session_state.thread_id)
+        st.session_state.thread_id = str(uuid.uuid4())
 
         # 重置对话历史
-        st.session_state.history = []
+        replace_history()
+        st.session_state.pop("history_visible", None)
+        st.session_state.pop("reattached_jobs", None)
 
         # 通知消息
         st.success("对话已重置")
@@ -1049,19 +1449,61 @@ with st.sidebar:
             st.write(f"初始化: {'已完成' if st.session_state.session_initialized else '进行中'}")
             st.write(f"会话ID: `{st.session_state.get('thread_id', 'N/A')}`")
             st.write(f"连接: {'在线' if st.session_state.session_initialized else '离线'}")
-
+            st.write(f"提示词前缀哈希: `{st.session_state.get('prompt_prefix_hash', 'N/A')}`")
+            if st.session_state.get("last_turn_usage"):
+                usage = st.session_state.last_turn_usage
+                st.write(
+                    f"上一轮token: 输入 {usage['input_tokens']}（缓存命中 {usage['cache_read_tokens']}）"
+                    f"，输出 {usage['output_tokens']}"
+                )
+            if "route_stats" in st.session_state:
+                st.write("**模型路由统计**:")
+                st.json(st.session_state.route_stats.snapshot())
+            from admission import controller
+
+            st.write("**准入控制**:")
+            st.json(controller.snapshot())
+            from tool_output_guard import stats as output_stats
+
+            if "checkpointer" in st.session_state:
+                st.write("**对话记忆（去重后）**:")
+                st.json(st.session_state.checkpointer.snapshot())
+            st.write("**工具输出截断**:")
+            st.json(output_stats.snapshot())
+            st.write("**费用最高的对话**:")
+            st.json(usage_tracker.top_threads(5))
+
+
+# --- 配置热更新 ---
+# config.json被修改（或其他会话应用了新设置）后，运行时会在后台同步服务器并替换工具注册表；
+# 这里发现版本变化时用新工具重建代理，对话记忆（checkpointer）保持不变。
+# 侧边栏中有尚未应用的修改时不覆盖，只提示磁盘上的配置已变化
+if st.session_state.session_initialized:
+    runtime = get_mcp_runtime()
+    if runtime.version != st.session_state.get("tools_version"):
+        if st.session_state.get("pending_mcp_config") == st.session_state.get("applied_mcp_config"):
+            sync_config_from_disk()
+        else:
+            st.session_state.config_changed_on_disk = True
+        build_agent(runtime)
+    if st.session_state.get("config_changed_on_disk"):
+        col1, col2 = st.columns([8, 2])
+        col1.warning(
+            "config.json已被修改（或其他会话应用了新设置）并已生效。侧边栏中尚未应用的修改已保留，"
+            "点击'应用设置'会用侧边栏中的配置覆盖磁盘上的修改。"
+        )
+        col2.button("载入磁盘配置", key="reload_config_from_disk", on_click=sync_config_from_disk)
 
 # --- Initialize default session (if not initialized) ---
 if not st.session_state.session_initialized:
     with st.spinner("正在初始化MCP服务器和代理..."):
         # 自动加载配置并初始化
-        loaded_config = load_config_from_json()
         if "pending_mcp_config" not in st.session_state:
-            st.session_state.pending_mcp_config = loaded_config
+            sync_config_from_disk()
         
-        # 自动运行初始化
+        # 自动运行初始化（使用已解析的服务器配置）
         success = st.session_state.event_loop.run_until_complete(
-            initialize_session(st.session_state.pending_mcp_config)
+            initialize_session(st.session_state.pending_specs)
         )
         
         if success:
@@ -1074,10 +1516,25 @@ if not st.session_state.session_initialized:
 # --- 打印对话历史 ---
 print_message()
 
+# --- 后台任务进度 ---
+# 页面重新加载时根据链接中的任务ID重新连接到任务
+if "active_job" not in st.session_state and st.query_params.get("job"):
+    attach_job(st.query_params["job"])
+show_reattached_jobs()
+if st.session_state.get("job_error"):
+    st.error(st.session_state.pop("job_error"))
+if st.session_state.get("active_job"):
+    show_active_job()
+
 # --- 用户输入和处理 ---
 user_query = st.chat_input("输入您的问题")
 if user_query:
-    if st.session_state.session_initialized:
+    if st.session_state.get("active_job"):
+        st.warning("后台任务仍在执行，请等待完成或取消后再提问。")
+    elif st.session_state.session_initialized and st.session_state.background_jobs:
+        submit_job(user_query)
+        st.rerun()
+    elif st.session_state.session_initialized:
         st.chat_message("user").markdown(user_query)
         with st.chat_message("assistant"):
             tool_placeholder = st.empty()
@@ -1095,15 +1552,18 @@ if user_query:
         if "error" in resp:
             st.error(resp["error"])
         else:
-            st.session_state.history.append({"role": "user", "content": user_query})
-            st.session_state.history.append(
-                {"role": "assistant", "content": final_text}
-            )
-            if final_tool.strip():
-                st.session_state.history.append(
-                    {"role": "assistant_tool", "content": final_tool}
-                )
-            st.rerun()
+            items = [
+                {"role": "user", "content": user_query},
+                {"role": "assistant", "content": final_text, "usage": resp.get("usage")},
+            ]
+            if final_tool:
+                items.append({"role": "assistant_tool", "tool_calls": final_tool})
+            append_history(*items)
+            context_alert = usage_tracker.alert(st.session_state.thread_id)
+            if context_alert:
+                st.warning(context_alert)
+            # 本轮消息已经在页面上流式显示，无需立即重新运行脚本重绘整个对话；
+            # 下次交互时它们会由print_message()从历史中渲染
     else:
         st.warning(
             "系统正在初始化MCP服务器连接和智能代理，请稍候等待初始化完成。初始化过程包括连接各个MCP服务器、加载工具列表、配置代理模型等步骤..."
@@ -0,0 +1,191 @@
+"""
+基于录制trace的回放基准
+
+设置 AGENT_TRACE_DIR 运行应用后，每个对话的模型输出和工具调用会录制到 <AGENT_TRACE_DIR>/<thread_id>.jsonl。
+本脚本不访问网络，用回放模型和回放工具按录制的对话逐轮执行代理，测量：
+
+- 每轮的总耗时、首个文本片段的时间（TTFT）和流式事件数（创建代理和导入模块的时间单独记为setup）
+- overhead: 总耗时减去录制时模型和工具调用耗时（乘以latency_scale）之后剩下的部分，
+  即图执行、流式事件转换、回调（以及--render时Streamlit渲染）本身的开销
+
+用法:
+    python benchmarks/replay.py traces/<thread_id>.jsonl                 # 不等待，只测量开销
+    python benchmarks/replay.py trace.jsonl --latency-scale 1            # 按录制时的耗时回放
+    python benchmarks/replay.py trace.jsonl --render --profile 20        # 包含渲染，输出cProfile前20项
+    python benchmarks/replay.py trace.jsonl --json > before.json
+    python benchmarks/replay.py trace.jsonl --baseline before.json       # 与之前的结果比较
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _renderer():
+    """与app.py中流式回调相同的渲染（Streamlit在无页面的bare模式下运行，只构建渲染消息）"""
+    import logging
+
+    import streamlit as st
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    text_placeholder, tool_placeholder = st.empty(), st.empty()
+
+    def render(text: str, tool_calls):
+        if tool_calls is not None:
+            with tool_placeholder.expander("工具调用信息", expanded=True):
+                st.markdown(json.dumps(tool_calls, ensure_ascii=False, indent=2))
+        else:
+            text_placeholder.markdown(text)
+
+    return render
+
+
+async def replay_turns(trace, latency_scale: float, render: bool) -> list:
+    """用新的回放代理执行trace中的每一轮，返回每轮的测量结果"""
+    import utils
+    from langchain_core.messages import HumanMessage
+    from trace_replay import build_replay_agent
+
+    agent = build_replay_agent(trace, latency_scale)
+    config = {"recursion_limit": 100, "configurable": {"thread_id": utils.random_uuid()}}
+    draw = _renderer() if render else None
+    results = []
+    for turn in trace.turns:
+        assembler = utils.ToolCallAssembler()
+        text, events, first = [], 0, None
+        start = time.perf_counter()
+        async for event in utils.astream_graph(
+            agent,
+            {"messages": [HumanMessage(content=turn["query"])]},
+            config=config,
+            stream_mode=["messages", "updates"],
+        ):
+            events += 1
+            if isinstance(event, utils.TokenEvent):
+                if first is None:
+                    first = time.perf_counter() - start
+                text.append(event.text)
+                if draw:
+                    draw("".join(text), None)
+            elif assembler.feed(event) and draw:
+                draw(None, assembler.to_list())
+        results.append({
+            "seconds": time.perf_counter() - start,
+            "ttft": first,
+            "events": events,
+            "tool_calls": len(assembler.to_list()),
+        })
+    return results
+
+
+def run_benchmark(path: str, runs: int, latency_scale: float, render: bool, profile: int = 0) -> dict:
+    from trace_replay import load_trace
+
+    trace = load_trace(path)
+    profiler = cProfile.Profile() if profile else None
+    walls, setups, turns = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        turn_results = asyncio.run(replay_turns(trace, latency_scale, render))
+        if profiler:
+            profiler.disable()
+        # 只统计各轮的执行时间；创建代理和首次导入模块的时间单独记为setup
+        wall = sum(turn["seconds"] for turn in turn_results)
+        walls.append(wall)
+        setups.append(time.perf_counter() - start - wall)
+        turns.append(turn_results)
+
+    wall = statistics.median(walls)
+    expected = trace.recorded_latency * latency_scale
+    result = {
+        "trace": os.path.basename(path),
+        "summary": trace.summary(),
+        "runs": runs,
+        "latency_scale": latency_scale,
+        "render": render,
+        "wall_s": round(wall, 4),
+        "setup_s": round(statistics.median(setups), 4),
+        "overhead_s": round(wall - expected, 4),
+        "turns": [
+            {
+                "seconds": round(statistics.median(run[index]["seconds"] for run in turns), 4),
+                "ttft": _median_or_none(run[index]["ttft"] for run in turns),
+                "events": turns[0][index]["events"],
+                "tool_calls": turns[0][index]["tool_calls"],
+            }
+            for index in range(len(trace.turns))
+        ],
+    }
+    if profiler:
+        stats = pstats.Stats(profiler).sort_stats("cumulative")
+        result["profile"] = [
+            {
+                "function": f"{func[0]}:{func[1]}({func[2]})",
+                "calls": values[1],
+                "cumulative_s": round(values[3], 4),
+            }
+            for func, values in sorted(stats.stats.items(), key=lambda item: -item[1][3])[:profile]
+        ]
+    return result
+
+
+def _median_or_none(values):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 4) if values else None
+
+
+def print_report(result: dict, baseline: dict = None):
+    summary = result["summary"]
+    print(
+        f"{result['trace']}: {summary['turns']}轮, 模型调用{summary['llm_calls']}次, 工具调用{summary['tool_calls']}次, "
+        f"录制耗时 {summary['recorded_latency']}s"
+    )
+    print(f"latency_scale={result['latency_scale']} render={result['render']} runs={result['runs']}")
+    line = f"总耗时 {result['wall_s']:.4f}s  开销 {result['overhead_s']:.4f}s  (setup {result['setup_s']:.4f}s)"
+    if baseline:
+        delta = result["overhead_s"] - baseline["overhead_s"]
+        ratio = f" ({delta / baseline['overhead_s']:+.1%})" if baseline["overhead_s"] else ""
+        line += f"  对比基线开销 {baseline['overhead_s']:.4f}s: {delta:+.4f}s{ratio}"
+    print(line)
+    for index, turn in enumerate(result["turns"], 1):
+        ttft = f"{turn['ttft']:.4f}s" if turn["ttft"] is not None else "-"
+        print(f"  第{index}轮: {turn['seconds']:.4f}s  TTFT {ttft}  事件 {turn['events']}  工具调用 {turn['tool_calls']}")
+    for item in result.get("profile", []):
+        print(f"  {item['cumulative_s']:>8.4f}s {item['calls']:>8} {item['function']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的对话并测量开销")
+    parser.add_argument("trace", help="trace文件（.jsonl或.jsonl.gz）")
+    parser.add_argument("--runs", type=int, default=3, help="回放次数，结果取中位数")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="录制耗时的缩放比例，0为不等待")
+    parser.add_argument("--render", action="store_true", help="包含Streamlit渲染的开销")
+    parser.add_argument("--profile", type=int, default=0, metavar="N", help="用cProfile分析并列出累计耗时前N的函数")
+    parser.add_argument("--baseline", help="之前用--json输出的结果，用于比较")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.trace, args.runs, args.latency_scale, args.render, args.profile)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+启动性能基准
+
+对每个进程分别测量冷启动耗时，并用 `python -X importtime` 统计导入开销最大的模块：
+
+- app: Streamlit前端，测量从进程启动到页面渲染出第一个元素的时间（time-to-first-render），
+  以及首次脚本执行完成的时间（使用空的MCP配置，不启动任何工具服务器）
+- amap / time: MCP服务器，通过stdio客户端启动，测量初始化握手、列出工具和第一次工具调用完成的时间
+  （time-to-first-tool-call）。高德服务调用不访问网络的amap_service_stats工具
+
+用法:
+    python benchmarks/startup.py                 # 每个进程运行3次，输出中位数
+    python benchmarks/startup.py --runs 5 --top 15
+    python benchmarks/startup.py --json          # 输出JSON，便于与历史结果比较
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# MCP服务器: 名称 -> (脚本, 第一次调用的工具, 参数)
+SERVERS = {
+    "amap": ("mcp_server_amap.py", "amap_service_stats", {}),
+    "time": ("mcp_server_time.py", "get_current_time", {}),
+}
+
+
+def parse_importtime(stderr: str, top: int = 10) -> dict:
+    """
+    解析 -X importtime 的输出
+
+    Returns:
+        dict: total_ms为顶层导入的累计耗时之和，top为累计耗时最大的顶层导入
+    """
+    roots = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # 表头
+        name = parts[2]
+        if name.startswith("  "):
+            continue  # 只统计顶层导入，子模块的耗时已包含在累计值中
+        roots.append((int(parts[1]) / 1000.0, name.strip()))
+    roots.sort(reverse=True)
+    return {
+        "total_ms": round(sum(ms for ms, _ in roots), 1),
+        "top": [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in roots[:top]],
+    }
+
+
+# ----- app 子进程 -----
+
+def _child_app():
+    """在子进程中运行：用AppTest执行一次app.py并报告渲染耗时（毫秒，相对于父进程启动子进程的时刻）"""
+    t0 = float(os.environ["STARTUP_BENCH_T0"])
+    marks = {}
+
+    from streamlit.delta_generator import DeltaGenerator
+    from streamlit.testing.v1 import AppTest
+
+    original_enqueue = DeltaGenerator._enqueue
+
+    def _enqueue(self, *args, **kwargs):
+        marks.setdefault("first_render_ms", (time.time() - t0) * 1000)
+        return original_enqueue(self, *args, **kwargs)
+
+    DeltaGenerator._enqueue = _enqueue
+
+    # 在临时目录中使用空配置运行，避免启动真实的MCP服务器
+    workdir = tempfile.mkdtemp(prefix="startup_bench_")
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        f.write("{}")
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    app.run()
+    marks["first_run_ms"] = (time.time() - t0) * 1000
+    marks["exceptions"] = len(app.exception)
+    print(json.dumps(marks))
+
+
+def measure_app(top: int) -> dict:
+    env = dict(os.environ, STARTUP_BENCH_T0=repr(time.time()))
+    env.setdefault("DEEPSEEK_API_KEY", "sk-startup-benchmark")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child-app"],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=ROOT,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"app基准子进程失败:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr, top)
+    return result
+
+
+# ----- MCP 服务器 -----
+
+async def _measure_server(script: str, tool: str, arguments: dict, errlog) -> dict:
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    env = dict(os.environ)
+    env.setdefault("AMAP_API_KEY", "startup-benchmark")
+    env.pop("AMAP_POI_STORE", None)
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=["-X", "importtime", os.path.join(ROOT, script)],
+        env=env,
+        cwd=ROOT,
+    )
+    t0 = time.perf_counter()
+    marks = {}
+    async with stdio_client(params, errlog=errlog) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            marks["initialize_ms"] = (time.perf_counter() - t0) * 1000
+            await session.list_tools()
+            marks["list_tools_ms"] = (time.perf_counter() - t0) * 1000
+            result = await session.call_tool(tool, arguments)
+            marks["first_tool_call_ms"] = (time.perf_counter() - t0) * 1000
+            marks["tool_error"] = bool(result.isError)
+    return marks
+
+
+def measure_server(name: str, top: int) -> dict:
+    script, tool, arguments = SERVERS[name]
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as errlog:
+        result = asyncio.run(_measure_server(script, tool, arguments, errlog))
+        errlog.seek(0)
+        result["imports"] = parse_importtime(errlog.read(), top)
+    return result
+
+
+# ----- 汇总 -----
+
+def _median_runs(runs: list) -> dict:
+    """数值指标取中位数，导入统计取耗时中位数所在的那一次"""
+    summary = {}
+    for field, value in runs[0].items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        summary[field] = round(statistics.median(run[field] for run in runs), 1)
+    by_total = sorted(runs, key=lambda run: run["imports"]["total_ms"])
+    summary["imports"] = by_total[len(by_total) // 2]["imports"]
+    summary["runs"] = len(runs)
+    return summary
+
+
+def run_benchmarks(processes, runs: int, top: int) -> dict:
+    results = {}
+    for name in processes:
+        samples = []
+        for _ in range(runs):
+            samples.append(measure_app(top) if name == "app" else measure_server(name, top))
+        results[name] = _median_runs(samples)
+    return results
+
+
+def print_report(results: dict):
+    for name, result in results.items():
+        print(f"== {name} (中位数, {result['runs']}次) ==")
+        for field, value in result.items():
+            if field.endswith("_ms"):
+                print(f"  {field:<20} {value:>9.1f} ms")
+        print(f"  {'import_total_ms':<20} {result['imports']['total_ms']:>9.1f} ms")
+        for item in result["imports"]["top"]:
+            print(f"    {item['cumulative_ms']:>9.1f} ms  {item['module']}")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量各进程的冷启动耗时")
+    parser.add_argument("processes", nargs="*", default=["app", *SERVERS], help="app / amap / time")
+    parser.add_argument("--runs", type=int, default=3, help="每个进程运行的次数")
+    parser.add_argument("--top", type=int, default=10, help="列出导入耗时最大的模块数")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+    parser.add_argument("--child-app", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_app:
+        _child_app()
+        return
+
+    results = run_benchmarks(args.processes, args.runs, args.top)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+对话记忆（checkpointer）中的消息去重
+
+MemorySaver每次保存检查点时把整个messages通道（到目前为止的全部消息）重新序列化一遍，
+长对话中早期的消息会在每个检查点中重复保存；同一工具用相同参数多次调用（如get_current_time、
+相同的poi_search）时，相同的工具结果也会重复保存。
+
+DedupSerializer把消息列表拆开，每条消息再拆成"消息外壳"（id、tool_call_id等）和内容（content）两部分，
+分别按内容的SHA-256保存在共享的BlobTable中，检查点中只保存这些哈希的引用：
+
+- 同一条消息在不同检查点之间只保存一份，检查点的大小与新增消息数成正比，而不是与对话长度成正比
+- 内容相同的工具结果（即使tool_call_id不同）只保存一份内容
+- 嵌套在其他数据中的消息列表同样替换为引用，例如create_react_agent为每个工具调用发送的Send
+  （__pregel_tasks写入）中携带的完整对话状态
+- 最近序列化过的消息对象按对象缓存引用，保存检查点时只序列化新增的消息
+
+DedupMemorySaver使用该序列化器，删除对话时清理不再被引用的数据；清理与保存检查点互斥，
+仍在运行的任务（如页面已经离开的后台任务）新写入的数据不会在被检查点引用之前被删除。
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.types import Send
+
+# 序列化结果中表示"消息引用列表"/"单条消息引用"的类型名
+MESSAGES_TYPE = "dedup_messages"
+MESSAGE_TYPE = "dedup_message"
+# 其中嵌套的消息被替换为引用的数据: 类型名为该前缀加上JsonPlusSerializer的类型名
+NESTED_PREFIX = "dedup+"
+# 嵌套数据中代替消息列表 / 单条消息的对象的键
+_MESSAGES_KEY = "__dedup_messages__"
+_MESSAGE_KEY = "__dedup_message__"
+# 查找嵌套消息的最大深度
+_MAX_DEPTH = 6
+
+# 按对象缓存的最近序列化过的消息数
+MESSAGE_CACHE_SIZE = 4096
+
+
+class BlobTable:
+    """按内容寻址的序列化数据表（线程安全）: 哈希 -> (类型, 数据)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, Tuple[str, bytes]] = {}
+        # 写入的总字节数（不去重），用于计算去重比例
+        self.logical_bytes = 0
+
+    def put(self, typed: Tuple[str, bytes]) -> str:
+        kind, data = typed
+        key = hashlib.sha256(kind.encode() + b"\0" + data).hexdigest()[:32]
+        with self._lock:
+            if key not in self._blobs:
+                self._blobs[key] = (kind, data)
+        return key
+
+    def count(self, size: int):
+        """记录一次引用的数据大小（不去重时需要写入的字节数）"""
+        with self._lock:
+            self.logical_bytes += size
+
+    def get(self, key: str) -> Tuple[str, bytes]:
+        return self._blobs[key]
+
+    def retain(self, keys: Iterable[str]):
+        """只保留keys中的数据"""
+        keep = set(keys)
+        with self._lock:
+            for key in [key for key in self._blobs if key not in keep]:
+                del self._blobs[key]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stored = sum(len(data) for _, data in self._blobs.values())
+            return {"blobs": len(self._blobs), "stored_bytes": stored, "logical_bytes": self.logical_bytes}
+
+
+class DedupSerializer(JsonPlusSerializer):
+    """
+    消息列表按内容去重的序列化器，其他对象按JsonPlusSerializer序列化
+
+    继承JsonPlusSerializer是为了让LangGraph按图的状态类型派生msgpack白名单（with_msgpack_allowlist）时
+    仍然得到本类的实例；派生出的实例（浅拷贝）与原实例共享同一个BlobTable。
+    """
+
+    def __init__(self, *args: Any, table: Optional[BlobTable] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.table = table or BlobTable()
+        self._cache_lock = threading.Lock()
+        # id(message) -> (message, message.id, 引用, 数据大小)；保存消息对象本身，避免对象被回收后id被复用。
+        # add_messages会在节点输出写入（put_writes）之后才为没有id的消息分配id，因此同时比较message.id
+        self._cache: "OrderedDict[int, Tuple[BaseMessage, Optional[str], List[str], int]]" = OrderedDict()
+
+    def _cached_ref(self, message: BaseMessage) -> Optional[Tuple[List[str], int]]:
+        with self._cache_lock:
+            cached = self._cache.get(id(message))
+            if cached is None or cached[0] is not message or cached[1] != message.id:
+                return None
+            self._cache.move_to_end(id(message))
+            return cached[2], cached[3]
+
+    def _remember(self, message: BaseMessage, ref: List[str], size: int):
+        with self._cache_lock:
+            self._cache[id(message)] = (message, message.id, ref, size)
+            if len(self._cache) > MESSAGE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _message_ref(self, message: BaseMessage) -> List[str]:
+        cached = self._cached_ref(message)
+        if cached is None:
+            shell = super().dumps_typed(message.model_copy(update={"content": ""}))
+            content = super().dumps_typed(message.content)
+            cached = [self.table.put(shell), self.table.put(content)], len(shell[1]) + len(content[1])
+            self._remember(message, *cached)
+        self.table.count(cached[1])
+        return cached[0]
+
+    def clear_cache(self):
+        """清空消息引用缓存（BlobTable中的数据被删除后，缓存的引用可能已失效）"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _load_message(self, ref: List[str]) -> BaseMessage:
+        shell_key, content_key = ref
+        shell, content = self.table.get(shell_key), self.table.get(content_key)
+        message = super().loads_typed(shell).model_copy(update={"content": super().loads_typed(content)})
+        # 读取检查点后这些消息对象会随下一个检查点再次保存，缓存引用以免重新序列化
+        self._remember(message, ref, len(shell[1]) + len(content[1]))
+        return message
+
+    def _strip(self, obj: Any, depth: int = 0) -> Tuple[Any, bool]:
+        """把嵌套的消息替换为引用，返回(替换后的数据, 是否有替换)"""
+        if isinstance(obj, BaseMessage):
+            return {_MESSAGE_KEY: self._message_ref(obj)}, True
+        if depth >= _MAX_DEPTH:
+            return obj, False
+        if isinstance(obj, list) and obj and all(isinstance(item, BaseMessage) for item in obj):
+            return {_MESSAGES_KEY: [self._message_ref(item) for item in obj]}, True
+        if isinstance(obj, Send):
+            arg, changed = self._strip(obj.arg, depth + 1)
+            return (Send(obj.node, arg), True) if changed else (obj, False)
+        if isinstance(obj, dict):
+            items = {key: self._strip(value, depth + 1) for key, value in obj.items()}
+            if any(changed for _, changed in items.values()):
+                return {key: value for key, (value, _) in items.items()}, True
+            return obj, False
+        if isinstance(obj, (list, tuple)):
+            items = [self._strip(item, depth + 1) for item in obj]
+            if any(changed for _, changed in items):
+                return type(obj)(value for value, _ in items), True
+            return obj, False
+        return obj, False
+
+    def _restore(self, obj: Any, depth: int = 0) -> Any:
+        """_strip()的逆操作"""
+        if depth > _MAX_DEPTH:
+            return obj
+        if isinstance(obj, dict):
+            if _MESSAGES_KEY in obj and len(obj) == 1:
+                return [self._load_message(ref) for ref in obj[_MESSAGES_KEY]]
+            if _MESSAGE_KEY in obj and len(obj) == 1:
+                return self._load_message(obj[_MESSAGE_KEY])
+            return {key: self._restore(value, depth + 1) for key, value in obj.items()}
+        if isinstance(obj, Send):
+            return Send(obj.node, self._restore(obj.arg, depth + 1))
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._restore(item, depth + 1) for item in obj)
+        return obj
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        if isinstance(obj, BaseMessage):
+            return MESSAGE_TYPE, json.dumps(self._message_ref(obj)).encode()
+        if isinstance(obj, list) and obj and all(isinstance(item, BaseMessage) for item in obj):
+            return MESSAGES_TYPE, json.dumps([self._message_ref(item) for item in obj]).encode()
+        stripped, changed = self._strip(obj)
+        if changed:
+            kind, data = super().dumps_typed(stripped)
+            return NESTED_PREFIX + kind, data
+        return super().dumps_typed(obj)
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        kind, payload = data
+        if kind == MESSAGE_TYPE:
+            return self._load_message(json.loads(payload))
+        if kind == MESSAGES_TYPE:
+            return [self._load_message(ref) for ref in json.loads(payload)]
+        if kind.startswith(NESTED_PREFIX):
+            return self._restore(super().loads_typed((kind[len(NESTED_PREFIX):], payload)))
+        return super().loads_typed(data)
+
+    def referenced_keys(self, data: Tuple[str, bytes]) -> List[str]:
+        """一条序列化数据引用的BlobTable哈希"""
+        kind, payload = data
+        if kind == MESSAGE_TYPE:
+            return json.loads(payload)
+        if kind == MESSAGES_TYPE:
+            return [key for ref in json.loads(payload) for key in ref]
+        if kind.startswith(NESTED_PREFIX):
+            keys: List[str] = []
+            _collect_refs(super().loads_typed((kind[len(NESTED_PREFIX):], payload)), keys)
+            return keys
+        return []
+
+
+def _collect_refs(obj: Any, keys: List[str]):
+    if isinstance(obj, Send):
+        _collect_refs(obj.arg, keys)
+    elif isinstance(obj, dict):
+        if _MESSAGES_KEY in obj and len(obj) == 1:
+            keys.extend(key for ref in obj[_MESSAGES_KEY] for key in ref)
+        elif _MESSAGE_KEY in obj and len(obj) == 1:
+            keys.extend(obj[_MESSAGE_KEY])
+        else:
+            for value in obj.values():
+                _collect_refs(value, keys)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _collect_refs(item, keys)
+
+
+class DedupMemorySaver(MemorySaver):
+    """使用DedupSerializer的MemorySaver"""
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault("serde", DedupSerializer())
+        super().__init__(**kwargs)
+        # put/put_writes先把消息写入BlobTable再保存引用它们的检查点，两步之间不能进行垃圾回收
+        # （异步的aput/aput_writes/adelete_thread调用对应的同步方法）
+        self._gc_lock = threading.RLock()
+
+    def put(self, *args: Any, **kwargs: Any):
+        with self._gc_lock:
+            return super().put(*args, **kwargs)
+
+    def put_writes(self, *args: Any, **kwargs: Any) -> None:
+        with self._gc_lock:
+            super().put_writes(*args, **kwargs)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._gc_lock:
+            super().delete_thread(thread_id)
+            self.collect_garbage()
+
+    def collect_garbage(self):
+        """删除不再被任何检查点或待写入数据引用的消息数据"""
+        serde = self.serde
+        if not isinstance(serde, DedupSerializer):
+            return
+        with self._gc_lock:
+            keys = set()
+            for typed in list(self.blobs.values()):
+                keys.update(serde.referenced_keys(typed))
+            for writes in list(self.writes.values()):
+                for _, _, typed, _ in list(writes.values()):
+                    keys.update(serde.referenced_keys(typed))
+            serde.clear_cache()
+            serde.table.retain(keys)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """去重数据表的大小: stored_bytes为实际保存的字节数，logical_bytes为不去重时需要写入的字节数"""
+        serde = self.serde
+        if not isinstance(serde, DedupSerializer):
+            return {}
+        return serde.table.snapshot()
@@ -0,0 +1,250 @@
+"""
+MCP服务器配置解析
+
+config.json中的每个服务器配置被解析并校验为不可变的ServerSpec，错误按服务器分别报告，
+一个服务器配置有误不影响其他服务器。load_config()按文件的修改时间和大小缓存解析结果，
+文件未变化时直接返回上一次的结果，不再重复读取和解析JSON。
+
+除了传给MCP客户端的连接参数外，每个服务器还可以配置以下性能参数（只在本项目中使用）：
+
+- start_timeout: 启动服务器（建立会话并列出工具）的超时时间（秒）
+- call_timeout: 单次工具调用的超时时间（秒），不设置则不限制
+- max_concurrency: 该服务器同时执行的工具调用数上限，不设置时使用admission中的默认值（MCP_TOOL_MAX_CONCURRENCY）
+- max_output_bytes / max_output_tokens: 单次工具结果的字节数 / 估算token数上限，超过时截断（见tool_output_guard），
+  不设置时使用TOOL_OUTPUT_MAX_BYTES / TOOL_OUTPUT_MAX_TOKENS
+- spill_output: 截断时是否把完整内容保存到本地存储供代理分页读取，不设置时使用TOOL_OUTPUT_SPILL
+- health_interval: 健康检查（ping）的间隔（秒），不设置时使用MCP_HEALTH_INTERVAL
+- critical: 为true时预先启动一个备用进程，当前进程退出或无响应时立即切换
+
+通过npx启动的stdio服务器，如果其包已由provision_npx安装到本地（记录在锁文件中），
+解析时改为用node直接运行已安装的可执行文件；锁文件变化时load_config()同样重新解析。
+"""
+
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from provision_npx import NPX_LOCK_PATH, local_launch, lock_stamp
+
+TRANSPORTS = ("stdio", "sse", "streamable_http", "websocket")
+URL_TRANSPORTS = ("sse", "streamable_http", "websocket")
+
+DEFAULT_START_TIMEOUT = float(os.getenv("MCP_SERVER_START_TIMEOUT", "60"))
+
+# 只在本项目中使用、不传给MCP客户端的字段
+RUNTIME_FIELDS = (
+    "start_timeout", "call_timeout", "max_concurrency", "max_output_bytes", "max_output_tokens", "spill_output",
+    "health_interval", "critical",
+)
+
+
+class ConfigError(ValueError):
+    """服务器配置无效"""
+
+
+def _string_pairs(value: Any, field_name: str) -> Tuple[Tuple[str, str], ...]:
+    if value is None:
+        return ()
+    if not isinstance(value, dict):
+        raise ConfigError(f"'{field_name}' 必须是对象（{{}}）格式")
+    pairs = []
+    for key, item in value.items():
+        if not isinstance(item, str):
+            raise ConfigError(f"'{field_name}.{key}' 必须是字符串")
+        pairs.append((str(key), item))
+    return tuple(sorted(pairs))
+
+
+def _positive_number(value: Any, field_name: str, integer: bool = False) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ConfigError(f"'{field_name}' 必须是大于0的数字")
+    if integer and int(value) != value:
+        raise ConfigError(f"'{field_name}' 必须是整数")
+    return int(value) if integer else float(value)
+
+
+def _optional_bool(value: Any, field_name: str) -> Optional[bool]:
+    if value is None:
+        return None
+    if not isinstance(value, bool):
+        raise ConfigError(f"'{field_name}' 必须是true或false")
+    return value
+
+
+@dataclass(frozen=True)
+class ServerSpec:
+    """校验后的服务器配置（不可变，可比较、可哈希）"""
+
+    name: str
+    transport: str
+    command: Optional[str] = None
+    args: Tuple[str, ...] = ()
+    env: Tuple[Tuple[str, str], ...] = ()
+    cwd: Optional[str] = None
+    url: Optional[str] = None
+    headers: Tuple[Tuple[str, str], ...] = ()
+    start_timeout: float = DEFAULT_START_TIMEOUT
+    call_timeout: Optional[float] = None
+    max_concurrency: Optional[int] = None
+    max_output_bytes: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    spill_output: Optional[bool] = None
+    health_interval: Optional[float] = None
+    critical: bool = False
+    # 其他原样传给MCP客户端的字段: (字段名, JSON编码的值)
+    extra: Tuple[Tuple[str, str], ...] = ()
+    preview: str = field(default="", compare=False)
+
+    def connection(self) -> Dict[str, Any]:
+        """返回传给MultiServerMCPClient的连接配置"""
+        connection: Dict[str, Any] = {"transport": self.transport}
+        if self.command is not None:
+            connection["command"] = self.command
+            connection["args"] = list(self.args)
+        if self.env:
+            connection["env"] = dict(self.env)
+        if self.cwd is not None:
+            connection["cwd"] = self.cwd
+        if self.url is not None:
+            connection["url"] = self.url
+        if self.headers:
+            connection["headers"] = dict(self.headers)
+        for key, value in self.extra:
+            connection[key] = json.loads(value)
+        return connection
+
+
+def parse_server(name: str, raw: Any) -> ServerSpec:
+    """
+    校验并解析单个服务器配置
+
+    Raises:
+        ConfigError: 配置无效
+    """
+    if not isinstance(raw, dict):
+        raise ConfigError("服务器配置必须是对象（{}）格式")
+    transport = raw.get("transport") or ("sse" if "url" in raw else "stdio")
+    if transport not in TRANSPORTS:
+        raise ConfigError(f"不支持的transport '{transport}'，可选: {', '.join(TRANSPORTS)}")
+
+    command, args, url = raw.get("command"), raw.get("args", []), raw.get("url")
+    if transport == "stdio":
+        if not isinstance(command, str) or not command:
+            raise ConfigError("stdio服务器需要 'command' 字段")
+        if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+            raise ConfigError("'args' 必须是字符串数组（[]）格式")
+    elif not isinstance(url, str) or not url:
+        raise ConfigError(f"{transport}服务器需要 'url' 字段")
+
+    cwd = raw.get("cwd")
+    if cwd is not None and not isinstance(cwd, str):
+        raise ConfigError("'cwd' 必须是字符串")
+
+    known = {"transport", "command", "args", "env", "cwd", "url", "headers", *RUNTIME_FIELDS}
+    extra = tuple(sorted(
+        (key, json.dumps(value, sort_keys=True, ensure_ascii=False))
+        for key, value in raw.items()
+        if key not in known
+    ))
+
+    preview = [f"命令: {command}" if transport == "stdio" else f"URL: {url}", f"传输: {transport}"]
+    local = local_launch(command, args) if transport == "stdio" else None
+    if local is not None:
+        command, args, package = local
+        preview.append(f"本地安装: {package}")
+    if raw.get("critical"):
+        preview.append("备用进程")
+    return ServerSpec(
+        name=name,
+        transport=transport,
+        command=command if transport == "stdio" else None,
+        args=tuple(args) if transport == "stdio" else (),
+        env=_string_pairs(raw.get("env"), "env"),
+        cwd=cwd,
+        url=url if transport != "stdio" else None,
+        headers=_string_pairs(raw.get("headers"), "headers"),
+        start_timeout=_positive_number(raw.get("start_timeout"), "start_timeout") or DEFAULT_START_TIMEOUT,
+        call_timeout=_positive_number(raw.get("call_timeout"), "call_timeout"),
+        max_concurrency=_positive_number(raw.get("max_concurrency"), "max_concurrency", integer=True),
+        max_output_bytes=_positive_number(raw.get("max_output_bytes"), "max_output_bytes", integer=True),
+        max_output_tokens=_positive_number(raw.get("max_output_tokens"), "max_output_tokens", integer=True),
+        spill_output=_optional_bool(raw.get("spill_output"), "spill_output"),
+        health_interval=_positive_number(raw.get("health_interval"), "health_interval"),
+        critical=bool(_optional_bool(raw.get("critical"), "critical")),
+        extra=extra,
+        preview=" | ".join(preview),
+    )
+
+
+@dataclass(frozen=True)
+class ParsedConfig:
+    """解析后的完整配置: 有效的服务器配置和按服务器报告的错误"""
+
+    servers: Mapping[str, ServerSpec]
+    errors: Mapping[str, str]
+
+
+def parse_config(data: Any) -> ParsedConfig:
+    """解析整个配置（服务器名 -> 服务器配置），支持mcpServers包装格式"""
+    if isinstance(data, dict) and isinstance(data.get("mcpServers"), dict):
+        data = data["mcpServers"]
+    if not isinstance(data, dict):
+        return ParsedConfig({}, {"*": "配置必须是对象（{}）格式，键为服务器名称"})
+    servers, errors = {}, {}
+    for name, raw in data.items():
+        try:
+            servers[name] = parse_server(name, raw)
+        except ConfigError as e:
+            errors[name] = str(e)
+    return ParsedConfig(servers, errors)
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """某一时刻配置文件的内容及解析结果"""
+
+    path: str
+    stamp: Optional[Tuple[int, int]]
+    raw: Any
+    parsed: ParsedConfig
+    # 文件无法读取或不是合法JSON时的错误
+    file_error: Optional[str] = None
+    # 解析时npx锁文件的修改时间和大小
+    lock_stamp: Optional[Tuple[int, int]] = None
+
+
+_cache: Dict[str, ConfigSnapshot] = {}
+_cache_lock = threading.Lock()
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_config(path: str) -> ConfigSnapshot:
+    """读取并解析配置文件，文件和npx锁文件的修改时间和大小都未变化时返回缓存的结果"""
+    stamp, locked = _stamp(path), lock_stamp(NPX_LOCK_PATH)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached.stamp == stamp and cached.lock_stamp == locked:
+            return cached
+    if stamp is None:
+        snapshot = ConfigSnapshot(path, None, {}, ParsedConfig({}, {}), file_error="配置文件不存在")
+    else:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            snapshot = ConfigSnapshot(path, stamp, raw, parse_config(raw), lock_stamp=locked)
+        except (OSError, ValueError) as e:
+            snapshot = ConfigSnapshot(path, stamp, {}, ParsedConfig({}, {}), file_error=str(e), lock_stamp=locked)
+    with _cache_lock:
+        _cache[path] = snapshot
+    return snapshot
@@ -0,0 +1,208 @@
+"""
+中国行政区划的本地地名索引
+
+weather_query和geocoding的输入（"杭州"、"杭州市"、"hangzhou"、"浙江杭州"、"北京朝阳区"）在本地解析为行政区划，
+天气查询直接使用adcode，"某城市在哪里"这类简单的地理编码直接返回本地数据，不再请求高德。
+
+地名表为随项目发布的gazetteer.tsv（省级、地级、省直辖县级市和直辖市的区县），每个行政区划以
+全称、简称（去掉"市"、"地区"、"自治州"等后缀）、别名和拼音为键，建立哈希表和字符前缀树（trie）：
+
+- 整个输入是一个键时直接查哈希表
+- 否则用前缀树把输入切分为"上级 + 下级"（如"浙江" + "杭州"），每一段必须是前一段的下级
+- 区县的名称（全称、简称和拼音）只在上级之后有效："北京朝阳"、"北京市朝阳区"是北京的朝阳区，
+  单独的"朝阳区"无法确定是哪个城市（长春也有），返回None；单独的"朝阳"是辽宁省朝阳市
+- 同一个键对应多个不相关的行政区划（如"taizhou"：泰州、台州）时不做猜测，返回None，由调用方请求高德
+"""
+
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+GAZETTEER_PATH = os.getenv(
+    "AMAP_GAZETTEER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.tsv")
+)
+
+LEVELS = ("province", "city", "district")
+# 依次尝试去掉的后缀，去掉后至少保留两个字
+_SUFFIXES = ("特别行政区", "自治区", "自治州", "自治县", "地区", "新区", "林区", "省", "市", "区", "县", "盟")
+_SEPARATORS = re.compile(r"[\s'’·\-_,，]+")
+
+
+@dataclass(frozen=True)
+class Division:
+    """一个行政区划"""
+
+    adcode: str
+    name: str
+    level: str
+    parent: Optional[str]
+    longitude: float
+    latitude: float
+    pinyin: str
+    aliases: Tuple[str, ...] = ()
+
+    @property
+    def location(self) -> str:
+        return f"{self.longitude:.2f},{self.latitude:.2f}"
+
+
+def normalize(text: str) -> str:
+    """统一大小写，去掉空白和分隔符"""
+    return _SEPARATORS.sub("", text).lower()
+
+
+def short_name(name: str) -> Optional[str]:
+    for suffix in _SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[:-len(suffix)]
+    return None
+
+
+def _level(adcode: str) -> str:
+    if adcode.endswith("0000"):
+        return "province"
+    # 省直辖县级市（如济源、仙桃、石河子）的第3、4位为90
+    if adcode.endswith("00") or adcode[2:4] == "90":
+        return "city"
+    return "district"
+
+
+class Gazetteer:
+    """行政区划的哈希表和前缀树索引（构建后只读，线程安全）"""
+
+    def __init__(self, divisions: Iterable[Division]):
+        self._divisions: Dict[str, Division] = {}
+        # 键 -> [(行政区划, 是否只在上级之后有效)]
+        self._index: Dict[str, List[Tuple[Division, bool]]] = {}
+        self._trie: dict = {}
+        for division in divisions:
+            self._divisions[division.adcode] = division
+        for division in self._divisions.values():
+            for key, scoped in self._keys(division):
+                entries = self._index.setdefault(key, [])
+                if all(existing is not division for existing, _ in entries):
+                    entries.append((division, scoped))
+                    self._insert(key)
+
+    def _keys(self, division: Division):
+        # 表中只有直辖市的区县，而"朝阳区"、"江北区"、"普陀区"等在其他城市也有同名区县，
+        # 区县的全称同样只在上级之后有效
+        district = division.level == "district"
+        yield normalize(division.name), district
+        names = list(division.aliases) or [short_name(division.name)]
+        for name in [*names, division.pinyin]:
+            if name:
+                yield normalize(name), district
+
+    def _insert(self, key: str):
+        node = self._trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def __len__(self) -> int:
+        return len(self._divisions)
+
+    def get(self, adcode: str) -> Optional[Division]:
+        return self._divisions.get(adcode)
+
+    def chain(self, division: Division) -> List[Division]:
+        """从省级到该行政区划的上级链"""
+        chain = [division]
+        while chain[0].parent is not None:
+            chain.insert(0, self._divisions[chain[0].parent])
+        return chain
+
+    def _is_ancestor(self, ancestor: Division, division: Division) -> bool:
+        return ancestor is not division and ancestor in self.chain(division)
+
+    def _prefixes(self, text: str, start: int) -> List[int]:
+        """text[start:]中是键的前缀的结束位置，从长到短"""
+        node, ends = self._trie, []
+        for index in range(start, len(text)):
+            node = node.get(text[index])
+            if node is None:
+                break
+            if "" in node:
+                ends.append(index + 1)
+        return ends[::-1]
+
+    def _parse(self, text: str, start: int, context: Optional[Division], depth: int = 0) -> List[Division]:
+        if start == len(text):
+            return [context] if context is not None else []
+        if depth >= len(LEVELS):
+            return []
+        results: List[Division] = []
+        for end in self._prefixes(text, start):
+            for division, scoped in self._index[text[start:end]]:
+                if context is None and scoped:
+                    continue
+                if context is not None and not self._is_ancestor(context, division):
+                    continue
+                results.extend(self._parse(text, end, division, depth + 1))
+            if results:
+                # 最长匹配优先，较短的切分只在最长匹配无法解析时尝试
+                break
+        return results
+
+    def resolve(self, text: str) -> Optional[Division]:
+        """
+        把地名解析为行政区划，无法解析或有歧义时返回None
+
+        多个结果在同一条上级链上时（如"吉林"：吉林省、吉林市）取最下级的一个。
+        """
+        key = normalize(text or "")
+        if not key:
+            return None
+        candidates = list({division.adcode: division for division in self._parse(key, 0, None)}.values())
+        if not candidates:
+            return None
+        deepest = max(candidates, key=lambda division: LEVELS.index(division.level))
+        if all(division is deepest or self._is_ancestor(division, deepest) for division in candidates):
+            return deepest
+        return None
+
+
+def load(path: str) -> Gazetteer:
+    """读取地名表: adcode、名称、拼音、经度、纬度、别名（逗号分隔，可选），以#开头的行为注释"""
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            columns = line.rstrip("\n").split("\t")
+            adcode, name, pinyin, longitude, latitude = columns[:5]
+            aliases = tuple(alias for alias in (columns[5].split(",") if len(columns) > 5 else []) if alias)
+            rows.append((adcode, name, pinyin, float(longitude), float(latitude), aliases))
+    adcodes = {row[0] for row in rows}
+
+    def parent(adcode: str) -> Optional[str]:
+        level = _level(adcode)
+        if level == "province":
+            return None
+        city = adcode[:4] + "00"
+        if level == "district" and city in adcodes:
+            return city
+        # 直辖市的区县和省直辖县级市的上级为省级
+        return adcode[:2] + "0000"
+
+    return Gazetteer(
+        Division(adcode, name, _level(adcode), parent(adcode), longitude, latitude, pinyin, aliases)
+        for adcode, name, pinyin, longitude, latitude, aliases in rows
+    )
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Optional[Gazetteer]:
+    """首次使用时加载地名表（AMAP_GAZETTEER为空或文件不存在时返回None）"""
+    global _gazetteer
+    if _gazetteer is None and GAZETTEER_PATH and os.path.exists(GAZETTEER_PATH):
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = load(GAZETTEER_PATH)
+    return _gazetteer
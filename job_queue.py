@@ -0,0 +1,402 @@
+"""
+后台任务队列
+
+耗时较长的问题（如同时扫描文件系统并查询GitHub）在Streamlit脚本中同步执行时会受单轮超时限制，
+并且会一直占用当前会话。任务模式下问题提交后立即返回任务ID，由后台工作线程执行：
+
+- JobStore: SQLite中的任务表和事件表。流式输出的文本片段按时间批量写入，工具调用在组装完成后写入，
+  客户端按事件序号增量读取，可以随时重新连接（re-attach）或轮询任务状态
+- JobQueue: 若干工作线程，每个线程运行自己的事件循环，同一线程中最多同时执行 concurrency 个任务，
+  新任务分配给当前任务最少的线程；超出的任务在该线程中排队。执行前还需占用与页面对话共用的turns闸门
+
+任务在后台线程中执行，不依赖提交它的浏览器会话，关闭页面后任务会继续运行，结果保存在SQLite中。
+进程重启时，上一次未完成的任务标记为interrupted（代理和对话记忆都在进程内，无法继续执行）。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+JOB_DB_PATH = os.getenv("AGENT_JOB_DB", ".agent_jobs.sqlite")
+JOB_WORKERS = int(os.getenv("AGENT_JOB_WORKERS", "2"))
+JOB_WORKER_CONCURRENCY = int(os.getenv("AGENT_JOB_WORKER_CONCURRENCY", "2"))
+# 单个任务的最长执行时间（秒）
+JOB_TIMEOUT = float(os.getenv("AGENT_JOB_TIMEOUT", "1800"))
+# 文本片段合并写入的间隔（秒）
+JOB_FLUSH_INTERVAL = float(os.getenv("AGENT_JOB_FLUSH_INTERVAL", "0.25"))
+# 已结束任务的保留时间（秒），启动时清理
+JOB_RETENTION = float(os.getenv("AGENT_JOB_RETENTION", str(7 * 24 * 3600)))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, INTERRUPTED = (
+    "queued", "running", "succeeded", "failed", "cancelled", "interrupted"
+)
+FINISHED = (SUCCEEDED, FAILED, CANCELLED, INTERRUPTED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    query TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class JobStore:
+    """SQLite任务存储，可在多个线程中共享"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # 每个任务的下一个事件序号
+        self._next_seq: Dict[str, int] = {}
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def create(self, job_id: str, query: str, thread_id: Optional[str] = None):
+        self._execute(
+            "INSERT INTO jobs (id, thread_id, query, status, created) VALUES (?, ?, ?, ?, ?)",
+            (job_id, thread_id, query, QUEUED, time.time()),
+        )
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None, result: Any = None):
+        now = time.time()
+        if status == RUNNING:
+            self._execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (status, now, job_id))
+            return
+        self._execute(
+            "UPDATE jobs SET status = ?, finished = ?, error = ?, result = ? WHERE id = ?",
+            (
+                status,
+                now if status in FINISHED else None,
+                error,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                job_id,
+            ),
+        )
+        if status in FINISHED:
+            self._next_seq.pop(job_id, None)
+
+    def append_events(self, job_id: str, events: List[Dict[str, Any]]):
+        """追加事件（{"kind": ..., "data": ...}），同一批事件在一个事务中写入"""
+        if not events:
+            return
+        now = time.time()
+        with self._lock:
+            seq = self._next_seq.get(job_id)
+            if seq is None:
+                row = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+                ).fetchone()
+                seq = row[0] + 1
+            rows = []
+            for event in events:
+                rows.append((job_id, seq, event["kind"], json.dumps(event["data"], ensure_ascii=False), now))
+                seq += 1
+            self._next_seq[job_id] = seq
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO job_events (job_id, seq, kind, data, ts) VALUES (?, ?, ?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return _job_dict(rows[0]) if rows else None
+
+    def events(self, job_id: str, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """读取序号大于after的事件"""
+        rows = self._execute(
+            "SELECT seq, kind, data, ts FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (job_id, after, limit),
+        )
+        return [
+            {"seq": row["seq"], "kind": row["kind"], "data": json.loads(row["data"]), "ts": row["ts"]}
+            for row in rows
+        ]
+
+    def recent(self, limit: int = 10, thread_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        if thread_id is None:
+            rows = self._execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+        else:
+            rows = self._execute(
+                "SELECT * FROM jobs WHERE thread_id = ? ORDER BY created DESC LIMIT ?", (thread_id, limit)
+            )
+        return [_job_dict(row) for row in rows]
+
+    def mark_interrupted(self) -> int:
+        """把上一个进程中未完成的任务标记为interrupted，返回任务数"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, time.time(), "进程重启，任务已中断", QUEUED, RUNNING),
+            ).rowcount
+
+    def prune(self, max_age: float = JOB_RETENTION) -> int:
+        """删除结束时间早于max_age秒之前的任务及其事件"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished < ?)", (cutoff,)
+            )
+            return self._conn.execute("DELETE FROM jobs WHERE finished < ?", (cutoff,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _job_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def replay_events(events: List[Dict[str, Any]], view: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    把事件合并为当前的显示状态: {"seq", "text", "tool_calls"}
+
+    传入上一次的view时只合并新事件，用于轮询时增量更新。
+    """
+    view = view if view is not None else {"seq": 0, "text": "", "tool_calls": []}
+    for event in events:
+        if event["kind"] == "text":
+            view["text"] += event["data"]
+        elif event["kind"] == "tool_calls":
+            view["tool_calls"] = event["data"]
+        view["seq"] = event["seq"]
+    return view
+
+
+class _EventRecorder:
+    """把流式事件转换为存储事件，文本片段按JOB_FLUSH_INTERVAL合并写入"""
+
+    def __init__(self, store: JobStore, job_id: str, utils):
+        self.store = store
+        self.job_id = job_id
+        self.utils = utils
+        self.text: List[str] = []
+        self.assembler = utils.ToolCallAssembler()
+        self._pending_text: List[str] = []
+        self._pending: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+
+    def feed(self, event):
+        if isinstance(event, self.utils.TokenEvent):
+            self.text.append(event.text)
+            self._pending_text.append(event.text)
+        elif self.assembler.feed(event):
+            self._take_text()
+            self._pending.append({"kind": "tool_calls", "data": self.assembler.to_list()})
+        if self._pending or time.monotonic() - self._last_flush >= JOB_FLUSH_INTERVAL:
+            self.flush()
+
+    def _take_text(self):
+        if self._pending_text:
+            self._pending.append({"kind": "text", "data": "".join(self._pending_text)})
+            self._pending_text = []
+
+    def flush(self):
+        self._take_text()
+        self.store.append_events(self.job_id, self._pending)
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+
+class _Worker:
+    """一个工作线程及其事件循环"""
+
+    def __init__(self, index: int, concurrency: int):
+        self.loop = asyncio.new_event_loop()
+        self.concurrency = concurrency
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.assigned = 0
+        self.thread = threading.Thread(target=self._run, name=f"agent-job-worker-{index}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.loop.run_forever()
+
+
+class JobQueue:
+    """
+    后台任务队列（进程内共享）
+
+    Args:
+        store (JobStore): 任务存储
+        workers (int): 工作线程数
+        concurrency (int): 每个工作线程同时执行的任务数
+        timeout (float): 单个任务的最长执行时间（秒）
+    """
+
+    def __init__(
+        self,
+        store: Optional[JobStore] = None,
+        workers: int = JOB_WORKERS,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        timeout: float = JOB_TIMEOUT,
+    ):
+        self.store = store or JobStore()
+        self.store.mark_interrupted()
+        self.store.prune()
+        self.timeout = timeout
+        self._workers = [_Worker(index, max(1, concurrency)) for index in range(max(1, workers))]
+        self._futures: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, agent, query: str, config: Dict[str, Any], inputs: Optional[dict] = None) -> str:
+        """
+        提交一个问题，立即返回任务ID
+
+        Args:
+            agent: 要执行的LangGraph代理
+            query (str): 用户问题
+            config (dict): 调用配置（thread_id、model等）
+            inputs (dict, optional): 代理输入，默认为包含query的一条用户消息
+        """
+        from utils import random_uuid
+
+        job_id = random_uuid()
+        thread_id = (config.get("configurable") or {}).get("thread_id")
+        self.store.create(job_id, query, thread_id)
+        if inputs is None:
+            from langchain_core.messages import HumanMessage
+
+            inputs = {"messages": [HumanMessage(content=query)]}
+
+        with self._lock:
+            worker = min(self._workers, key=lambda item: item.assigned)
+            worker.assigned += 1
+            future = asyncio.run_coroutine_threadsafe(self._run(worker, job_id, agent, inputs, config), worker.loop)
+            self._futures[job_id] = future
+
+        def release(_):
+            with self._lock:
+                worker.assigned -= 1
+                self._futures.pop(job_id, None)
+
+        future.add_done_callback(release)
+        return job_id
+
+    async def _run(self, worker: _Worker, job_id: str, agent, inputs: dict, config: Dict[str, Any]):
+        import utils
+        from admission import AdmissionRejected, turn_gate
+        from usage_tracker import get_tracker, turn_usage, usage_callback
+
+        recorder = _EventRecorder(self.store, job_id, utils)
+        # 超时、出错和取消的任务同样记录已经完成的模型调用和工具调用的用量
+        usage_recorder = usage_callback()
+        config = {**config, "callbacks": [*(config.get("callbacks") or []), usage_recorder]}
+        configurable = config.get("configurable") or {}
+
+        def record_usage(seconds: float) -> dict:
+            usage = turn_usage(usage_recorder.messages, configurable.get("model"))
+            if configurable.get("thread_id"):
+                get_tracker().record(configurable["thread_id"], usage, configurable.get("model"), seconds)
+            return usage
+
+        try:
+            # 后台任务与页面中的对话轮次共用turns闸门，排队期间任务保持queued状态
+            async with worker.semaphore, turn_gate().slot():
+                self.store.set_status(job_id, RUNNING)
+                started = time.monotonic()
+                try:
+                    done = await asyncio.wait_for(self._consume(agent, inputs, config, recorder), self.timeout)
+                finally:
+                    usage = record_usage(time.monotonic() - started)
+            recorder.flush()
+            result = {
+                "text": "".join(recorder.text),
+                "tool_calls": recorder.assembler.to_list(),
+                "usage": usage,
+                "node": done.node if done else None,
+            }
+            self.store.set_status(job_id, SUCCEEDED, result=result)
+        except asyncio.CancelledError:
+            recorder.flush()
+            self.store.set_status(job_id, CANCELLED, error="任务已取消")
+            raise
+        except asyncio.TimeoutError:
+            recorder.flush()
+            self.store.set_status(job_id, FAILED, error=f"任务执行时间超过 {self.timeout:g} 秒")
+        except AdmissionRejected as e:
+            self.store.set_status(job_id, FAILED, error=f"系统繁忙（{e.reason}），请稍后再试")
+        except Exception as e:
+            recorder.flush()
+            self.store.set_status(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+
+    @staticmethod
+    async def _consume(agent, inputs: dict, config: Dict[str, Any], recorder: _EventRecorder):
+        done = None
+        async for event in recorder.utils.astream_graph(
+            agent, inputs, config=config, stream_mode=["messages", "updates"]
+        ):
+            if isinstance(event, recorder.utils.DoneEvent):
+                done = event
+            recorder.feed(event)
+        return done
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或执行中的任务"""
+        with self._lock:
+            future = self._futures.get(job_id)
+        return bool(future and future.cancel())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        return self.store.events(job_id, after)
+
+    def follow(self, job_id: str, after: int = 0, poll_interval: float = 0.5) -> Iterator[Dict[str, Any]]:
+        """重新连接任务的事件流: 产出序号大于after的事件，直到任务结束"""
+        while True:
+            job = self.store.get(job_id)
+            events = self.store.events(job_id, after)
+            for event in events:
+                after = event["seq"]
+                yield event
+            if job is None or (job["status"] in FINISHED and not events):
+                return
+            if not events:
+                time.sleep(poll_interval)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": len(self._workers),
+                "concurrency": self._workers[0].concurrency,
+                "active": len(self._futures),
+                "assigned": [worker.assigned for worker in self._workers],
+            }
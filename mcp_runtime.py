@@ -0,0 +1,540 @@
+"""
+MCP服务器运行时
+
+在独立的后台线程中运行一个事件循环，为每个MCP服务器维护一个常驻会话（stdio服务器只启动一次进程），
+而不是每次调用工具或每次"应用设置"都重新启动所有服务器：
+
+- reconcile(): 把新配置与正在运行的服务器逐个比较，只启动新增的、停止删除的、重启配置有变化的服务器，
+  未变化的服务器保持运行。全部完成后一次性替换工具注册表（version加一），读取方不会看到中间状态
+- watch(): 轮询config.json的修改时间，文件变化后自动执行reconcile
+- 工具在后台事件循环中执行，返回给代理的工具会把调用转发到该事件循环，因此可以在任意事件循环
+  （如Streamlit每个会话自己的事件循环）中调用
+
+启动失败或配置无效的服务器记录在errors中，不影响其他服务器；下次reconcile时会重新尝试启动。
+服务器配置由config_schema解析为不可变的ServerSpec，其中的call_timeout在后台事件循环中生效；
+每个服务器的工具调用经过admission中名为"tool:<服务器名>"的闸门，max_concurrency覆盖其默认并发上限，
+闸门已满时调用排队或被拒绝；被闸门拒绝、超过call_timeout以及服务器重启期间不可用的调用作为工具错误
+（status为error的ToolMessage）返回给模型，不会中断整轮对话。
+工具结果按服务器的输出策略（tool_output_guard.OutputPolicy）检查大小，过大的结果被截断后再返回给代理；
+任一服务器开启spill时，工具注册表中额外包含分页读取完整内容的 read_tool_output 工具。
+
+每个服务器由ServerHandle监控: 定期ping，进程退出或无响应时切换到备用会话（config.json中critical为true的服务器
+预先启动一个备用进程）或按指数退避自动重启，无需"重新应用设置"，工具对象保持不变，代理无需重建。
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from admission import AdmissionRejected, Gate, tool_gate
+from config_schema import ConfigSnapshot, ParsedConfig, ServerSpec, load_config, parse_config
+from tool_output_guard import OutputPolicy, aguard_result, output_page_tool
+
+# 停止服务器时等待会话关闭的超时时间（秒）
+STOP_TIMEOUT = float(os.getenv("MCP_SERVER_STOP_TIMEOUT", "10"))
+# 健康检查（ping）的间隔和超时时间（秒），间隔为0表示只在工具调用失败时检查；间隔可由服务器配置中的health_interval覆盖
+HEALTH_INTERVAL = float(os.getenv("MCP_HEALTH_INTERVAL", "30"))
+PING_TIMEOUT = float(os.getenv("MCP_PING_TIMEOUT", "5"))
+# 重启失败后的等待时间（秒），每次失败加倍，最长RESTART_BACKOFF_MAX
+RESTART_BACKOFF = float(os.getenv("MCP_RESTART_BACKOFF", "1"))
+RESTART_BACKOFF_MAX = float(os.getenv("MCP_RESTART_BACKOFF_MAX", "60"))
+
+
+class ToolUnavailable(ConnectionError):
+    """服务器正在重启或切换，或重启后不再提供该工具"""
+
+
+# 作为工具错误返回给模型的运行时错误（其他异常仍然中断本轮对话）
+_TOOL_ERRORS = (AdmissionRejected, asyncio.TimeoutError, ToolUnavailable)
+
+
+def _bind_to_loop(tool, handle: "ServerHandle", loop: asyncio.AbstractEventLoop, gate: Gate):
+    """返回一个把调用转发到loop中、由handle的当前会话执行的工具副本，调用经过gate并限制输出大小"""
+    from langchain_core.tools import ToolException
+
+    policy = OutputPolicy.for_spec(handle.spec)
+    name = tool.name
+    handle_error = tool.handle_tool_error
+
+    @functools.wraps(tool.coroutine)
+    async def call_on_runtime_loop(*args, **kwargs):
+        try:
+            async with gate.slot():
+                future = asyncio.run_coroutine_threadsafe(handle.call(name, args, kwargs), loop)
+                result = await asyncio.wrap_future(future)
+        except _TOOL_ERRORS as e:
+            # ToolNode只把ToolInvocationError作为工具结果返回，其他异常会中断整轮对话，
+            # 因此转换为ToolException，由下面的handle_tool_error生成错误结果
+            raise ToolException(_tool_error_text(handle, name, e)) from e
+        # 截断在调用方释放名额之后进行，不占用服务器的并发名额，也不阻塞运行时的事件循环
+        return await aguard_result(result, policy, handle.name, name)
+
+    def handle_tool_error(error):
+        if isinstance(error.__cause__, _TOOL_ERRORS):
+            return str(error)
+        # 适配器的处理函数只处理MCP服务器返回的isError结果
+        if callable(handle_error):
+            return handle_error(error)
+        raise error
+
+    return tool.model_copy(update={"coroutine": call_on_runtime_loop, "handle_tool_error": handle_tool_error})
+
+
+def _tool_error_text(handle: "ServerHandle", tool: str, error: BaseException) -> str:
+    if isinstance(error, AdmissionRejected):
+        return f"MCP服务器 {handle.name} 繁忙，工具 {tool} 未执行（{error.reason}），请稍后再试"
+    if isinstance(error, ToolUnavailable):
+        return str(error)
+    if handle.spec.call_timeout is not None:
+        return f"MCP服务器 {handle.name} 的工具 {tool} 执行超过 {handle.spec.call_timeout:g} 秒，已取消"
+    return f"MCP服务器 {handle.name} 的工具 {tool} 执行超时"
+
+
+def _error_text(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+class _Session:
+    """一个MCP会话（stdio服务器即一个进程）：会话由后台事件循环中的任务持有，直到stop()"""
+
+    def __init__(self, spec: ServerSpec):
+        self.spec = spec
+        self.session = None
+        # 工具名 -> load_mcp_tools返回的工具
+        self.tools: Dict[str, Any] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.ready: Optional[asyncio.Future] = None
+        self.stop_event: Optional[asyncio.Event] = None
+        # 会话建立后意外断开时的错误信息
+        self.error: Optional[str] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.task is not None and not self.task.done() and self.error is None
+
+    async def start(self, loop: asyncio.AbstractEventLoop):
+        """建立会话并加载工具，失败时抛出异常"""
+        self.ready = loop.create_future()
+        self.stop_event = asyncio.Event()
+        self.task = loop.create_task(self._serve())
+        try:
+            await asyncio.wait_for(asyncio.shield(self.ready), self.spec.start_timeout)
+        except BaseException:
+            await self.stop()
+            raise
+
+    async def _serve(self):
+        from langchain_mcp_adapters.client import MultiServerMCPClient
+        from langchain_mcp_adapters.tools import load_mcp_tools
+
+        try:
+            client = MultiServerMCPClient({self.spec.name: self.spec.connection()})
+            # 会话上下文必须在同一个任务中进入和退出，因此由本任务一直持有到stop()
+            async with client.session(self.spec.name) as session:
+                self.session = session
+                self.tools = {tool.name: tool for tool in await load_mcp_tools(session)}
+                if not self.ready.done():
+                    self.ready.set_result(True)
+                await self.stop_event.wait()
+        except BaseException as e:
+            if not self.ready.done():
+                self.ready.set_exception(e)
+            else:
+                self.error = _error_text(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+    async def ping(self) -> float:
+        """发送ping，返回往返时间（毫秒）；会话已断开或超时时抛出异常"""
+        if not self.alive:
+            raise ConnectionError(self.error or "会话已关闭")
+        started = time.monotonic()
+        await asyncio.wait_for(self.session.send_ping(), PING_TIMEOUT)
+        return (time.monotonic() - started) * 1000
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.stop_event.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), STOP_TIMEOUT)
+        except (asyncio.TimeoutError, Exception):
+            self.task.cancel()
+        self.task = None
+
+
+class ServerHandle:
+    """
+    一个运行中的MCP服务器
+
+    supervisor任务每隔health_interval秒ping当前会话，工具调用失败时立即检查；会话断开或无响应时
+    切换到备用会话（critical服务器预先启动一个），没有可用的备用会话时按指数退避重新启动。
+    返回给代理的工具对象在重启和切换后保持不变（调用时才取当前会话中的同名工具），代理无需重建；
+    恢复期间的工具调用最多等待start_timeout秒。所有状态只在运行时的事件循环中修改。
+    """
+
+    def __init__(self, spec: ServerSpec):
+        self.name = spec.name
+        self.spec = spec
+        self.tools: List[Any] = []
+        self.active: Optional[_Session] = None
+        self.standby: Optional[_Session] = None
+        self.supervisor: Optional[asyncio.Task] = None
+        # 当前会话可用时置位
+        self.available: Optional[asyncio.Event] = None
+        # 工具调用失败时置位，唤醒supervisor立即检查
+        self.wake: Optional[asyncio.Event] = None
+        # 重启后工具列表发生变化时调用（由McpRuntime设置）
+        self.on_tools_changed: Optional[Callable[[], None]] = None
+        self.state = "stopped"
+        self.error: Optional[str] = None
+        self.standby_error: Optional[str] = None
+        self.restarts = 0
+        self.failovers = 0
+        self.last_ping_ms: Optional[float] = None
+
+    @property
+    def health_interval(self) -> float:
+        return self.spec.health_interval or HEALTH_INTERVAL
+
+    async def start(self, loop: asyncio.AbstractEventLoop):
+        """启动服务器并加载工具，失败时抛出异常"""
+        session = _Session(self.spec)
+        await session.start(loop)
+        self.available = asyncio.Event()
+        self.wake = asyncio.Event()
+        self._activate(session)
+        self.supervisor = loop.create_task(self._supervise(loop))
+
+    def _activate(self, session: _Session):
+        previous = {name: tool.args_schema for name, tool in self.active.tools.items()} if self.active else None
+        self.active = session
+        if previous != {name: tool.args_schema for name, tool in session.tools.items()}:
+            gate = tool_gate(self.name, self.spec.max_concurrency)
+            loop = asyncio.get_running_loop()
+            self.tools = [_bind_to_loop(tool, self, loop, gate) for tool in session.tools.values()]
+            if previous is not None and self.on_tools_changed is not None:
+                self.on_tools_changed()
+        self.state = "running"
+        self.error = None
+        self.available.set()
+
+    async def call(self, name: str, args: tuple, kwargs: dict):
+        """在当前会话中执行工具（在运行时的事件循环中调用）"""
+        if not self.available.is_set():
+            try:
+                await asyncio.wait_for(self.available.wait(), self.spec.start_timeout)
+            except asyncio.TimeoutError:
+                raise ToolUnavailable(f"MCP服务器 {self.name} 正在重启，暂不可用（{self.error}）") from None
+        tool = self.active.tools.get(name)
+        if tool is None:
+            raise ToolUnavailable(f"MCP服务器 {self.name} 重启后不再提供工具 {name}")
+        try:
+            return await asyncio.wait_for(tool.coroutine(*args, **kwargs), self.spec.call_timeout)
+        except Exception:
+            # 调用失败可能是因为进程已退出或卡住，立即检查一次
+            self.wake.set()
+            raise
+
+    async def _healthy(self, session: Optional[_Session]) -> bool:
+        if session is None:
+            return False
+        try:
+            ping_ms = await session.ping()
+        except Exception as e:
+            session.error = session.error or _error_text(e)
+            return False
+        if session is self.active:
+            self.last_ping_ms = round(ping_ms, 1)
+        return True
+
+    async def _supervise(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            if self.spec.critical and self.standby is None:
+                await self._spawn_standby(loop)
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.health_interval or None)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            if not await self._healthy(self.active):
+                self.error = self.active.error
+                await self._recover(loop)
+            if self.standby is not None and not await self._healthy(self.standby):
+                self.standby_error = self.standby.error
+                loop.create_task(self.standby.stop())
+                self.standby = None
+
+    async def _spawn_standby(self, loop: asyncio.AbstractEventLoop):
+        session = _Session(self.spec)
+        try:
+            await session.start(loop)
+        except Exception as e:
+            # 下一次检查时再尝试
+            self.standby_error = _error_text(e)
+            return
+        self.standby = session
+        self.standby_error = None
+
+    async def _recover(self, loop: asyncio.AbstractEventLoop):
+        """当前会话不可用: 切换到备用会话，或按指数退避重启直到成功"""
+        self.available.clear()
+        # 卡住的进程可能需要等待STOP_TIMEOUT才能关闭，不阻塞恢复
+        loop.create_task(self.active.stop())
+        standby, self.standby = self.standby, None
+        if standby is not None and await self._healthy(standby):
+            self.failovers += 1
+            self._activate(standby)
+            return
+        if standby is not None:
+            loop.create_task(standby.stop())
+        self.state = "restarting"
+        delay = RESTART_BACKOFF
+        while True:
+            session = _Session(self.spec)
+            try:
+                await session.start(loop)
+            except Exception as e:
+                self.error = _error_text(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RESTART_BACKOFF_MAX)
+                continue
+            self.restarts += 1
+            self._activate(session)
+            return
+
+    async def stop(self):
+        if self.supervisor is not None:
+            self.supervisor.cancel()
+            try:
+                await self.supervisor
+            except BaseException:
+                pass
+            self.supervisor = None
+        await asyncio.gather(*(session.stop() for session in (self.active, self.standby) if session is not None))
+        self.active = self.standby = None
+        self.tools = []
+        self.state = "stopped"
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "restarts": self.restarts,
+            "failovers": self.failovers,
+            "standby": self.standby is not None,
+            "last_ping_ms": self.last_ping_ms,
+            "error": self.error,
+            "standby_error": self.standby_error,
+        }
+
+
+class ReconcileResult:
+    """一次reconcile的结果"""
+
+    def __init__(self):
+        self.added: List[str] = []
+        self.removed: List[str] = []
+        self.restarted: List[str] = []
+        self.unchanged: List[str] = []
+        self.errors: Dict[str, str] = {}
+        self.version = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed or self.restarted)
+
+    def to_dict(self) -> dict:
+        return {
+            "added": self.added,
+            "removed": self.removed,
+            "restarted": self.restarted,
+            "unchanged": self.unchanged,
+            "errors": self.errors,
+            "version": self.version,
+        }
+
+
+class McpRuntime:
+    """
+    MCP服务器运行时（进程内共享）
+
+    tools / server_tools() 读取的是最近一次reconcile完成后的工具注册表，version在注册表替换时加一。
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="mcp-runtime", daemon=True)
+        self._thread.start()
+        self._servers: Dict[str, ServerHandle] = {}
+        # 工具注册表: 服务器名 -> 工具列表，整体替换，不做原地修改
+        self._registry: Dict[str, List[Any]] = {}
+        # 不属于任何服务器的工具（read_tool_output），与注册表一起替换
+        self._extra_tools: List[Any] = []
+        self._page_tool = None
+        self._reconcile_lock: Optional[asyncio.Lock] = None
+        self.errors: Dict[str, str] = {}
+        self.version = 0
+        self._watcher: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        self.watch_error: Optional[str] = None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # ----- 工具注册表 -----
+
+    @property
+    def tools(self) -> List[Any]:
+        """当前所有服务器的工具，按名称排序"""
+        registry, extra = self._registry, self._extra_tools
+        tools = [tool for tools in registry.values() for tool in tools]
+        return sorted(tools + extra, key=lambda tool: tool.name)
+
+    def server_tools(self) -> Dict[str, List[Any]]:
+        """服务器名 -> 该服务器的工具列表"""
+        return dict(self._registry)
+
+    # ----- 配置同步 -----
+
+    async def _reconcile(self, config: ParsedConfig) -> ReconcileResult:
+        if self._reconcile_lock is None:
+            self._reconcile_lock = asyncio.Lock()
+        async with self._reconcile_lock:
+            result = ReconcileResult()
+            # 配置无效的服务器视为已删除，错误按服务器报告
+            result.errors.update(config.errors)
+            specs = config.servers
+            to_stop, to_start = [], []
+            for name, handle in self._servers.items():
+                if name not in specs:
+                    result.removed.append(name)
+                    to_stop.append(handle)
+                elif specs[name] != handle.spec:
+                    result.restarted.append(name)
+                    to_stop.append(handle)
+            for name, spec in specs.items():
+                handle = self._servers.get(name)
+                if handle is None:
+                    result.added.append(name)
+                    to_start.append(self._new_handle(spec))
+                elif name in result.restarted:
+                    to_start.append(self._new_handle(spec))
+                else:
+                    result.unchanged.append(name)
+
+            await asyncio.gather(*(handle.stop() for handle in to_stop))
+            for handle in to_stop:
+                self._servers.pop(handle.name, None)
+
+            outcomes = await asyncio.gather(
+                *(handle.start(self._loop) for handle in to_start), return_exceptions=True
+            )
+            for handle, outcome in zip(to_start, outcomes):
+                if isinstance(outcome, BaseException):
+                    result.errors[handle.name] = f"{type(outcome).__name__}: {outcome}"
+                else:
+                    self._servers[handle.name] = handle
+
+            # 原子替换工具注册表
+            self._registry = {name: list(handle.tools) for name, handle in self._servers.items()}
+            self._extra_tools = self._output_tools()
+            self.errors = result.errors
+            if result.changed:
+                self.version += 1
+            result.version = self.version
+            return result
+
+    def _new_handle(self, spec: ServerSpec) -> ServerHandle:
+        handle = ServerHandle(spec)
+        handle.on_tools_changed = functools.partial(self._tools_changed, handle)
+        return handle
+
+    def _tools_changed(self, handle: ServerHandle):
+        """服务器重启后提供的工具发生变化（如@latest包已更新）: 替换注册表，代理按version重建"""
+        if self._servers.get(handle.name) is not handle:
+            return
+        self._registry = {**self._registry, handle.name: list(handle.tools)}
+        self.version += 1
+
+    def _output_tools(self) -> List[Any]:
+        """任一服务器开启spill时提供read_tool_output工具（同一个实例，工具定义保持不变）"""
+        if not any(OutputPolicy.for_spec(handle.spec).spill for handle in self._servers.values()):
+            return []
+        if self._page_tool is None:
+            self._page_tool = output_page_tool()
+        return [self._page_tool]
+
+    @staticmethod
+    def _parsed(config: Union[dict, ParsedConfig, ConfigSnapshot]) -> ParsedConfig:
+        if isinstance(config, ConfigSnapshot):
+            return config.parsed
+        if isinstance(config, ParsedConfig):
+            return config
+        return parse_config(config)
+
+    def reconcile(self, config: Union[dict, ParsedConfig, ConfigSnapshot]) -> ReconcileResult:
+        """同步版本，可在任意线程中调用；config可以是原始配置或已解析的配置"""
+        return self._submit(self._reconcile(self._parsed(config))).result()
+
+    async def areconcile(self, config: Union[dict, ParsedConfig, ConfigSnapshot]) -> ReconcileResult:
+        """异步版本，可在任意事件循环中调用"""
+        return await asyncio.wrap_future(self._submit(self._reconcile(self._parsed(config))))
+
+    # ----- 配置文件监视 -----
+
+    def watch(self, path: str, interval: float = 2.0):
+        """启动后台线程轮询配置文件，文件修改后自动reconcile（重复调用无效）"""
+        if self._watcher is not None or interval <= 0:
+            return
+        self._watcher = threading.Thread(
+            target=self._watch_loop, args=(path, interval), name="mcp-config-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def _watch_loop(self, path: str, interval: float):
+        # load_config按修改时间缓存，文件未变化时返回同一个快照对象
+        last = load_config(path)
+        while not self._watch_stop.wait(interval):
+            try:
+                snapshot = load_config(path)
+                if snapshot is last:
+                    continue
+                last = snapshot
+                if snapshot.stamp is None:
+                    continue
+                if snapshot.file_error:
+                    raise ValueError(snapshot.file_error)
+                self.reconcile(snapshot)
+                self.watch_error = None
+            except Exception as e:
+                # 文件可能正在写入或格式错误，保持当前运行状态，等待下一次修改
+                self.watch_error = f"{type(e).__name__}: {e}"
+
+    # ----- 关闭 -----
+
+    def shutdown(self):
+        self._watch_stop.set()
+        try:
+            self._submit(self._reconcile(ParsedConfig({}, {}))).result(STOP_TIMEOUT * 2)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def snapshot(self) -> dict:
+        return {
+            "version": self.version,
+            "servers": {name: len(tools) for name, tools in self._registry.items()},
+            "errors": {
+                **dict(self.errors),
+                **{name: handle.error for name, handle in self._servers.items() if handle.error},
+            },
+            "watch_error": self.watch_error,
+            "health": {name: handle.health() for name, handle in self._servers.items()},
+        }
@@ -1,9 +1,28 @@
 from mcp.server.fastmcp import FastMCP
+import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import inspect
 import json
 import os
-from typing import Optional
+import re
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlencode
 import urllib3
 from dotenv import load_dotenv
+import gazetteer
+import poi_index
+import polyline
+import route_optimizer
+import speculation
+from rate_limiter import KeyPool, RateLimitExceeded
 
 # 加载环境变量
 load_dotenv()
@@ -11,14 +30,44 @@ load_dotenv()
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# 从环境变量获取配置
+# 从环境变量获取配置，AMAP_API_KEYS可用逗号分隔多个密钥轮换使用
 AMAP_API_KEY = os.getenv("AMAP_API_KEY")
-if not AMAP_API_KEY:
+AMAP_API_KEYS = [key.strip() for key in os.getenv("AMAP_API_KEYS", "").split(",") if key.strip()]
+if AMAP_API_KEY:
+    AMAP_API_KEYS.insert(0, AMAP_API_KEY)
+if not AMAP_API_KEYS:
     raise ValueError("AMAP_API_KEY 环境变量未设置。请在 .env 文件中添加您的高德地图API密钥。")
 
+# 限流与配额配置
+AMAP_QPS = float(os.getenv("AMAP_QPS", "3"))  # 每个密钥每个端点的QPS
+AMAP_KEY_QPS = float(os.getenv("AMAP_KEY_QPS", "30"))  # 每个密钥所有端点合计的QPS
+AMAP_DAILY_QUOTA = int(os.getenv("AMAP_DAILY_QUOTA", "5000"))  # 每个密钥每个端点的日配额，0表示不限制
+AMAP_MAX_QUEUE_WAIT = float(os.getenv("AMAP_MAX_QUEUE_WAIT", "10"))  # 排队等待的最长秒数
+AMAP_QUOTA_FILE = os.getenv("AMAP_QUOTA_FILE", ".amap_quota.json")
+
+# 预测预取（默认关闭）：根据上一次调用预测后续调用并在后台预热响应缓存
+SPECULATE = os.getenv("AMAP_SPECULATE", "0") != "0"
+SPECULATE_PER_MINUTE = float(os.getenv("AMAP_SPECULATE_PER_MINUTE", "20"))  # 预取每分钟最多发起的上游请求数
+SPECULATE_RULES = os.getenv("AMAP_SPECULATE_RULES")  # 跟随规则JSON文件，不设置时使用内置规则
+SPECULATE_LEARN = os.getenv("AMAP_SPECULATE_LEARN", "1") != "0"
+SPECULATE_MIN_SUPPORT = int(os.getenv("AMAP_SPECULATE_MIN_SUPPORT", "3"))
+SPECULATE_MIN_RATIO = float(os.getenv("AMAP_SPECULATE_MIN_RATIO", "0.3"))
+SPECULATE_WINDOW = float(os.getenv("AMAP_SPECULATE_WINDOW", "120"))  # 两次调用间隔超过该秒数时不视为先后关系
+SPECULATE_MAX_FOLLOWUPS = int(os.getenv("AMAP_SPECULATE_MAX_FOLLOWUPS", "2"))
+
+# 响应缓存：成功的上游响应按规范化后的请求参数缓存，TTL为0时不缓存。
+# 预取依赖缓存才有意义，因此只在开启预取时默认缓存300秒，否则默认不缓存，保持原有的实时查询行为
+RESPONSE_CACHE_TTL = float(os.getenv("AMAP_RESPONSE_CACHE_TTL", "300" if SPECULATE else "0"))
+RESPONSE_CACHE_SIZE = int(os.getenv("AMAP_RESPONSE_CACHE_SIZE", "1024"))
+
+# 本地地名索引：为1时"某城市在哪里"这类只包含行政区划名称的地理编码直接返回本地数据
+LOCAL_GEOCODE = os.getenv("AMAP_LOCAL_GEOCODE", "1") != "0"
+
 # 服务器配置从环境变量获取，提供默认值
 MCP_HOST = os.getenv("MCP_AMAP_HOST", "0.0.0.0")
 MCP_PORT = int(os.getenv("MCP_AMAP_PORT", "8006"))
+# 传输方式：stdio为每个客户端独立进程；sse可让多个会话共享同一服务进程（请求合并在此模式下效果最明显）
+MCP_TRANSPORT = os.getenv("MCP_AMAP_TRANSPORT", "stdio")
 
 # 高德地图API配置
 AMAP_BASE_URL = os.getenv("AMAP_BASE_URL", "https://restapi.amap.com/v3")
@@ -28,6 +77,7 @@ API_ENDPOINTS = {
     "geocoding": f"{AMAP_BASE_URL}/geocode/geo",
     "reverse_geocoding": f"{AMAP_BASE_URL}/geocode/regeo", 
     "poi_search": f"{AMAP_BASE_URL}/place/text",
+    "poi_around": f"{AMAP_BASE_URL}/place/around",
     "weather": f"{AMAP_BASE_URL}/weather/weatherInfo",
     "route_planning": f"{AMAP_BASE_URL}/direction/driving",
     "distance": f"{AMAP_BASE_URL}/distance"
@@ -42,25 +92,46 @@ mcp = FastMCP(
 )
 
 # 通用请求函数
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'zh-CN,zh;q=0.9'
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    返回共享的requests会话
+
+    requests在首次请求时才导入（服务启动和列出工具时不需要它），会话创建后复用连接池。
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                import requests
+
+                session = requests.Session()
+                session.headers.update(REQUEST_HEADERS)
+                # 请求在线程池中并发执行，连接池大小与默认线程池上限一致
+                session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=32))
+                _http_session = session
+    return _http_session
+
+
 def make_request(url, params):
     """统一的HTTP请求函数"""
-    import requests
-    
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'application/json',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'zh-CN,zh;q=0.9'
-        }
-        
         # 直接尝试HTTP连接（跳过HTTPS问题）
         http_url = url.replace('https://', 'http://')
         
-        response = requests.get(
+        response = get_http_session().get(
             http_url,
             params=params,
-            headers=headers,
             timeout=10,
             allow_redirects=True
         )
@@ -75,8 +146,328 @@ def make_request(url, params):
         return {"status": "0", "info": f"请求失败: {str(e)}"}
 
 
+class SingleFlight:
+    """
+    请求合并（single-flight）
+
+    同一时刻键相同的并发调用只会触发一次上游请求，其余调用等待并共享该请求的结果。
+    请求完成后立即移除记录，因此不会缓存结果。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["upstream"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+
+            def _forget(done_task, key=key):
+                # 只移除自己，避免误删同键的新请求
+                if self._inflight.get(key) is done_task:
+                    del self._inflight[key]
+
+            task.add_done_callback(_forget)
+        else:
+            self.stats["coalesced"] += 1
+        # shield: 某个调用方被取消时不影响其他共享该请求的调用方
+        return await asyncio.shield(task)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def running(self, key: str) -> bool:
+        """键相同的请求是否正在进行"""
+        return key in self._inflight
+
+
+_single_flight = SingleFlight()
+
+
+class ResponseCache:
+    """成功的上游响应的TTL缓存（LRU淘汰），记录由预取写入的条目被实际调用命中的次数"""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "speculative_hits": 0}
+
+    def get(self, key: str, speculative: bool = False) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if speculative:
+            return entry[1] if entry is not None else None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        if entry[2]:
+            # 只在第一次命中时计为预取命中
+            self.stats["speculative_hits"] += 1
+            entry[2] = False
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, data: dict, speculative: bool = False):
+        if self.ttl <= 0 or data.get("status") != "1":
+            return
+        self._entries[key] = [time.monotonic(), data, speculative]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, entries=len(self._entries))
+
+
+_response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+_speculator = speculation.Speculator(
+    speculation.load_rules(SPECULATE_RULES),
+    per_minute=SPECULATE_PER_MINUTE,
+    learn=SPECULATE_LEARN,
+    min_support=SPECULATE_MIN_SUPPORT,
+    min_ratio=SPECULATE_MIN_RATIO,
+    window=SPECULATE_WINDOW,
+    max_followups=SPECULATE_MAX_FOLLOWUPS,
+) if SPECULATE else None
+# 当前调用是否为后台预取（预取的调用不参与学习，也不触发新的预取）
+_speculating: contextvars.ContextVar = contextvars.ContextVar("amap_speculating", default=False)
+
+_key_pool = KeyPool(
+    AMAP_API_KEYS,
+    endpoint_qps=AMAP_QPS,
+    key_qps=AMAP_KEY_QPS,
+    daily_quota=AMAP_DAILY_QUOTA,
+    max_wait=AMAP_MAX_QUEUE_WAIT,
+    quota_file=AMAP_QUOTA_FILE,
+)
+atexit.register(_key_pool.quota.flush)
+
+
+def normalize_params(params: dict) -> Dict[str, str]:
+    """规范化请求参数：去掉空值、去除首尾空白并统一为字符串，按键排序"""
+    normalized = {}
+    for name in sorted(params):
+        value = params[name]
+        if value is None:
+            continue
+        value = str(value).strip()
+        if value == "":
+            continue
+        normalized[name] = value
+    return normalized
+
+
+async def _limited_request(endpoint: str, params: Dict[str, str], key: Optional[str] = None) -> dict:
+    """
+    经过限流和配额检查后发起请求，上游报告QPS超限时换用其他密钥重试一次
+
+    key不为空时表示调用方已经不排队地取得了密钥（预取），不再排队，也不重试
+    """
+    url = API_ENDPOINTS[endpoint]
+    retry = key is None
+    if key is None:
+        try:
+            key = await _key_pool.acquire(endpoint)
+        except RateLimitExceeded as e:
+            return {"status": "0", "info": f"请求被限流: {str(e)}"}
+
+    data = await asyncio.to_thread(make_request, url, dict(params, key=key))
+    if _key_pool.record(key, endpoint, data) and retry:
+        try:
+            key = await _key_pool.acquire(endpoint, exclude=key)
+        except RateLimitExceeded:
+            return data
+        data = await asyncio.to_thread(make_request, url, dict(params, key=key))
+        _key_pool.record(key, endpoint, data)
+    return data
+
+
+async def amap_get(endpoint: str, params: dict) -> dict:
+    """
+    异步调用高德API
+
+    参数规范化后相同的并发请求会被合并为一次上游HTTP请求，合并后的请求再经过限流排队，
+    API密钥由限流池按配额和等待时间轮换选择。成功的响应进入响应缓存，TTL内的相同请求直接返回缓存。
+    后台预取的请求只在预取预算和限流令牌都有余量、且没有正常请求在排队时才发往上游，否则直接放弃。
+
+    Args:
+        endpoint (str): API_ENDPOINTS中的端点名称
+        params (dict): 请求参数（不含key）
+
+    Returns:
+        dict: 高德API返回的JSON数据，多个合并的调用方共享同一对象，请勿修改
+    """
+    normalized = normalize_params(params)
+    flight_key = f"{endpoint}?{urlencode(normalized)}"
+    speculative = _speculating.get()
+    cached = _response_cache.get(flight_key, speculative=speculative)
+    if cached is not None:
+        return cached
+
+    key = None
+    if speculative:
+        if _single_flight.running(flight_key):
+            return {"status": "0", "info": "预取跳过: 相同请求正在进行"}
+        # 先取限流令牌再扣预取预算，拿不到令牌时不浪费预算；预算不足时归还令牌
+        key = None if _key_pool.waiting else _key_pool.try_acquire(endpoint)
+        if key is None:
+            return {"status": "0", "info": "预取跳过: 没有可立即使用的限流令牌"}
+        if not _speculator.try_spend():
+            _key_pool.release(key, endpoint)
+            return {"status": "0", "info": "预取跳过: 超出预取预算"}
+
+    async def fetch():
+        data = await _limited_request(endpoint, normalized, key)
+        _response_cache.put(flight_key, data, speculative=speculative)
+        return data
+
+    return await _single_flight.do(flight_key, fetch)
+
+
+_speculation_tasks = set()
+_speculation_stats = {"scheduled": 0, "failed": 0}
+_tool_functions: Dict[str, Callable[..., Awaitable[str]]] = {}
+
+
+def _speculation_context(tool: str, args: dict, result: str) -> dict:
+    """从一次调用的参数和成功结果中提取预测后续调用所需的值（city、longitude、latitude等）"""
+    context = {name: value for name, value in args.items() if isinstance(value, (str, int, float)) and value != ""}
+    try:
+        data = json.loads(result)
+    except ValueError:
+        return context
+    if data.get("status") != "success":
+        return context
+    if tool == "geocoding":
+        lng, lat = data["location"].split(",")
+        context.update(longitude=float(lng), latitude=float(lat), location=data["location"])
+        # 直辖市的city字段为空（[]），使用province
+        context["city"] = data["city"] if isinstance(data["city"], str) and data["city"] else data["province"]
+        # 县级地址（如义乌）的city是所属地级市，天气等按地点查询的后续调用应使用adcode
+        if isinstance(data.get("adcode"), str) and data["adcode"]:
+            context["adcode"] = data["adcode"]
+    elif tool == "reverse_geocoding":
+        component = data.get("addressComponent", {})
+        city = component.get("city")
+        context["city"] = city if isinstance(city, str) and city else component.get("province")
+        if isinstance(component.get("adcode"), str) and component["adcode"]:
+            context["adcode"] = component["adcode"]
+    return context
+
+
+def _schedule_speculation(tool: str, args: dict):
+    async def run():
+        _speculating.set(True)
+        try:
+            await _tool_functions[tool](**args)
+        except Exception:
+            _speculation_stats["failed"] += 1
+
+    _speculation_stats["scheduled"] += 1
+    task = asyncio.get_running_loop().create_task(run())
+    _speculation_tasks.add(task)
+    task.add_done_callback(_speculation_tasks.discard)
+
+
+def speculative(fn):
+    """
+    参与预测预取的工具
+
+    工具返回后记录本次调用并预测后续调用，在后台执行预测的调用以预热响应缓存（未启用预取时不做任何事）。
+    放在@mcp.tool()之下，工具的参数签名保持不变。
+    """
+    signature = inspect.signature(fn)
+    _tool_functions[fn.__name__] = fn
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        result = await fn(*args, **kwargs)
+        if _speculator is None or _speculating.get():
+            return result
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            context = _speculation_context(fn.__name__, bound.arguments, result)
+            _speculator.observe(fn.__name__, dict(bound.arguments), context)
+            for tool, tool_args in _speculator.predict(fn.__name__, context):
+                if tool in _tool_functions:
+                    _schedule_speculation(tool, tool_args)
+        except Exception:
+            # 预取失败不影响本次调用的结果
+            _speculation_stats["failed"] += 1
+        return result
+
+    return wrapper
+
+
+_gazetteer_stats = {"geocode_local": 0, "weather_local": 0, "weather_geocoded": 0, "weather_unresolved": 0}
+_GEOCODE_LEVELS = {"province": "省", "city": "市", "district": "区县"}
+# 直辖市（高德地理编码结果中city字段与province相同）
+_MUNICIPALITIES = {"110000", "120000", "310000", "500000"}
+
+
+def _local_geocode(address: str, city: Optional[str]) -> Optional[dict]:
+    """address（和city）只是行政区划名称时，按高德地理编码结果的格式返回本地数据，否则返回None"""
+    index = gazetteer.get_gazetteer() if LOCAL_GEOCODE else None
+    if index is None:
+        return None
+    division = index.resolve(address)
+    if division is None and city:
+        # 区县名称需要上级，如address="朝阳区", city="北京"
+        division = index.resolve(city + address)
+    if division is None:
+        return None
+    chain = index.chain(division)
+    if city:
+        scope = index.resolve(city)
+        if scope is None or scope not in chain:
+            return None
+    province = chain[0]
+    if len(chain) > 1 and chain[1].level == "city":
+        city_name = chain[1].name
+    else:
+        city_name = province.name if province.adcode in _MUNICIPALITIES else ""
+    return {
+        "location": division.location,
+        "formatted_address": "".join(item.name for item in chain),
+        "province": province.name,
+        "city": city_name,
+        "district": division.name if division.level == "district" else "",
+        "level": _GEOCODE_LEVELS[division.level],
+        "adcode": division.adcode,
+    }
+
+
+async def _weather_adcode(city: str) -> Optional[str]:
+    """把天气查询的城市解析为adcode: 先查本地地名索引，查不到时请求高德地理编码"""
+    city = (city or "").strip()
+    if re.fullmatch(r"\d{6}", city):
+        return city
+    index = gazetteer.get_gazetteer()
+    division = index.resolve(city) if index is not None else None
+    if division is not None:
+        _gazetteer_stats["weather_local"] += 1
+        return division.adcode
+    data = await amap_get("geocoding", {"address": city, "output": "json"})
+    if data["status"] == "1" and data.get("geocodes") and isinstance(data["geocodes"][0].get("adcode"), str):
+        _gazetteer_stats["weather_geocoded"] += 1
+        return data["geocodes"][0]["adcode"]
+    _gazetteer_stats["weather_unresolved"] += 1
+    return None
+
+
 @mcp.tool()
-def geocoding(address: str, city: Optional[str] = None) -> str:
+@speculative
+async def geocoding(address: str, city: Optional[str] = None) -> str:
     """
     地理编码 - 将地址转换为经纬度坐标
     
@@ -85,18 +476,21 @@ def geocoding(address: str, city: Optional[str] = None) -> str:
         city (str, optional): 指定查询的城市，提高查询精度
     
     Returns:
-        str: 包含经纬度坐标和详细地址信息的JSON字符串
+        str: 包含经纬度坐标和详细地址信息的JSON字符串，地址只是行政区划名称时source为local（来自本地地名索引）
     """
-    url = API_ENDPOINTS["geocoding"]
+    local = _local_geocode(address, city)
+    if local is not None:
+        _gazetteer_stats["geocode_local"] += 1
+        return json.dumps(dict(status="success", source="local", **local), ensure_ascii=False, indent=2)
+
     params = {
-        "key": AMAP_API_KEY,
         "address": address,
         "output": "json"
     }
     if city:
         params["city"] = city
         
-    data = make_request(url, params)
+    data = await amap_get("geocoding", params)
     
     if data["status"] == "1" and data.get("geocodes"):
         result = data["geocodes"][0]
@@ -107,7 +501,8 @@ def geocoding(address: str, city: Optional[str] = None) -> str:
             "province": result["province"],
             "city": result["city"],
             "district": result["district"],
-            "level": result["level"]
+            "level": result["level"],
+            "adcode": result.get("adcode", "")
         }, ensure_ascii=False, indent=2)
     else:
         return json.dumps({
@@ -117,7 +512,8 @@ def geocoding(address: str, city: Optional[str] = None) -> str:
 
 
 @mcp.tool()
-def reverse_geocoding(longitude: float, latitude: float, radius: Optional[int] = 1000) -> str:
+@speculative
+async def reverse_geocoding(longitude: float, latitude: float, radius: Optional[int] = 1000) -> str:
     """
     逆地理编码 - 将经纬度坐标转换为地址信息
     
@@ -129,16 +525,14 @@ def reverse_geocoding(longitude: float, latitude: float, radius: Optional[int] =
     Returns:
         str: 包含地址信息的JSON字符串
     """
-    url = API_ENDPOINTS["reverse_geocoding"]
     params = {
-        "key": AMAP_API_KEY,
         "location": f"{longitude},{latitude}",
         "output": "json",
         "radius": radius,
         "extensions": "all"
     }
     
-    data = make_request(url, params)
+    data = await amap_get("reverse_geocoding", params)
     
     if data["status"] == "1":
         regeocode = data["regeocode"]
@@ -155,8 +549,49 @@ def reverse_geocoding(longitude: float, latitude: float, radius: Optional[int] =
         }, ensure_ascii=False, indent=2)
 
 
+# 本地POI索引配置：设置AMAP_POI_STORE（SQLite文件路径）后启用
+POI_PAGE_SIZE = 10
+POI_PREFETCH_PAGE_SIZE = 25  # 高德POI搜索单页最多25条
+POI_STORE_PATH = os.getenv("AMAP_POI_STORE")
+POI_STORE_TTL = float(os.getenv("AMAP_POI_TTL", str(7 * 86400)))
+_poi_store = poi_index.PoiStore(POI_STORE_PATH, ttl=POI_STORE_TTL) if POI_STORE_PATH else None
+
+
+def _format_poi(poi: dict) -> dict:
+    return {
+        "id": poi.get("id", ""),
+        "name": poi["name"],
+        "type": poi["type"],
+        "address": poi["address"],
+        "location": poi["location"],
+        "tel": poi.get("tel", ""),
+        "distance": poi.get("distance", ""),
+        "business_area": poi.get("business_area", ""),
+        "cityname": poi.get("cityname", ""),
+        "adname": poi.get("adname", "")
+    }
+
+
+def _poi_query_key(*parts) -> str:
+    return "|".join(str(part or "").strip() for part in parts)
+
+
+def _poi_filters(keywords: Optional[str], types: Optional[str]) -> str:
+    """周边搜索的筛选条件，类型（名称或编码）按原样比较，与顺序无关"""
+    type_list = sorted({t.strip() for t in (types or "").split("|") if t.strip()})
+    return _poi_query_key((keywords or "").strip(), "|".join(type_list))
+
+
+def _remember_pois(key: str, offset: int, pois: List[dict], total: int):
+    if _poi_store is None:
+        return
+    _poi_store.upsert(pois)
+    _poi_store.record_query(key, offset, [poi["id"] for poi in pois if poi.get("id")], total)
+
+
 @mcp.tool()
-def poi_search(keywords: str, city: Optional[str] = None, types: Optional[str] = None, page: Optional[int] = 1) -> str:
+@speculative
+async def poi_search(keywords: str, city: Optional[str] = None, types: Optional[str] = None, page: Optional[int] = 1) -> str:
     """
     POI搜索 - 搜索兴趣点信息
     
@@ -169,13 +604,25 @@ def poi_search(keywords: str, city: Optional[str] = None, types: Optional[str] =
     Returns:
         str: 包含POI搜索结果的JSON字符串
     """
-    url = API_ENDPOINTS["poi_search"]
+    page = page or 1
+    key = _poi_query_key("text", keywords, city, types)
+    offset = (page - 1) * POI_PAGE_SIZE
+    if _poi_store is not None:
+        hit = _poi_store.lookup_query(key, offset, POI_PAGE_SIZE)
+        if hit is not None:
+            pois, total = hit
+            return json.dumps({
+                "status": "success",
+                "source": "local",
+                "count": str(total),
+                "pois": pois
+            }, ensure_ascii=False, indent=2)
+
     params = {
-        "key": AMAP_API_KEY,
         "keywords": keywords,
         "output": "json",
         "page": page,
-        "offset": 10
+        "offset": POI_PAGE_SIZE
     }
     
     if city:
@@ -183,20 +630,11 @@ def poi_search(keywords: str, city: Optional[str] = None, types: Optional[str] =
     if types:
         params["types"] = types
         
-    data = make_request(url, params)
+    data = await amap_get("poi_search", params)
     
     if data["status"] == "1":
-        pois = []
-        for poi in data["pois"]:
-            pois.append({
-                "name": poi["name"],
-                "type": poi["type"],
-                "address": poi["address"],
-                "location": poi["location"],
-                "tel": poi.get("tel", ""),
-                "distance": poi.get("distance", ""),
-                "business_area": poi.get("business_area", "")
-            })
+        pois = [_format_poi(poi) for poi in data["pois"]]
+        _remember_pois(key, offset, pois, int(data["count"]))
         
         return json.dumps({
             "status": "success",
@@ -211,30 +649,163 @@ def poi_search(keywords: str, city: Optional[str] = None, types: Optional[str] =
 
 
 @mcp.tool()
-def weather_query(city: str = "北京市", extensions: Optional[str] = "base") -> str:
+async def poi_prefetch(keywords: str, city: Optional[str] = None, types: Optional[str] = None, max_pages: Optional[int] = 4) -> str:
+    """
+    POI预取 - 并发获取某个搜索条件的多页结果并存入本地POI索引，之后相同条件的poi_search翻页可直接在本地完成
+    
+    Args:
+        keywords (str): 搜索关键词
+        city (str, optional): 搜索城市
+        types (str, optional): POI类型，如"餐饮服务|购物服务"
+        max_pages (int, optional): 最多获取的页数（每页25条），默认4
+    
+    Returns:
+        str: 包含预取数量和本地索引状态的JSON字符串
+    """
+    if _poi_store is None:
+        return json.dumps({
+            "status": "error",
+            "message": "本地POI索引未启用，请设置AMAP_POI_STORE环境变量"
+        }, ensure_ascii=False, indent=2)
+
+    params = {"keywords": keywords, "output": "json", "offset": POI_PREFETCH_PAGE_SIZE}
+    if city:
+        params["city"] = city
+    if types:
+        params["types"] = types
+
+    first = await amap_get("poi_search", dict(params, page=1))
+    if first["status"] != "1":
+        return json.dumps({
+            "status": "error",
+            "message": f"POI预取失败: {first.get('info', '未知错误')}"
+        }, ensure_ascii=False, indent=2)
+
+    total = int(first["count"])
+    pages = min(max(1, max_pages or 4), max(1, -(-total // POI_PREFETCH_PAGE_SIZE)))
+    rest = await asyncio.gather(*[
+        amap_get("poi_search", dict(params, page=page)) for page in range(2, pages + 1)
+    ])
+    pois = [_format_poi(poi) for poi in first["pois"]]
+    fetched_pages = 1
+    for data in rest:
+        if data["status"] != "1":
+            # 某页失败时只保留此前连续的结果
+            break
+        pois.extend(_format_poi(poi) for poi in data["pois"])
+        fetched_pages += 1
+    _remember_pois(_poi_query_key("text", keywords, city, types), 0, pois, total)
+
+    return json.dumps({
+        "status": "success",
+        "total": total,
+        "fetched": len(pois),
+        "pages": fetched_pages,
+        "store": _poi_store.snapshot()
+    }, ensure_ascii=False, indent=2)
+
+
+@mcp.tool()
+@speculative
+async def poi_nearby(
+    longitude: float,
+    latitude: float,
+    radius: Optional[int] = 1000,
+    keywords: Optional[str] = None,
+    types: Optional[str] = None,
+    limit: Optional[int] = 10,
+) -> str:
+    """
+    周边搜索 - 搜索指定坐标附近的POI，已浏览过的区域优先从本地POI索引返回
+    
+    Args:
+        longitude (float): 中心点经度
+        latitude (float): 中心点纬度
+        radius (int, optional): 搜索半径，单位米，默认1000米
+        keywords (str, optional): 搜索关键词
+        types (str, optional): POI类型，如"餐饮服务|购物服务"
+        limit (int, optional): 返回数量，默认10，最多25
+    
+    Returns:
+        str: 包含按距离排序的POI列表及数据来源（local或amap）的JSON字符串
+    """
+    radius = radius or 1000
+    limit = min(max(1, limit or 10), POI_PREFETCH_PAGE_SIZE)
+    filters = _poi_filters(keywords, types)
+    if _poi_store is not None:
+        local = _poi_store.lookup_area(filters, longitude, latitude, radius, limit)
+        if local is not None:
+            pois = [dict(poi, distance=str(int(distance))) for distance, poi in local]
+            return json.dumps({
+                "status": "success",
+                "source": "local",
+                "count": len(pois),
+                "pois": pois
+            }, ensure_ascii=False, indent=2)
+
+    params = {
+        "location": f"{longitude},{latitude}",
+        "radius": radius,
+        "output": "json",
+        "offset": limit,
+        "page": 1,
+        "sortrule": "distance"
+    }
+    if keywords:
+        params["keywords"] = keywords
+    if types:
+        params["types"] = types
+
+    data = await amap_get("poi_around", params)
+    if data["status"] == "1":
+        pois = [_format_poi(poi) for poi in data["pois"]]
+        if _poi_store is not None:
+            _poi_store.upsert(pois)
+            # 结果按距离排序，未全部返回时只有到最远一条结果的距离以内是完整的
+            _poi_store.record_area(
+                filters, longitude, latitude, radius,
+                [poi["id"] for poi in pois if poi.get("id")], int(data["count"]) <= len(pois)
+            )
+        return json.dumps({
+            "status": "success",
+            "source": "amap",
+            "count": len(pois),
+            "pois": pois
+        }, ensure_ascii=False, indent=2)
+    else:
+        return json.dumps({
+            "status": "error",
+            "message": f"周边搜索失败: {data.get('info', '未知错误')}"
+        }, ensure_ascii=False, indent=2)
+
+
+@mcp.tool()
+@speculative
+async def weather_query(city: str = "北京市", extensions: Optional[str] = "base") -> str:
     """
     天气查询 - 获取指定城市的天气信息
     
     Args:
-        city (str): 城市名称，如"北京市"、"上海市"等，默认"北京市"
+        city (str): 城市或区县名称，如"北京市"、"杭州"、"hangzhou"、"北京朝阳区"，也可以是adcode，默认"北京市"
         extensions (str, optional): 气象类型，base-实况天气，all-预报天气，默认base
     
     Returns:
         str: 包含天气信息的JSON字符串
     """
-    # 如果没有提供完整城市名，尝试补全
-    if city and not city.endswith("市") and not city.endswith("区") and not city.endswith("县"):
-        city = city + "市"
-        
-    url = API_ENDPOINTS["weather"]
+    adcode = await _weather_adcode(city)
+    if adcode is None:
+        return json.dumps({
+            "status": "error",
+            "message": f"无法识别城市: {city}，请提供省、市或区县的名称"
+        }, ensure_ascii=False, indent=2)
+
     params = {
-        "key": AMAP_API_KEY,
-        "city": city,
+        "city": adcode,
         "extensions": extensions,
         "output": "json"
     }
     
-    data = make_request(url, params)
+    data = await amap_get("weather", params)
     
     if data["status"] == "1":
         if extensions == "base":
@@ -285,8 +856,68 @@ def weather_query(city: str = "北京市", extensions: Optional[str] = "base") -
             }, ensure_ascii=False, indent=2)
 
 
+# 路线缓存：保存完整路线供route_steps分页读取，避免客户端为了查看更多步骤而重新规划
+ROUTE_CACHE_SIZE = int(os.getenv("AMAP_ROUTE_CACHE_SIZE", "64"))
+ROUTE_CACHE_TTL = float(os.getenv("AMAP_ROUTE_CACHE_TTL", "1800"))
+_route_store: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def _store_route(params: dict, path: dict) -> str:
+    route_id = hashlib.sha1(urlencode(normalize_params(params)).encode("utf-8")).hexdigest()[:12]
+    _route_store[route_id] = (time.monotonic(), path)
+    _route_store.move_to_end(route_id)
+    while len(_route_store) > ROUTE_CACHE_SIZE:
+        _route_store.popitem(last=False)
+    return route_id
+
+
+def _load_route(route_id: str) -> Optional[dict]:
+    entry = _route_store.get(route_id)
+    if entry is None:
+        return None
+    created, path = entry
+    if time.monotonic() - created > ROUTE_CACHE_TTL:
+        del _route_store[route_id]
+        return None
+    return path
+
+
+def _route_steps_page(path: dict, page: int, page_size: int, polyline_format: Optional[str]) -> dict:
+    """按页截取路线步骤，polyline_format不为空时附带每一步的压缩几何"""
+    steps = path["steps"]
+    page_size = max(1, page_size or 20)
+    total_pages = max(1, (len(steps) + page_size - 1) // page_size)
+    page = min(max(1, page or 1), total_pages)
+    items = []
+    for step in steps[(page - 1) * page_size:page * page_size]:
+        item = {
+            "instruction": step["instruction"],
+            "distance": step["distance"],
+            "duration": step["duration"],
+            "road": step.get("road", "")
+        }
+        if polyline_format:
+            item["polyline"] = polyline.encode(polyline.parse_amap_polyline(step.get("polyline", "")), polyline_format)
+        items.append(item)
+    return {
+        "page": page,
+        "page_size": page_size,
+        "total_pages": total_pages,
+        "next_page": page + 1 if page < total_pages else None,
+        "steps": items
+    }
+
+
 @mcp.tool()
-def route_planning(origin: str, destination: str, strategy: Optional[int] = 10, waypoints: Optional[str] = None) -> str:
+async def route_planning(
+    origin: str,
+    destination: str,
+    strategy: Optional[int] = 10,
+    waypoints: Optional[str] = None,
+    detail: Optional[str] = "summary",
+    polyline_format: Optional[str] = "google",
+    steps_page_size: Optional[int] = 20,
+) -> str:
     """
     路径规划 - 驾车路径规划
     
@@ -295,13 +926,27 @@ def route_planning(origin: str, destination: str, strategy: Optional[int] = 10,
         destination (str): 终点坐标，格式：经度,纬度
         strategy (int, optional): 路径规划策略，默认10（不走高速+费用最少+距离最短）
         waypoints (str, optional): 途经点，格式：经度,纬度;经度,纬度
+        detail (str, optional): summary-只返回前5个步骤，full-返回整条路线的压缩几何和第一页步骤，默认summary
+        polyline_format (str, optional): full模式下的几何编码格式，google或delta_varint，默认google
+        steps_page_size (int, optional): full模式下每页的步骤数，默认20
     
     Returns:
-        str: 包含路径规划结果的JSON字符串
+        str: 包含路径规划结果的JSON字符串，其中route_id可用于route_steps分页获取全部步骤
     """
-    url = API_ENDPOINTS["route_planning"]
+    detail = detail or "summary"
+    polyline_format = polyline_format or "google"
+    if detail not in ("summary", "full"):
+        return json.dumps({
+            "status": "error",
+            "message": f"不支持的detail参数: {detail}，可选: summary, full"
+        }, ensure_ascii=False, indent=2)
+    if detail == "full" and polyline_format not in polyline.FORMATS:
+        return json.dumps({
+            "status": "error",
+            "message": f"不支持的polyline编码格式: {polyline_format}，可选: {', '.join(polyline.FORMATS)}"
+        }, ensure_ascii=False, indent=2)
+
     params = {
-        "key": AMAP_API_KEY,
         "origin": origin,
         "destination": destination,
         "strategy": strategy,
@@ -312,27 +957,34 @@ def route_planning(origin: str, destination: str, strategy: Optional[int] = 10,
     if waypoints:
         params["waypoints"] = waypoints
         
-    data = make_request(url, params)
+    data = await amap_get("route_planning", params)
     
     if data["status"] == "1" and data["route"]["paths"]:
         path = data["route"]["paths"][0]
-        return json.dumps({
+        route_id = _store_route(params, path)
+        result = {
             "status": "success",
+            "route_id": route_id,
             "distance": path["distance"],
             "duration": path["duration"],
             "tolls": path["tolls"],
             "toll_distance": path["toll_distance"],
             "restriction": path["restriction"],
             "steps_count": len(path["steps"]),
-            "steps": [
-                {
-                    "instruction": step["instruction"],
-                    "distance": step["distance"],
-                    "duration": step["duration"],
-                    "road": step.get("road", "")
-                } for step in path["steps"][:5]
-            ]
-        }, ensure_ascii=False, indent=2)
+        }
+        if detail == "summary":
+            result["steps"] = _route_steps_page(path, 1, 5, None)["steps"]
+            return json.dumps(result, ensure_ascii=False, indent=2)
+
+        points = polyline.merge_polylines(step.get("polyline", "") for step in path["steps"])
+        result["polyline"] = {
+            "format": polyline_format,
+            "precision": 5 if polyline_format == "google" else 6,
+            "points": len(points),
+            "encoded": polyline.encode(points, polyline_format)
+        }
+        result.update(_route_steps_page(path, 1, steps_page_size, None))
+        return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
     else:
         return json.dumps({
             "status": "error",
@@ -341,7 +993,44 @@ def route_planning(origin: str, destination: str, strategy: Optional[int] = 10,
 
 
 @mcp.tool()
-def distance_calculation(origins: str, destinations: str, type_distance: Optional[int] = 1) -> str:
+async def route_steps(
+    route_id: str,
+    page: Optional[int] = 1,
+    page_size: Optional[int] = 20,
+    polyline_format: Optional[str] = None,
+) -> str:
+    """
+    路线步骤分页 - 分页获取route_planning已规划路线的全部步骤，不会重新请求高德
+    
+    Args:
+        route_id (str): route_planning返回的路线ID
+        page (int, optional): 页码，默认第1页
+        page_size (int, optional): 每页步骤数，默认20
+        polyline_format (str, optional): 附带每一步的几何编码，google或delta_varint，默认不附带
+    
+    Returns:
+        str: 包含该页步骤及分页信息（next_page为空表示已是最后一页）的JSON字符串
+    """
+    if polyline_format and polyline_format not in polyline.FORMATS:
+        return json.dumps({
+            "status": "error",
+            "message": f"不支持的polyline编码格式: {polyline_format}，可选: {', '.join(polyline.FORMATS)}"
+        }, ensure_ascii=False, indent=2)
+
+    path = _load_route(route_id)
+    if path is None:
+        return json.dumps({
+            "status": "error",
+            "message": f"路线 {route_id} 不存在或已过期，请重新调用route_planning"
+        }, ensure_ascii=False, indent=2)
+
+    result = {"status": "success", "route_id": route_id, "steps_count": len(path["steps"])}
+    result.update(_route_steps_page(path, page, page_size, polyline_format))
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+
+
+@mcp.tool()
+async def distance_calculation(origins: str, destinations: str, type_distance: Optional[int] = 1) -> str:
     """
     距离测量 - 计算两点间的距离和时间
     
@@ -353,16 +1042,14 @@ def distance_calculation(origins: str, destinations: str, type_distance: Optiona
     Returns:
         str: 包含距离和时间信息的JSON字符串
     """
-    url = API_ENDPOINTS["distance"]
     params = {
-        "key": AMAP_API_KEY,
         "origins": origins,
         "destination": destinations,
         "type": type_distance,
         "output": "json"
     }
     
-    data = make_request(url, params)
+    data = await amap_get("distance", params)
     
     if data["status"] == "1":
         results = []
@@ -386,5 +1073,257 @@ def distance_calculation(origins: str, destinations: str, type_distance: Optiona
         }, ensure_ascii=False, indent=2)
 
 
+# 距离矩阵配置
+DISTANCE_MAX_ORIGINS = 100  # 高德距离测量接口单次请求最多支持100个起点、1个终点
+MATRIX_MAX_ELEMENTS = int(os.getenv("AMAP_MATRIX_MAX_ELEMENTS", "2500"))
+MATRIX_CACHE_SIZE = int(os.getenv("AMAP_MATRIX_CACHE_SIZE", "20000"))
+MATRIX_CACHE_TTL = float(os.getenv("AMAP_MATRIX_CACHE_TTL", "3600"))
+OPTIMIZE_MAX_POINTS = int(os.getenv("AMAP_OPTIMIZE_MAX_POINTS", "30"))
+# 出行方式到距离测量接口type参数的映射
+MATRIX_MODES = {"driving": 1, "straight": 0, "walking": 3}
+# 点对缓存：(起点, 终点, type) -> (写入时间, 距离米, 时间秒)
+_pair_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def _parse_points(text: str) -> List[str]:
+    """解析"经度,纬度|经度,纬度"形式的坐标列表，统一为6位小数以便缓存命中"""
+    points = []
+    for item in text.replace(";", "|").split("|"):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            lng, lat = (float(v) for v in item.split(","))
+        except ValueError:
+            raise ValueError(f"坐标格式错误: {item}，应为 经度,纬度")
+        points.append(f"{lng:.6f},{lat:.6f}")
+    return points
+
+
+def _cache_pair(key: tuple, distance: Optional[int], duration: Optional[int]):
+    _pair_cache[key] = (time.monotonic(), distance, duration)
+    _pair_cache.move_to_end(key)
+    while len(_pair_cache) > MATRIX_CACHE_SIZE:
+        _pair_cache.popitem(last=False)
+
+
+def _cached_pair(key: tuple) -> Optional[tuple]:
+    entry = _pair_cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] > MATRIX_CACHE_TTL:
+        del _pair_cache[key]
+        return None
+    return entry[1], entry[2]
+
+
+async def _compute_matrix(origins: List[str], destinations: List[str], type_distance: int) -> dict:
+    """
+    计算起终点矩阵
+
+    未命中缓存的点对按终点分组、每组最多100个起点拆分为多个请求并发发出，
+    请求经过amap_get，因此同样受请求合并和限流控制。
+    """
+    distance = [[None] * len(destinations) for _ in origins]
+    duration = [[None] * len(destinations) for _ in origins]
+    missing: Dict[int, List[int]] = {}
+    cached = 0
+    for j, dest in enumerate(destinations):
+        for i, origin in enumerate(origins):
+            if origin == dest:
+                distance[i][j], duration[i][j] = 0, 0
+                continue
+            hit = _cached_pair((origin, dest, type_distance))
+            if hit is None:
+                missing.setdefault(j, []).append(i)
+            else:
+                distance[i][j], duration[i][j] = hit
+                cached += 1
+
+    errors = []
+
+    async def fetch_chunk(j: int, chunk: List[int]):
+        data = await amap_get("distance", {
+            "origins": "|".join(origins[i] for i in chunk),
+            "destination": destinations[j],
+            "type": type_distance,
+            "output": "json"
+        })
+        if data["status"] != "1":
+            errors.append(data.get("info", "未知错误"))
+            return
+        for result in data["results"]:
+            i = chunk[int(result["origin_id"]) - 1]
+            if not result.get("distance"):
+                continue
+            dist = int(float(result["distance"]))
+            dur = int(float(result["duration"])) if result.get("duration") else None
+            distance[i][j], duration[i][j] = dist, dur
+            _cache_pair((origins[i], destinations[j], type_distance), dist, dur)
+
+    tasks = [
+        fetch_chunk(j, idxs[k:k + DISTANCE_MAX_ORIGINS])
+        for j, idxs in missing.items()
+        for k in range(0, len(idxs), DISTANCE_MAX_ORIGINS)
+    ]
+    await asyncio.gather(*tasks)
+    return {
+        "distance": distance,
+        "duration": duration,
+        "cached_pairs": cached,
+        "requests": len(tasks),
+        "errors": errors
+    }
+
+
+@mcp.tool()
+async def route_matrix(origins: str, destinations: str, mode: Optional[str] = "driving") -> str:
+    """
+    距离矩阵 - 批量计算多个起点到多个终点的距离和时间
+    
+    Args:
+        origins (str): 起点坐标列表，格式：经度,纬度|经度,纬度
+        destinations (str): 终点坐标列表，格式：经度,纬度|经度,纬度
+        mode (str, optional): driving-驾车，walking-步行（5公里以内），straight-直线距离，默认driving
+    
+    Returns:
+        str: 紧凑的JSON字符串，distance_m[i][j]和duration_s[i][j]为第i个起点到第j个终点的距离（米）和时间（秒），null表示无结果
+    """
+    mode = mode or "driving"
+    if mode not in MATRIX_MODES:
+        return json.dumps({
+            "status": "error",
+            "message": f"不支持的出行方式: {mode}，可选: {', '.join(MATRIX_MODES)}"
+        }, ensure_ascii=False, indent=2)
+    try:
+        origin_points = _parse_points(origins)
+        dest_points = _parse_points(destinations)
+    except ValueError as e:
+        return json.dumps({"status": "error", "message": str(e)}, ensure_ascii=False, indent=2)
+    if not origin_points or not dest_points:
+        return json.dumps({"status": "error", "message": "起点和终点均不能为空"}, ensure_ascii=False, indent=2)
+    if len(origin_points) * len(dest_points) > MATRIX_MAX_ELEMENTS:
+        return json.dumps({
+            "status": "error",
+            "message": f"矩阵过大: {len(origin_points)}x{len(dest_points)}，最多支持{MATRIX_MAX_ELEMENTS}个点对"
+        }, ensure_ascii=False, indent=2)
+
+    matrix = await _compute_matrix(origin_points, dest_points, MATRIX_MODES[mode])
+    result = {
+        "status": "success" if not matrix["errors"] else "partial",
+        "mode": mode,
+        "origins": len(origin_points),
+        "destinations": len(dest_points),
+        "distance_m": matrix["distance"],
+        "duration_s": matrix["duration"],
+        "cached_pairs": matrix["cached_pairs"],
+        "requests": matrix["requests"]
+    }
+    if matrix["errors"]:
+        result["errors"] = sorted(set(matrix["errors"]))
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+
+
+@mcp.tool()
+async def optimize_visit_order(
+    points: str,
+    mode: Optional[str] = "driving",
+    start_index: Optional[int] = 0,
+    return_to_start: Optional[bool] = False,
+    optimize_for: Optional[str] = "duration",
+) -> str:
+    """
+    访问顺序优化 - 为多个途经点计算近似最优的访问顺序（最近邻 + 2-opt）
+    
+    Args:
+        points (str): 待访问的坐标列表，格式：经度,纬度|经度,纬度
+        mode (str, optional): driving-驾车，walking-步行，straight-直线距离，默认driving
+        start_index (int, optional): 出发点在points中的下标，默认0
+        return_to_start (bool, optional): 是否需要回到出发点，默认否
+        optimize_for (str, optional): duration-最短时间，distance-最短距离，默认duration
+    
+    Returns:
+        str: 包含访问顺序（points中的下标）、按顺序排列的坐标、总距离和总时间的JSON字符串
+    """
+    mode = mode or "driving"
+    start_index = start_index or 0
+    optimize_for = optimize_for or "duration"
+    if mode not in MATRIX_MODES:
+        return json.dumps({
+            "status": "error",
+            "message": f"不支持的出行方式: {mode}，可选: {', '.join(MATRIX_MODES)}"
+        }, ensure_ascii=False, indent=2)
+    if optimize_for not in ("duration", "distance"):
+        return json.dumps({
+            "status": "error",
+            "message": f"不支持的优化目标: {optimize_for}，可选: duration, distance"
+        }, ensure_ascii=False, indent=2)
+    try:
+        coords = _parse_points(points)
+    except ValueError as e:
+        return json.dumps({"status": "error", "message": str(e)}, ensure_ascii=False, indent=2)
+    if len(coords) < 2 or len(coords) > OPTIMIZE_MAX_POINTS:
+        return json.dumps({
+            "status": "error",
+            "message": f"途经点数量应在2到{OPTIMIZE_MAX_POINTS}之间，当前为{len(coords)}"
+        }, ensure_ascii=False, indent=2)
+    if not 0 <= start_index < len(coords):
+        return json.dumps({"status": "error", "message": f"start_index超出范围: {start_index}"}, ensure_ascii=False, indent=2)
+
+    matrix = await _compute_matrix(coords, coords, MATRIX_MODES[mode])
+    # 直线距离没有时间数据，只能按距离优化
+    metric = "distance" if mode == "straight" else optimize_for
+    order = route_optimizer.optimize_order(matrix[metric], start_index, return_to_start)
+    legs = list(zip(order, order[1:] + order[:1] if return_to_start else order[1:]))
+
+    def total(key):
+        values = [matrix[key][a][b] for a, b in legs]
+        return None if any(v is None for v in values) else sum(values)
+
+    def cost(route):
+        value = route_optimizer.route_cost(matrix[metric], route, return_to_start)
+        return None if value == route_optimizer.UNREACHABLE else value
+
+    input_order = [start_index] + [i for i in range(len(coords)) if i != start_index]
+    result = {
+        "status": "success" if not matrix["errors"] else "partial",
+        "mode": mode,
+        "optimize_for": metric,
+        "return_to_start": return_to_start,
+        "order": order,
+        "points": "|".join(coords[i] for i in order),
+        "total_distance_m": total("distance"),
+        "total_duration_s": total("duration"),
+        "input_order_cost": cost(input_order),
+        "optimized_cost": cost(order)
+    }
+    if matrix["errors"]:
+        result["errors"] = sorted(set(matrix["errors"]))
+    return json.dumps(result, ensure_ascii=False, indent=2)
+
+
+@mcp.tool()
+async def amap_service_stats() -> str:
+    """
+    服务统计 - 查看高德API请求的运行计数、缓存、预取和本地地名索引的命中情况、限流状态和各密钥今日配额使用情况
+
+    Returns:
+        str: 包含请求合并、响应缓存、预测预取、本地地名解析、限流排队统计和配额使用量的JSON字符串
+    """
+    stats = dict(_single_flight.stats)
+    stats["inflight"] = _single_flight.inflight
+    return json.dumps({
+        "status": "success",
+        "request_coalescing": stats,
+        "response_cache": _response_cache.snapshot(),
+        "gazetteer": _gazetteer_stats,
+        "speculation": dict(_speculation_stats, **_speculator.snapshot()) if _speculator is not None else None,
+        "rate_limit": _key_pool.snapshot(),
+        "poi_store": _poi_store.snapshot() if _poi_store is not None else None
+    }, ensure_ascii=False, indent=2)
+
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
\ No newline at end of file
+    # 被SIGTERM终止时也走正常退出流程，保证atexit里的配额写盘会执行
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    mcp.run(transport=MCP_TRANSPORT)
\ No newline at end of file
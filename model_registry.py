@@ -0,0 +1,239 @@
+"""
+DeepSeek模型客户端注册表
+
+进程内按(模型名, 参数)复用 ChatDeepSeek 实例，所有实例共享HTTP连接池（keep-alive），
+避免每次"应用设置"或每个浏览器会话都重新建立TLS连接：
+
+- 同步请求共享一个 httpx.Client（线程安全，整个进程一个）
+- httpx.AsyncClient 的连接与创建它的事件循环绑定，因此每个事件循环一个异步连接池。
+  Streamlit中每个浏览器会话有自己的事件循环，同一会话内的所有模型共享该连接池，
+  事件循环被回收后对应的连接池和模型实例也随之释放
+
+连接池参数通过环境变量配置（见下方常量）。
+
+ModelSwitch 是可以直接交给 create_react_agent 的Runnable：每次调用时按
+config["configurable"]["model"] 从注册表取模型，切换模型无需重建MCP客户端或代理图。
+"""
+
+import asyncio
+import json
+import os
+import threading
+import weakref
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence
+
+import httpx
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from admission import llm_gate
+from prompt_cache import canonical_tools
+
+DEFAULT_MODEL = os.getenv("DEEPSEEK_DEFAULT_MODEL", "deepseek-chat")
+# 默认的模型参数（stream_usage使流式响应也返回token用量）
+DEFAULT_MODEL_PARAMS = {"temperature": 0.1, "stream_usage": True}
+
+MAX_CONNECTIONS = int(os.getenv("DEEPSEEK_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DEEPSEEK_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("DEEPSEEK_KEEPALIVE_EXPIRY", "60"))
+# 单次请求超时（秒），流式响应按读取间隔计算
+REQUEST_TIMEOUT = float(os.getenv("DEEPSEEK_REQUEST_TIMEOUT", "120"))
+CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "10"))
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _params_key(model: str, params: Dict[str, Any]) -> str:
+    return json.dumps([model, params], sort_keys=True, default=str)
+
+
+def _current_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class _LoopPool:
+    """一个事件循环内的异步连接池及使用它的模型实例"""
+
+    def __init__(self):
+        self.http_async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+        self.models: Dict[str, Any] = {}
+
+
+class ModelRegistry:
+    """
+    进程级的模型客户端注册表
+
+    get()返回当前事件循环内(模型名, 参数)对应的 ChatDeepSeek 实例，不存在时创建。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http_client: Optional[httpx.Client] = None
+        self._loop_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopPool]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # 没有运行中的事件循环时（同步调用）创建的模型
+        self._sync_models: Dict[str, Any] = {}
+        self.stats = {"created": 0, "reused": 0}
+
+    def _shared_http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+        return self._http_client
+
+    def get(self, model: str = DEFAULT_MODEL, **params):
+        """
+        返回(模型名, 参数)对应的 ChatDeepSeek 实例
+
+        Args:
+            model (str): 模型名称，如 deepseek-chat、deepseek-reasoner
+            **params: 其他 ChatDeepSeek 参数，未指定的使用 DEFAULT_MODEL_PARAMS
+        """
+        params = {**DEFAULT_MODEL_PARAMS, **params}
+        key = _params_key(model, params)
+        loop = _current_loop()
+        with self._lock:
+            if loop is None:
+                models, http_async_client = self._sync_models, None
+            else:
+                pool = self._loop_pools.get(loop)
+                if pool is None:
+                    pool = _LoopPool()
+                    self._loop_pools[loop] = pool
+                models, http_async_client = pool.models, pool.http_async_client
+
+            instance = models.get(key)
+            if instance is not None:
+                self.stats["reused"] += 1
+                return instance
+
+            from langchain_deepseek import ChatDeepSeek
+
+            client_kwargs = {"http_client": self._shared_http_client()}
+            if http_async_client is not None:
+                client_kwargs["http_async_client"] = http_async_client
+            instance = ChatDeepSeek(model=model, **client_kwargs, **params)
+            models[key] = instance
+            self.stats["created"] += 1
+            return instance
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            loops = list(self._loop_pools.values())
+            return {
+                "event_loops": len(loops),
+                "models": sum(len(pool.models) for pool in loops) + len(self._sync_models),
+                "max_connections": MAX_CONNECTIONS,
+                "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+                "keepalive_expiry": KEEPALIVE_EXPIRY,
+                **self.stats,
+            }
+
+
+registry = ModelRegistry()
+
+
+def get_model(model: str = DEFAULT_MODEL, **params):
+    """从进程级注册表获取模型实例"""
+    return registry.get(model, **params)
+
+
+class ModelSwitch(Runnable):
+    """
+    按调用配置选择模型的Runnable
+
+    每次调用读取 config["configurable"]["model"]（缺省为default_model），
+    从注册表取得模型并绑定工具后执行。bind_tools()返回绑定了工具的新ModelSwitch，
+    因此可以直接作为 create_react_agent 的model参数。
+    """
+
+    def __init__(
+        self,
+        default_model: str = DEFAULT_MODEL,
+        model_params: Optional[Dict[str, Any]] = None,
+        tools: Optional[Sequence[Any]] = None,
+        tool_kwargs: Optional[Dict[str, Any]] = None,
+        model_registry: Optional[ModelRegistry] = None,
+    ):
+        self.default_model = default_model
+        self.model_params = dict(model_params or {})
+        # 工具定义规范化并排序，保证提示词前缀稳定（见prompt_cache）
+        self.tools = canonical_tools(tools) if tools else None
+        self.tool_kwargs = dict(tool_kwargs or {})
+        self.registry = model_registry or registry
+        # id(模型实例) -> (模型实例, 绑定工具后的Runnable)
+        self._bound: Dict[int, tuple] = {}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs) -> "ModelSwitch":
+        return ModelSwitch(self.default_model, self.model_params, tools, kwargs, self.registry)
+
+    def model_name(self, config: Optional[RunnableConfig] = None) -> str:
+        configurable = (config or {}).get("configurable") or {}
+        return configurable.get("model") or self.default_model
+
+    def resolve(self, config: Optional[RunnableConfig] = None) -> Runnable:
+        """返回本次调用实际使用的（已绑定工具的）模型"""
+        return self.bound_model(self.model_name(config))
+
+    def bound_model(self, name: str) -> Runnable:
+        """返回名为name的（已绑定工具的）模型"""
+        model = self.registry.get(name, **self.model_params)
+        if not self.tools:
+            return model
+        entry = self._bound.get(id(model))
+        if entry is None or entry[0] is not model:
+            entry = (model, model.bind_tools(self.tools, **self.tool_kwargs))
+            self._bound[id(model)] = entry
+        return entry[1]
+
+    # 实际的模型调用都经过admission的llm闸门，限制进程内同时进行的模型调用数
+
+    @staticmethod
+    def _call(model: Runnable, input: Any, config: Optional[RunnableConfig], **kwargs):
+        with llm_gate().hold():
+            return model.invoke(input, config, **kwargs)
+
+    @staticmethod
+    async def _acall(model: Runnable, input: Any, config: Optional[RunnableConfig], **kwargs):
+        async with llm_gate().slot():
+            return await model.ainvoke(input, config, **kwargs)
+
+    @staticmethod
+    def _stream(model: Runnable, input: Any, config: Optional[RunnableConfig], **kwargs) -> Iterator[Any]:
+        with llm_gate().hold():
+            yield from model.stream(input, config, **kwargs)
+
+    @staticmethod
+    async def _astream(
+        model: Runnable, input: Any, config: Optional[RunnableConfig], **kwargs
+    ) -> AsyncIterator[Any]:
+        async with llm_gate().slot():
+            async for chunk in model.astream(input, config, **kwargs):
+                yield chunk
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        return self._call(self.resolve(config), input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        return await self._acall(self.resolve(config), input, config, **kwargs)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> Iterator[Any]:
+        yield from self._stream(self.resolve(config), input, config, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> AsyncIterator[Any]:
+        async for chunk in self._astream(self.resolve(config), input, config, **kwargs):
+            yield chunk
@@ -0,0 +1,337 @@
+"""
+模型路由
+
+ReAct代理的每一步并不都需要最强的模型：根据用户问题选择工具这类调度步骤用快速模型即可，
+工具返回结果后的综合回答才交给强模型。路由规则从 model_config.json 的 "routing" 部分读取：
+
+- dispatch: 最后一条消息是用户提问（调度/简单问题），默认使用快速模型
+- complex: 用户提问超过 long_query_chars 个字符，默认使用强模型
+- synthesis: 最后一条消息是工具结果（综合回答），默认使用强模型
+
+快速模型的输出为空、包含无法解析的工具调用或调用了不存在的工具时，视为置信度低，
+用强模型重新生成（escalation）。strong_model 为 null 时使用侧边栏中选择的模型。
+可能升级的快速模型调用不流式输出：输出先在本地检查，只有被采用的结果才交给回调（界面、工具调用拼装、
+追踪录制），被丢弃的输出不会出现在界面或trace中。
+
+每条路由的调用次数、升级次数、耗时和token用量（含缓存命中数）记录在 RouteStats 中。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackManager, CallbackManager
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.runnables import RunnableConfig, ensure_config
+
+from model_registry import DEFAULT_MODEL, ModelRegistry, ModelSwitch
+from prompt_cache import token_usage
+
+MODEL_CONFIG_PATH = os.getenv("MODEL_CONFIG_PATH", "model_config.json")
+
+TIERS = ("fast", "strong")
+ROUTES = ("dispatch", "complex", "synthesis")
+ESCALATION_REASONS = ("empty", "invalid_tool_call", "unknown_tool")
+
+# langgraph的messages流模式忽略带该标签的模型调用
+NOSTREAM_TAG = "nostream"
+
+DEFAULT_ROUTING = {
+    "enabled": True,
+    "fast_model": "deepseek-chat",
+    "strong_model": None,
+    "routes": {"dispatch": "fast", "complex": "strong", "synthesis": "strong"},
+    "long_query_chars": 300,
+    "escalate_on": list(ESCALATION_REASONS),
+}
+
+
+class RoutingPolicy:
+    """
+    路由规则
+
+    Args:
+        enabled (bool): 为False时所有步骤都使用所选模型
+        fast_model (str): 快速模型名称
+        strong_model (Optional[str]): 强模型名称，None表示使用所选模型
+        routes (dict): 路由名 -> "fast" / "strong"
+        long_query_chars (int): 用户提问超过该长度时走complex路由，0表示不区分
+        escalate_on (Sequence[str]): 触发升级的情况，取值见ESCALATION_REASONS
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        fast_model: str = "deepseek-chat",
+        strong_model: Optional[str] = None,
+        routes: Optional[Dict[str, str]] = None,
+        long_query_chars: int = 300,
+        escalate_on: Sequence[str] = ESCALATION_REASONS,
+    ):
+        self.enabled = enabled
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.routes = {**DEFAULT_ROUTING["routes"], **(routes or {})}
+        invalid = {tier for tier in self.routes.values() if tier not in TIERS}
+        if invalid:
+            raise ValueError(f"无效的模型层级: {', '.join(sorted(invalid))}，可选: {', '.join(TIERS)}")
+        self.long_query_chars = long_query_chars
+        self.escalate_on = set(escalate_on)
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "RoutingPolicy":
+        options = {**DEFAULT_ROUTING, **(data or {})}
+        return cls(**{key: options[key] for key in DEFAULT_ROUTING})
+
+    def route(self, messages: Sequence[BaseMessage]) -> str:
+        """根据对话的最后一条消息确定路由"""
+        last = messages[-1] if messages else None
+        if isinstance(last, ToolMessage):
+            return "synthesis"
+        if (
+            isinstance(last, HumanMessage)
+            and self.long_query_chars
+            and len(_text(last)) > self.long_query_chars
+        ):
+            return "complex"
+        return "dispatch"
+
+    def model_for(self, tier: str, selected_model: str) -> str:
+        if tier == "fast":
+            return self.fast_model or selected_model
+        return self.strong_model or selected_model
+
+    def escalation_reason(self, message: Any, tool_names: Optional[set]) -> Optional[str]:
+        """检查快速模型的输出，需要升级时返回原因"""
+        if not isinstance(message, AIMessage):
+            return None
+        if "invalid_tool_call" in self.escalate_on and message.invalid_tool_calls:
+            return "invalid_tool_call"
+        if "unknown_tool" in self.escalate_on and tool_names is not None:
+            if any(call["name"] not in tool_names for call in message.tool_calls):
+                return "unknown_tool"
+        if "empty" in self.escalate_on and not message.tool_calls and not _text(message).strip():
+            return "empty"
+        return None
+
+
+def load_routing_policy(path: str = MODEL_CONFIG_PATH) -> RoutingPolicy:
+    """从model_config.json读取路由规则，文件不存在时使用默认规则"""
+    if not os.path.exists(path):
+        return RoutingPolicy.from_dict(None)
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return RoutingPolicy.from_dict(config.get("routing"))
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part) for part in content or []
+    )
+
+
+def _as_messages(value: Any) -> List[BaseMessage]:
+    if hasattr(value, "to_messages"):
+        return value.to_messages()
+    if isinstance(value, dict):
+        value = value.get("messages", [])
+    return [message for message in value if isinstance(message, BaseMessage)]
+
+
+def _tool_name(tool: Any) -> Optional[str]:
+    if isinstance(tool, dict):
+        return (tool.get("function") or tool).get("name")
+    return getattr(tool, "name", None)
+
+
+class Escalated(Exception):
+    """快速模型的输出被丢弃、改由强模型重新生成：作为被丢弃那次调用的on_llm_error传给回调，message为被丢弃的输出"""
+
+    def __init__(self, reason: str, message: Any = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.message = message
+
+
+def _attempt_callbacks(manager_class, config: RunnableConfig):
+    """调用配置中的回调，登记的模型调用带NOSTREAM_TAG"""
+    return manager_class.configure(
+        config.get("callbacks"),
+        inheritable_tags=config.get("tags"),
+        local_tags=[NOSTREAM_TAG],
+        inheritable_metadata=config.get("metadata"),
+    )
+
+
+def _llm_result(message: Any) -> LLMResult:
+    generations = [ChatGeneration(message=message)] if isinstance(message, BaseMessage) else []
+    return LLMResult(generations=[generations])
+
+
+class RouteStats:
+    """按路由统计调用次数、升级次数、耗时和token用量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, dict] = {}
+
+    def record(self, route: str, model: str, seconds: float, message: Any, escalated_from: Optional[str] = None):
+        usage = token_usage(message)
+        with self._lock:
+            entry = self._routes.setdefault(route, {
+                "calls": 0,
+                "escalations": 0,
+                "seconds": 0.0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cache_read_tokens": 0,
+                "models": {},
+            })
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            for key, value in usage.items():
+                entry[key] += value
+            entry["models"][model] = entry["models"].get(model, 0) + 1
+            if escalated_from:
+                entry["escalations"] += 1
+                reasons = entry.setdefault("escalation_reasons", {})
+                reasons[escalated_from] = reasons.get(escalated_from, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for route, entry in self._routes.items():
+                item = json.loads(json.dumps(entry))
+                item["seconds"] = round(entry["seconds"], 3)
+                item["avg_latency"] = round(entry["seconds"] / entry["calls"], 3) if entry["calls"] else 0.0
+                result[route] = item
+            return result
+
+
+class RoutedModel(ModelSwitch):
+    """
+    带路由的ModelSwitch
+
+    每次调用按RoutingPolicy选择快速模型或强模型；强模型默认是config["configurable"]["model"]
+    指定的模型（即侧边栏中选择的模型）。升级产生的调用记为"<路由>:escalated"。
+    可能升级的快速模型调用不带回调执行，由本类代为登记一次带NOSTREAM_TAG的模型调用：
+    采用时以on_llm_end结束（langgraph随节点输出把整条消息发给messages流），
+    丢弃时以on_llm_error(Escalated)结束，强模型的调用照常流式输出。
+    stream/astream同样按路由选择模型，但输出已经流式返回，因此不做升级，也不计入统计。
+    """
+
+    def __init__(
+        self,
+        default_model: str = DEFAULT_MODEL,
+        model_params: Optional[Dict[str, Any]] = None,
+        tools: Optional[Sequence[Any]] = None,
+        tool_kwargs: Optional[Dict[str, Any]] = None,
+        model_registry: Optional[ModelRegistry] = None,
+        policy: Optional[RoutingPolicy] = None,
+        stats: Optional[RouteStats] = None,
+    ):
+        super().__init__(default_model, model_params, tools, tool_kwargs, model_registry)
+        self.policy = policy or RoutingPolicy()
+        self.stats = stats or RouteStats()
+        names = [_tool_name(tool) for tool in self.tools or []]
+        self.tool_names = set(filter(None, names)) if self.tools else None
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs) -> "RoutedModel":
+        return RoutedModel(
+            self.default_model, self.model_params, tools, kwargs, self.registry, self.policy, self.stats
+        )
+
+    def _plan(self, input: Any, config: Optional[RunnableConfig]):
+        selected = self.model_name(config)
+        if not self.policy.enabled:
+            return "selected", "strong", selected
+        route = self.policy.route(_as_messages(input))
+        tier = self.policy.routes[route]
+        return route, tier, self.policy.model_for(tier, selected)
+
+    def _escalation(self, tier: str, model: str, result: Any, config: Optional[RunnableConfig]):
+        if tier != "fast":
+            return None, None
+        reason = self.policy.escalation_reason(result, self.tool_names)
+        strong = self.policy.model_for("strong", self.model_name(config))
+        if reason is None or strong == model:
+            return None, None
+        return reason, strong
+
+    def _may_escalate(self, tier: str, model: str, config: Optional[RunnableConfig]) -> bool:
+        return (
+            tier == "fast"
+            and bool(self.policy.escalate_on)
+            and self.policy.model_for("strong", self.model_name(config)) != model
+        )
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        config = ensure_config(config)
+        route, tier, model = self._plan(input, config)
+        run = None
+        if self._may_escalate(tier, model, config):
+            manager = _attempt_callbacks(CallbackManager, config)
+            run = manager.on_chat_model_start({"name": model}, [_as_messages(input)], name=model)[0]
+        start = time.perf_counter()
+        try:
+            attempt_config = {**config, "callbacks": []} if run else config
+            result = self._call(self.bound_model(model), input, attempt_config, **kwargs)
+        except BaseException as e:
+            if run:
+                run.on_llm_error(e)
+            raise
+        self.stats.record(route, model, time.perf_counter() - start, result)
+        reason, strong = self._escalation(tier, model, result, config)
+        if run and reason:
+            run.on_llm_error(Escalated(reason, result))
+        elif run:
+            run.on_llm_end(_llm_result(result))
+        if reason:
+            start = time.perf_counter()
+            result = self._call(self.bound_model(strong), input, config, **kwargs)
+            self.stats.record(f"{route}:escalated", strong, time.perf_counter() - start, result, reason)
+        return result
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        config = ensure_config(config)
+        route, tier, model = self._plan(input, config)
+        run = None
+        if self._may_escalate(tier, model, config):
+            manager = _attempt_callbacks(AsyncCallbackManager, config)
+            run = (await manager.on_chat_model_start({"name": model}, [_as_messages(input)], name=model))[0]
+        start = time.perf_counter()
+        try:
+            attempt_config = {**config, "callbacks": []} if run else config
+            result = await self._acall(self.bound_model(model), input, attempt_config, **kwargs)
+        except BaseException as e:
+            if run:
+                await run.on_llm_error(e)
+            raise
+        self.stats.record(route, model, time.perf_counter() - start, result)
+        reason, strong = self._escalation(tier, model, result, config)
+        if run and reason:
+            await run.on_llm_error(Escalated(reason, result))
+        elif run:
+            await run.on_llm_end(_llm_result(result))
+        if reason:
+            start = time.perf_counter()
+            result = await self._acall(self.bound_model(strong), input, config, **kwargs)
+            self.stats.record(f"{route}:escalated", strong, time.perf_counter() - start, result, reason)
+        return result
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> Iterator[Any]:
+        _, _, model = self._plan(input, config)
+        yield from self._stream(self.bound_model(model), input, config, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> AsyncIterator[Any]:
+        _, _, model = self._plan(input, config)
+        async for chunk in self._astream(self.bound_model(model), input, config, **kwargs):
+            yield chunk
@@ -0,0 +1,282 @@
+"""
+本地POI索引
+
+把从高德获取到的POI持久化到SQLite，并在内存中按经纬度把POI放入约1公里见方的网格（空间索引），
+附近搜索只需检查覆盖半径的少量网格。
+
+本地只回答确实从高德获取过的范围，不用其他搜索顺带得到的POI猜测结果：
+
+- 查询记录: 每个文本搜索条件已获取到的结果顺序，相同条件的翻页请求直接从本地返回
+- 覆盖区域: 每次周边搜索记录中心、半径、筛选条件（关键词和类型）和返回的POI。结果完整时整个圆都已覆盖，
+  结果被截断时（按距离排序）只有到最远一条结果的距离以内是完整的。相同筛选条件的周边搜索的圆
+  落在某个覆盖区域内时，从该区域的POI中返回
+
+POI、查询记录和覆盖区域都有过期时间，过期的数据在查询时被忽略，下次从高德获取后覆盖。
+"""
+
+import json
+import math
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+EARTH_RADIUS = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine(lng1: float, lat1: float, lng2: float, lat2: float) -> float:
+    """两点间的球面距离（米）"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def parse_location(location: str) -> Optional[Tuple[float, float]]:
+    try:
+        lng, lat = location.split(",")
+        return float(lng), float(lat)
+    except (AttributeError, ValueError):
+        return None
+
+
+class PoiStore:
+    """
+    POI本地存储
+
+    Args:
+        path (str): SQLite数据库文件路径
+        ttl (float): POI和查询记录的有效期（秒）
+        cell_size (float): 空间网格的边长（度），默认0.01度约1公里
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 86400, cell_size: float = 0.01):
+        self.path = path
+        self.ttl = ttl
+        self.cell_size = cell_size
+        self._pois: Dict[str, dict] = {}
+        self._meta: Dict[str, Tuple[float, float, float]] = {}  # id -> (经度, 纬度, 获取时间)
+        self._grid: Dict[Tuple[int, int], Set[str]] = {}
+        self._queries: Dict[str, dict] = {}
+        # 筛选条件 -> 覆盖区域列表
+        self._areas: Dict[str, List[dict]] = {}
+        self.stats = {"local_hits": 0, "local_misses": 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pois (id TEXT PRIMARY KEY, data TEXT, fetched_at REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, ids TEXT, total INTEGER, fetched_at REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS areas (id INTEGER PRIMARY KEY, filters TEXT, longitude REAL, latitude REAL,"
+            " radius REAL, ids TEXT, fetched_at REAL)"
+        )
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        for poi_id, data, fetched_at in self._db.execute("SELECT id, data, fetched_at FROM pois"):
+            if fetched_at >= cutoff:
+                self._index(json.loads(data), fetched_at)
+        for key, ids, total, fetched_at in self._db.execute("SELECT key, ids, total, fetched_at FROM queries"):
+            if fetched_at >= cutoff:
+                self._queries[key] = {"ids": json.loads(ids), "total": total, "fetched_at": fetched_at}
+        rows = self._db.execute("SELECT id, filters, longitude, latitude, radius, ids, fetched_at FROM areas")
+        for area_id, filters, lng, lat, radius, ids, fetched_at in rows:
+            if fetched_at >= cutoff:
+                self._areas.setdefault(filters, []).append({
+                    "id": area_id, "center": (lng, lat), "radius": radius,
+                    "ids": set(json.loads(ids)), "fetched_at": fetched_at,
+                })
+
+    def _cell(self, lng: float, lat: float) -> Tuple[int, int]:
+        return int(math.floor(lng / self.cell_size)), int(math.floor(lat / self.cell_size))
+
+    def _unindex(self, poi_id: str):
+        self._pois.pop(poi_id, None)
+        lng, lat, _ = self._meta.pop(poi_id)
+        self._grid.get(self._cell(lng, lat), set()).discard(poi_id)
+
+    def _index(self, poi: dict, fetched_at: float) -> bool:
+        coords = parse_location(poi.get("location", ""))
+        poi_id = poi.get("id")
+        if not poi_id or coords is None:
+            return False
+        if poi_id in self._pois:
+            self._unindex(poi_id)
+        self._pois[poi_id] = poi
+        self._meta[poi_id] = (coords[0], coords[1], fetched_at)
+        self._grid.setdefault(self._cell(*coords), set()).add(poi_id)
+        return True
+
+    def _fresh(self, fetched_at: float, now: float) -> bool:
+        return now - fetched_at <= self.ttl
+
+    def upsert(self, pois: Iterable[dict]) -> int:
+        """写入或更新POI（每个POI需包含id和location字段），返回成功写入的数量"""
+        now = time.time()
+        rows = []
+        for poi in pois:
+            if self._index(poi, now):
+                rows.append((poi["id"], json.dumps(poi, ensure_ascii=False), now))
+        if rows:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO pois VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def record_query(self, key: str, offset: int, ids: List[str], total: int):
+        """
+        记录搜索条件key从第offset条开始获取到的结果
+
+        只维护从第0条开始的连续结果，不连续的页不记录（POI本身仍会被upsert）。
+        """
+        now = time.time()
+        entry = self._queries.get(key)
+        if entry is None or not self._fresh(entry["fetched_at"], now):
+            if offset != 0:
+                return
+            entry = {"ids": [], "total": total, "fetched_at": now}
+        if offset > len(entry["ids"]):
+            return
+        entry["ids"] = entry["ids"][:offset] + list(ids)
+        entry["total"] = total
+        self._queries[key] = entry
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry["ids"]), total, entry["fetched_at"]),
+            )
+
+    def lookup_query(self, key: str, offset: int, limit: int) -> Optional[Tuple[List[dict], int]]:
+        """
+        从本地返回搜索条件key的第offset条起的limit条结果
+
+        Returns:
+            (POI列表, 总数)；本地没有完整覆盖该范围或数据已过期时返回None
+        """
+        now = time.time()
+        entry = self._queries.get(key)
+        if entry is None or not self._fresh(entry["fetched_at"], now):
+            self.stats["local_misses"] += 1
+            return None
+        ids = entry["ids"]
+        end = min(offset + limit, entry["total"])
+        if end > len(ids) and len(ids) < entry["total"]:
+            self.stats["local_misses"] += 1
+            return None
+        pois = [self._pois[poi_id] for poi_id in ids[offset:end] if poi_id in self._pois]
+        if len(pois) < len(ids[offset:end]):
+            # 部分POI已被淘汰，视为未命中
+            self.stats["local_misses"] += 1
+            return None
+        self.stats["local_hits"] += 1
+        return pois, entry["total"]
+
+    def nearby(
+        self,
+        lng: float,
+        lat: float,
+        radius: float,
+        ids: Optional[Set[str]] = None,
+        limit: int = 20,
+    ) -> List[Tuple[float, dict]]:
+        """返回半径radius米内（ids不为空时只包括其中的POI）的POI，按距离升序排列，元素为(距离, POI)"""
+        now = time.time()
+        dlat = radius / METERS_PER_DEGREE
+        dlng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        min_cell = self._cell(lng - dlng, lat - dlat)
+        max_cell = self._cell(lng + dlng, lat + dlat)
+        results = []
+        for cx in range(min_cell[0], max_cell[0] + 1):
+            for cy in range(min_cell[1], max_cell[1] + 1):
+                for poi_id in self._grid.get((cx, cy), ()):
+                    if ids is not None and poi_id not in ids:
+                        continue
+                    p_lng, p_lat, fetched_at = self._meta[poi_id]
+                    if not self._fresh(fetched_at, now):
+                        continue
+                    distance = haversine(lng, lat, p_lng, p_lat)
+                    if distance <= radius:
+                        results.append((distance, self._pois[poi_id]))
+        results.sort(key=lambda item: item[0])
+        return results[:limit]
+
+    def record_area(
+        self, filters: str, lng: float, lat: float, radius: float, ids: List[str], complete: bool
+    ) -> float:
+        """
+        记录一次周边搜索覆盖的区域（ids中的POI需已upsert），返回完整覆盖的半径
+
+        Args:
+            filters (str): 筛选条件（关键词和类型），只有相同条件的查询使用该区域
+            complete (bool): 结果是否完整；不完整时结果需按距离排序，覆盖半径为最远一条结果的距离
+        """
+        known = [poi_id for poi_id in ids if poi_id in self._meta]
+        if not complete:
+            radius = max((haversine(lng, lat, *self._meta[poi_id][:2]) for poi_id in known), default=0.0)
+        if radius <= 0:
+            return 0.0
+        now = time.time()
+        areas = self._areas.setdefault(filters, [])
+        # 被新区域包含的旧区域不再需要
+        stale = [
+            area for area in areas
+            if not self._fresh(area["fetched_at"], now)
+            or haversine(lng, lat, *area["center"]) + area["radius"] <= radius
+        ]
+        with self._db:
+            for area in stale:
+                areas.remove(area)
+                self._db.execute("DELETE FROM areas WHERE id = ?", (area["id"],))
+            cursor = self._db.execute(
+                "INSERT INTO areas (filters, longitude, latitude, radius, ids, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (filters, lng, lat, radius, json.dumps(known), now),
+            )
+        areas.append({"id": cursor.lastrowid, "center": (lng, lat), "radius": radius, "ids": set(known), "fetched_at": now})
+        return radius
+
+    def lookup_area(
+        self, filters: str, lng: float, lat: float, radius: float, limit: int
+    ) -> Optional[List[Tuple[float, dict]]]:
+        """
+        从覆盖区域返回filters条件下离(lng, lat)最近的limit个半径radius米内的POI
+
+        查询的圆落在某个未过期的覆盖区域内时结果是完整的；只有一部分在区域内时，
+        区域内与中心的距离足够近的部分已包含至少limit个POI也可以回答（它们就是最近的limit个）。
+
+        Returns:
+            按距离升序的(距离, POI)列表；没有可用的覆盖区域时返回None
+        """
+        now = time.time()
+        best, reach = None, 0.0
+        for area in self._areas.get(filters, ()):
+            if not self._fresh(area["fetched_at"], now):
+                continue
+            inside = min(radius, area["radius"] - haversine(lng, lat, *area["center"]))
+            if inside > reach:
+                best, reach = area, inside
+        if best is not None:
+            results = self.nearby(lng, lat, reach, ids=best["ids"], limit=limit)
+            if reach >= radius or len(results) >= limit:
+                self.stats["local_hits"] += 1
+                return results
+        self.stats["local_misses"] += 1
+        return None
+
+    def snapshot(self) -> dict:
+        return {
+            "path": self.path,
+            "pois": len(self._pois),
+            "queries": len(self._queries),
+            "grid_cells": sum(1 for ids in self._grid.values() if ids),
+            "areas": sum(len(areas) for areas in self._areas.values()),
+            "ttl_seconds": self.ttl,
+            **self.stats,
+        }
@@ -0,0 +1,140 @@
+"""
+路线几何压缩编码
+
+高德返回的polyline是"经度,纬度;经度,纬度;..."形式的明文字符串，长路线会非常大。
+这里提供两种紧凑编码：
+
+- google: Google Encoded Polyline Algorithm，按规范先纬度后经度编码，可被大多数地图SDK直接解码
+- delta_varint: 坐标差分 + zigzag + varint，再做URL安全的base64编码，按经度、纬度的顺序编码
+
+所有函数的输入输出坐标点均为(经度, 纬度)元组，与高德保持一致。
+"""
+
+import base64
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+FORMATS = ("google", "delta_varint")
+
+
+def parse_amap_polyline(polyline: str) -> List[Point]:
+    """解析高德的polyline字符串"""
+    points = []
+    if not polyline:
+        return points
+    for pair in polyline.split(";"):
+        if not pair:
+            continue
+        lng, lat = pair.split(",")
+        points.append((float(lng), float(lat)))
+    return points
+
+
+def merge_polylines(polylines: Iterable[str]) -> List[Point]:
+    """将各步骤的polyline拼接为整条路线，去掉相邻步骤衔接处重复的点"""
+    points: List[Point] = []
+    for polyline in polylines:
+        for point in parse_amap_polyline(polyline):
+            if not points or points[-1] != point:
+                points.append(point)
+    return points
+
+
+def _encode_signed(value: int, chunks: List[str]):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_google(points: Sequence[Point], precision: int = 5) -> str:
+    """按Google Encoded Polyline算法编码"""
+    factor = 10 ** precision
+    chunks: List[str] = []
+    prev_lat = prev_lng = 0
+    for lng, lat in points:
+        lat_i = int(round(lat * factor))
+        lng_i = int(round(lng * factor))
+        _encode_signed(lat_i - prev_lat, chunks)
+        _encode_signed(lng_i - prev_lng, chunks)
+        prev_lat, prev_lng = lat_i, lng_i
+    return "".join(chunks)
+
+
+def decode_google(encoded: str, precision: int = 5) -> List[Point]:
+    """解码Google Encoded Polyline"""
+    factor = 10 ** precision
+    points: List[Point] = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lng / factor, lat / factor))
+    return points
+
+
+def _write_varint(value: int, out: bytearray):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_delta_varint(points: Sequence[Point], precision: int = 6) -> str:
+    """差分 + zigzag varint编码，结果为不带填充的URL安全base64字符串"""
+    factor = 10 ** precision
+    out = bytearray()
+    prev_lng = prev_lat = 0
+    for lng, lat in points:
+        lng_i = int(round(lng * factor))
+        lat_i = int(round(lat * factor))
+        _write_varint(lng_i - prev_lng, out)
+        _write_varint(lat_i - prev_lat, out)
+        prev_lng, prev_lat = lng_i, lat_i
+    return base64.urlsafe_b64encode(bytes(out)).decode("ascii").rstrip("=")
+
+
+def decode_delta_varint(encoded: str, precision: int = 6) -> List[Point]:
+    """解码encode_delta_varint的结果"""
+    factor = 10 ** precision
+    data = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value = shift = 0
+    points: List[Point] = []
+    lng = lat = 0
+    for i in range(0, len(values) - 1, 2):
+        lng += values[i]
+        lat += values[i + 1]
+        points.append((lng / factor, lat / factor))
+    return points
+
+
+def encode(points: Sequence[Point], fmt: str = "google", precision: Optional[int] = None) -> str:
+    """按指定格式编码，precision为None时使用该格式的默认精度"""
+    if fmt == "google":
+        return encode_google(points, 5 if precision is None else precision)
+    if fmt == "delta_varint":
+        return encode_delta_varint(points, 6 if precision is None else precision)
+    raise ValueError(f"不支持的polyline编码格式: {fmt}，可选: {', '.join(FORMATS)}")
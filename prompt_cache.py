@@ -0,0 +1,85 @@
+"""
+提示词前缀缓存
+
+DeepSeek会缓存请求的公共前缀（系统提示词 + 工具定义 + 历史消息），前缀完全相同的部分按缓存命中计费且首个token更快返回。
+工具定义来自MCP服务器的 list_tools 结果，顺序和JSON键顺序在每次初始化时都可能不同，导致前缀变化、缓存失效。
+
+- canonical_tools(): 把工具转换为OpenAI函数格式，按名称排序并递归排序JSON键，保证相同的工具集序列化结果完全一致
+- prefix_hash(): 系统提示词 + 规范化工具定义的哈希，写入调用配置的metadata，便于在追踪中确认前缀是否稳定
+- token_usage(): 从模型响应中提取输入/输出token数和缓存命中token数
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Sequence
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _canonical(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def canonical_tool(tool: Any) -> dict:
+    """把单个工具转换为键有序的OpenAI函数定义"""
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    schema = _canonical(convert_to_openai_tool(tool))
+    parameters = schema.get("function", {}).get("parameters")
+    if isinstance(parameters, dict) and isinstance(parameters.get("required"), list):
+        # required的顺序不影响语义，排序后保证稳定
+        parameters["required"] = sorted(parameters["required"])
+    return schema
+
+
+def canonical_tools(tools: Iterable[Any]) -> List[dict]:
+    """规范化并按名称排序工具定义"""
+    schemas = [canonical_tool(tool) for tool in tools]
+    return sorted(schemas, key=lambda schema: schema.get("function", {}).get("name", ""))
+
+
+def serialize_tools(tools: Sequence[dict]) -> str:
+    return json.dumps(tools, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def prefix_hash(system_prompt: str, tools: Sequence[Any]) -> str:
+    """系统提示词和工具定义组成的提示词前缀的哈希（16位十六进制）"""
+    digest = hashlib.sha256()
+    digest.update(system_prompt.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(serialize_tools(canonical_tools(tools)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def token_usage(message: Any) -> Dict[str, int]:
+    """
+    提取一条模型响应的token用量
+
+    缓存命中数优先取 usage_metadata.input_token_details.cache_read，
+    其次取DeepSeek原始用量中的 prompt_cache_hit_tokens。
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    cache_read = details.get("cache_read")
+    if cache_read is None:
+        raw = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+        cache_read = raw.get("prompt_cache_hit_tokens", 0)
+    return {
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "cache_read_tokens": cache_read or 0,
+    }
+
+
+def sum_usage(messages: Iterable[Any]) -> Dict[str, int]:
+    """汇总多条消息中模型响应（AIMessage）的token用量"""
+    total = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0}
+    for message in messages:
+        if getattr(message, "type", None) != "ai":
+            continue
+        total["calls"] += 1
+        for key, value in token_usage(message).items():
+            total[key] += value
+    return total
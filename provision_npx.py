@@ -0,0 +1,343 @@
+"""
+npx启动的MCP服务器的本地安装
+
+config.json中用 `npx -y <包>`（或 `node /path/to/npx ...`）启动的服务器每次启动时npx都要向npm仓库查询版本，
+`@latest` 还可能重新下载，启动慢几秒，离线时直接失败。本模块把这些包安装到本地目录并固定版本：
+
+- provision(): 对每个npx服务器查询一次版本（之后使用锁文件中的版本，--upgrade时重新查询），
+  安装到 <MCP_NPX_CACHE>/<包名>@<版本>，并把包名、版本和可执行文件路径写入锁文件（MCP_NPX_LOCK）
+- local_launch(): 解析服务器配置时（config_schema）查找锁文件，已安装的包改为用node直接运行其可执行文件，
+  不再经过npx和npm仓库。config.json本身不修改，删除锁文件即恢复原来的启动方式
+
+用法:
+    python provision_npx.py                  # 安装config.json中的npx服务器并写入锁文件
+    python provision_npx.py --upgrade        # 重新查询版本（如@latest）并更新锁文件
+    python provision_npx.py --bench --runs 3 # 同时比较安装前后每个服务器的启动耗时
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+NPX_CACHE_DIR = os.getenv("MCP_NPX_CACHE", ".mcp_packages")
+NPX_LOCK_PATH = os.getenv("MCP_NPX_LOCK", "mcp_packages.lock.json")
+# 为0时忽略锁文件，仍然通过npx启动
+NPX_LOCAL = os.getenv("MCP_NPX_LOCAL", "1") != "0"
+# 单个包的版本查询和安装的超时时间（秒）
+NPM_TIMEOUT = float(os.getenv("MCP_NPX_INSTALL_TIMEOUT", "300"))
+
+# npx自身的选项: 不带参数的 / 带一个参数的
+_NPX_FLAGS = {"-y", "--yes", "-q", "--quiet", "--prefer-offline", "--prefer-online", "--no-install", "--no"}
+_NPX_OPTIONS = {"-p", "--package", "--registry", "--cache"}
+_PACKAGE_PATTERN = re.compile(r"^(@[^/@\s]+/[^/@\s]+|[^/@\s][^/@\s]*)(?:@(\S+))?$")
+
+
+@dataclass(frozen=True)
+class NpxInvocation:
+    """一条npx启动命令: npx [选项] <包>[@版本] [参数...]"""
+
+    name: str
+    requested: str
+    # -p/--package指定包时要运行的可执行文件名
+    bin_name: Optional[str]
+    args: Tuple[str, ...]
+    # 原命令用node运行npx时的node路径
+    node: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """锁文件中的键（-p指定包时附加可执行文件名）"""
+        key = f"{self.name}@{self.requested}"
+        return f"{key} {self.bin_name}" if self.bin_name else key
+
+
+def _is_npx(path: str) -> bool:
+    base = os.path.basename(path).lower()
+    return base in ("npx", "npx.cmd", "npx.exe", "npx-cli.js")
+
+
+def parse_npx(command: Optional[str], args: List[str]) -> Optional[NpxInvocation]:
+    """识别npx启动命令，不是npx时返回None"""
+    if not command:
+        return None
+    node = None
+    if _is_npx(command):
+        npx_args = list(args)
+    elif os.path.basename(command).lower() in ("node", "node.exe") and args and _is_npx(args[0]):
+        node, npx_args = command, list(args[1:])
+    else:
+        return None
+
+    package, index = None, 0
+    while index < len(npx_args):
+        arg = npx_args[index]
+        if arg in _NPX_OPTIONS:
+            if arg in ("-p", "--package") and index + 1 < len(npx_args):
+                package = npx_args[index + 1]
+            index += 2
+        elif arg.startswith("--package="):
+            package = arg.split("=", 1)[1]
+            index += 1
+        elif arg in _NPX_FLAGS or (arg.startswith("-") and arg != "--"):
+            index += 1
+        else:
+            break
+    positional = npx_args[index:]
+    if positional[:1] == ["--"]:
+        positional = positional[1:]
+    if not positional:
+        return None
+
+    bin_name = None
+    if package is None:
+        package, rest = positional[0], positional[1:]
+    else:
+        bin_name, rest = positional[0], positional[1:]
+    match = _PACKAGE_PATTERN.match(package)
+    if match is None:
+        # 本地路径、git地址等不处理
+        return None
+    return NpxInvocation(match.group(1), match.group(2) or "latest", bin_name, tuple(rest), node)
+
+
+# ----- 锁文件 -----
+
+_lock_cache: Dict[str, Tuple[Optional[Tuple[int, int]], dict]] = {}
+_lock_cache_lock = threading.Lock()
+
+
+def lock_stamp(path: str = NPX_LOCK_PATH) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_lock(path: str = NPX_LOCK_PATH) -> dict:
+    """读取锁文件（按修改时间缓存），不存在或格式错误时返回空的锁"""
+    stamp = lock_stamp(path)
+    with _lock_cache_lock:
+        cached = _lock_cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    lock = {"packages": {}}
+    if stamp is not None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lock = json.load(f)
+        except (OSError, ValueError):
+            pass
+    with _lock_cache_lock:
+        _lock_cache[path] = (stamp, lock)
+    return lock
+
+
+def save_lock(lock: dict, path: str = NPX_LOCK_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(lock, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def _lock_base(path: str) -> str:
+    return os.path.dirname(os.path.abspath(path))
+
+
+def local_launch(command: Optional[str], args: List[str],
+                 lock_path: str = NPX_LOCK_PATH) -> Optional[Tuple[str, List[str], str]]:
+    """
+    npx命令对应的包已安装时，返回 (node命令, [可执行文件, 参数...], "包名@版本")，否则返回None
+    """
+    if not NPX_LOCAL:
+        return None
+    invocation = parse_npx(command, args)
+    if invocation is None:
+        return None
+    entry = load_lock(lock_path).get("packages", {}).get(invocation.key)
+    if not entry:
+        return None
+    bin_path = os.path.join(_lock_base(lock_path), entry["bin"])
+    if not os.path.exists(bin_path):
+        return None
+    node = invocation.node or "node"
+    return node, [bin_path, *invocation.args], f"{invocation.name}@{entry['version']}"
+
+
+# ----- 安装 -----
+
+
+def _npm(*args: str) -> str:
+    npm = shutil.which("npm")
+    if npm is None:
+        raise RuntimeError("找不到npm，请先安装Node.js")
+    proc = subprocess.run([npm, *args], capture_output=True, text=True, timeout=NPM_TIMEOUT)
+    if proc.returncode != 0:
+        raise RuntimeError(f"npm {' '.join(args)} 失败: {proc.stderr.strip()[-500:]}")
+    return proc.stdout
+
+
+def resolve_version(name: str, requested: str) -> str:
+    """向npm仓库查询标签或版本范围对应的具体版本"""
+    versions = json.loads(_npm("view", f"{name}@{requested}", "version", "--json") or "null")
+    if isinstance(versions, list):
+        versions = versions[-1] if versions else None
+    if not versions:
+        raise RuntimeError(f"npm仓库中没有 {name}@{requested}")
+    return versions
+
+
+def find_bin(package_dir: str, bin_name: Optional[str]) -> str:
+    """按npx的规则选择包的可执行文件: 只有一个时用它，否则用与包名（去掉scope）或bin_name同名的那个"""
+    with open(os.path.join(package_dir, "package.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    bins = manifest.get("bin") or {}
+    short_name = manifest["name"].split("/")[-1]
+    if isinstance(bins, str):
+        bins = {short_name: bins}
+    if bin_name is not None:
+        target = bins.get(bin_name)
+    elif len(bins) == 1:
+        target = next(iter(bins.values()))
+    else:
+        target = bins.get(short_name)
+    if not target:
+        raise RuntimeError(f"{manifest['name']} 中没有可执行文件 {bin_name or short_name}（bin: {sorted(bins)}）")
+    return os.path.normpath(os.path.join(package_dir, target))
+
+
+def install(invocation: NpxInvocation, version: str, cache_dir: str = NPX_CACHE_DIR) -> str:
+    """把包的指定版本安装到缓存目录（已安装时跳过），返回可执行文件的路径"""
+    prefix = os.path.join(cache_dir, f"{invocation.name.replace('/', '+')}@{version}")
+    package_dir = os.path.join(prefix, "node_modules", *invocation.name.split("/"))
+    if not os.path.exists(os.path.join(package_dir, "package.json")):
+        os.makedirs(prefix, exist_ok=True)
+        _npm("install", "--prefix", prefix, "--omit=dev", "--no-audit", "--no-fund", f"{invocation.name}@{version}")
+    return find_bin(package_dir, invocation.bin_name)
+
+
+def provision(config: dict, lock_path: str = NPX_LOCK_PATH, cache_dir: str = NPX_CACHE_DIR,
+              upgrade: bool = False) -> Dict[str, dict]:
+    """
+    安装配置中所有npx服务器使用的包并更新锁文件
+
+    Returns:
+        服务器名 -> {"package", "version", "status"（installed / cached / error）, "error"}
+    """
+    if isinstance(config.get("mcpServers"), dict):
+        config = config["mcpServers"]
+    lock = json.loads(json.dumps(load_lock(lock_path)))
+    packages = lock.setdefault("packages", {})
+    base = _lock_base(lock_path)
+    report = {}
+    for name, raw in config.items():
+        if not isinstance(raw, dict) or raw.get("transport", "stdio") != "stdio":
+            continue
+        invocation = parse_npx(raw.get("command"), raw.get("args") or [])
+        if invocation is None:
+            continue
+        entry = packages.get(invocation.key)
+        try:
+            if entry and not upgrade and os.path.exists(os.path.join(base, entry["bin"])):
+                report[name] = {"package": invocation.key, "version": entry["version"], "status": "cached"}
+                continue
+            # 锁文件中已有版本时直接安装该版本，不查询仓库
+            version = entry["version"] if entry and not upgrade else resolve_version(invocation.name, invocation.requested)
+            bin_path = install(invocation, version, cache_dir)
+            packages[invocation.key] = {
+                "name": invocation.name,
+                "requested": invocation.requested,
+                "version": version,
+                "bin": os.path.relpath(bin_path, base),
+            }
+            report[name] = {"package": invocation.key, "version": version, "status": "installed"}
+        except Exception as e:
+            report[name] = {"package": invocation.key, "status": "error", "error": str(e)}
+    save_lock(lock, lock_path)
+    return report
+
+
+# ----- 启动耗时 -----
+
+
+async def _measure(connection: dict) -> float:
+    """从启动进程到列出工具完成的耗时（毫秒）"""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    params = StdioServerParameters(
+        command=connection["command"],
+        args=connection.get("args", []),
+        env={**os.environ, **(connection.get("env") or {})},
+        cwd=connection.get("cwd"),
+    )
+    started = time.perf_counter()
+    with open(os.devnull, "w") as errlog:
+        async with stdio_client(params, errlog=errlog) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                await session.list_tools()
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_startup(connection: dict, runs: int, timeout: float = 120) -> Optional[float]:
+    """多次启动取中位数（毫秒），启动失败时返回None"""
+    samples = []
+    for _ in range(runs):
+        try:
+            samples.append(asyncio.run(asyncio.wait_for(_measure(connection), timeout)))
+        except Exception:
+            return None
+    return round(statistics.median(samples), 1)
+
+
+def main():
+    from config_schema import load_config
+
+    parser = argparse.ArgumentParser(description="把npx启动的MCP服务器安装到本地并固定版本")
+    parser.add_argument("--config", default="config.json", help="MCP服务器配置文件")
+    parser.add_argument("--upgrade", action="store_true", help="重新查询版本并更新锁文件")
+    parser.add_argument("--bench", action="store_true", help="比较安装前后每个服务器的启动耗时")
+    parser.add_argument("--runs", type=int, default=3, help="--bench时每种启动方式运行的次数")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+    args = parser.parse_args()
+
+    raw = load_config(args.config).raw
+    servers = raw.get("mcpServers", raw) if isinstance(raw, dict) else {}
+    report = provision(servers, upgrade=args.upgrade)
+    if args.bench:
+        for name, item in report.items():
+            if item["status"] == "error":
+                continue
+            original = servers[name]
+            local = local_launch(original.get("command"), original.get("args") or [])
+            item["npx_ms"] = measure_startup(original, args.runs)
+            if local is not None:
+                item["local_ms"] = measure_startup({**original, "command": local[0], "args": local[1]}, args.runs)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for name, item in report.items():
+        line = f"{name:<28} {item['package']:<48} "
+        line += item.get("version", "-") if item["status"] != "error" else f"失败: {item['error']}"
+        if "npx_ms" in item:
+            npx_ms, local_ms = item["npx_ms"], item.get("local_ms")
+            line += f"  启动 npx {npx_ms if npx_ms is not None else '失败'} ms -> 本地 {local_ms if local_ms is not None else '失败'} ms"
+        print(line)
+    print(f"锁文件: {NPX_LOCK_PATH}，安装目录: {NPX_CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
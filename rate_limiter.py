@@ -0,0 +1,372 @@
+"""
+高德API客户端限流与配额管理
+
+- TokenBucket: 预约式令牌桶，请求按到达顺序排队等待，突发流量被平滑为匀速请求而不是直接失败
+- QuotaTracker: 按天统计每个密钥、每个端点的调用次数，并持久化到本地JSON文件
+- KeyPool: 管理多个API密钥，每个密钥有端点级和密钥级两层令牌桶，按等待时间和剩余配额轮换使用
+
+本模块不依赖任何第三方库，也不会把原始密钥写入磁盘（只记录密钥指纹）。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，此时退化为不加文件锁
+    fcntl = None
+
+# 高德的日配额按北京时间零点重置
+CHINA_TZ = timezone(timedelta(hours=8))
+
+# 超出每日配额的返回码（10003: 访问已超出日访问量, 10044: 账号维度日调用量超出限制）
+DAILY_LIMIT_INFOCODES = {"10003", "10044"}
+# 超出QPS/并发限制的返回码
+QPS_LIMIT_INFOCODES = {"10004", "10019", "10020", "10021"}
+
+
+class RateLimitExceeded(Exception):
+    """排队等待时间超过上限或所有密钥的配额均已用尽"""
+
+
+def key_fingerprint(key: str) -> str:
+    """返回密钥的短指纹，用于日志、统计和持久化，避免泄露原始密钥"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+def today() -> str:
+    return datetime.now(CHINA_TZ).strftime("%Y-%m-%d")
+
+
+class TokenBucket:
+    """
+    预约式令牌桶
+
+    每次预约立即扣除一个令牌（令牌数可以为负），并返回调用方需要等待的秒数。
+    令牌数为负表示前面已有请求在排队，后来者需要等待更久，从而天然形成先到先得的队列。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # 调用方传入的now可能早于桶的创建时间（同一轮计算中新建的桶），此时不能倒扣令牌
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """不预约，仅计算若此刻预约需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self, now: Optional[float] = None) -> float:
+        """预约一个令牌，返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        wait = self.wait_time(now)
+        self.tokens -= 1
+        return wait
+
+    def refund(self):
+        """归还一个已预约但未使用的令牌"""
+        if self.rate <= 0:
+            return
+        self._refill(time.monotonic())
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def penalize(self, seconds: float = 1.0):
+        """上游报告限流时调用，让后续请求额外等待一段时间"""
+        if self.rate <= 0:
+            return
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class QuotaTracker:
+    """
+    每日配额统计
+
+    计数结构为 {日期: {密钥指纹: {端点: 次数}}}，只保留当天的数据。
+    写盘采用节流策略（最多每flush_interval秒一次）。多个进程可能共用同一个配额文件
+    （例如重启或主备切换时新旧进程短暂并存），因此写盘时在文件锁内重新读取文件，
+    只把本进程自上次写盘以来新增的次数累加上去，再通过临时文件替换保证原子性。
+    """
+
+    def __init__(self, path: Optional[str], daily_quota: int, flush_interval: float = 2.0):
+        self.path = path
+        self.daily_quota = daily_quota
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = 0.0
+        self._date = today()
+        self._counts: Dict[str, Dict[str, int]] = {}
+        # 自上次写盘以来本进程新增的次数，以及上游判定配额用尽时要求的下限
+        self._deltas: Dict[str, Dict[str, int]] = {}
+        self._floors: Dict[str, Dict[str, int]] = {}
+        self._counts = self._read_file().get(self._date, {})
+
+    def _read_file(self) -> dict:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的写盘互斥锁（锁文件与配额文件放在同一目录）"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _roll_date(self):
+        current = today()
+        if current != self._date:
+            self._date = current
+            self._counts = {}
+            self._deltas = {}
+            self._floors = {}
+            self._dirty = True
+
+    def used(self, fingerprint: str, endpoint: str) -> int:
+        with self._lock:
+            self._roll_date()
+            return self._counts.get(fingerprint, {}).get(endpoint, 0)
+
+    def remaining(self, fingerprint: str, endpoint: str) -> Optional[int]:
+        if self.daily_quota <= 0:
+            return None
+        return max(0, self.daily_quota - self.used(fingerprint, endpoint))
+
+    def add(self, fingerprint: str, endpoint: str, count: int = 1):
+        with self._lock:
+            self._roll_date()
+            per_key = self._counts.setdefault(fingerprint, {})
+            per_key[endpoint] = per_key.get(endpoint, 0) + count
+            deltas = self._deltas.setdefault(fingerprint, {})
+            deltas[endpoint] = deltas.get(endpoint, 0) + count
+            self._dirty = True
+        self.flush(force=False)
+
+    def exhaust(self, fingerprint: str, endpoint: str):
+        """上游返回日配额超限时，把本地计数直接置满"""
+        if self.daily_quota <= 0:
+            return
+        with self._lock:
+            self._roll_date()
+            per_key = self._counts.setdefault(fingerprint, {})
+            per_key[endpoint] = max(per_key.get(endpoint, 0), self.daily_quota)
+            self._floors.setdefault(fingerprint, {})[endpoint] = self.daily_quota
+            self._dirty = True
+        self.flush(force=False)
+
+    def flush(self, force: bool = True):
+        if not self.path:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not self._dirty or (not force and now - self._last_flush < self.flush_interval):
+                return
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with self._file_lock():
+                    # 以文件中其他进程写入的当天计数为基础，累加本进程的增量
+                    on_disk = self._read_file().get(self._date, {})
+                    merged = {fp: dict(per_key) for fp, per_key in on_disk.items() if isinstance(per_key, dict)}
+                    for fp, per_key in self._deltas.items():
+                        target = merged.setdefault(fp, {})
+                        for endpoint, count in per_key.items():
+                            target[endpoint] = target.get(endpoint, 0) + count
+                    for fp, per_key in self._floors.items():
+                        target = merged.setdefault(fp, {})
+                        for endpoint, floor in per_key.items():
+                            target[endpoint] = max(target.get(endpoint, 0), floor)
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump({self._date: merged}, f, ensure_ascii=False, indent=2)
+                    os.replace(tmp_path, self.path)
+            except OSError:
+                return
+            # 合并后的结果同时反映了其他进程的用量，作为新的本地计数
+            self._counts = merged
+            self._deltas = {}
+            self._floors = {}
+            self._dirty = False
+            self._last_flush = now
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._roll_date()
+            return {"date": self._date, "usage": json.loads(json.dumps(self._counts))}
+
+
+class KeyPool:
+    """
+    多密钥限流池
+
+    每个密钥对每个端点有独立的令牌桶（endpoint_qps），同时有一个密钥级令牌桶（key_qps）。
+    acquire()会在配额未用尽的密钥中选择等待时间最短的一个，预约令牌后等待，最长等待max_wait秒。
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        endpoint_qps: float = 3,
+        key_qps: float = 30,
+        daily_quota: int = 5000,
+        max_wait: float = 10.0,
+        quota_file: Optional[str] = None,
+    ):
+        if not keys:
+            raise ValueError("至少需要提供一个API密钥")
+        self.keys = list(dict.fromkeys(keys))
+        self.endpoint_qps = endpoint_qps
+        self.key_qps = key_qps
+        self.max_wait = max_wait
+        self.quota = QuotaTracker(quota_file, daily_quota)
+        self._fingerprints = {key: key_fingerprint(key) for key in self.keys}
+        self._key_buckets = {key: TokenBucket(key_qps) for key in self.keys}
+        self._endpoint_buckets: Dict[tuple, TokenBucket] = {}
+        self.waiting = 0
+        self.stats = {"acquired": 0, "queued": 0, "rejected": 0, "upstream_throttled": 0, "wait_seconds": 0.0}
+
+    def _endpoint_bucket(self, key: str, endpoint: str) -> TokenBucket:
+        bucket = self._endpoint_buckets.get((key, endpoint))
+        if bucket is None:
+            bucket = TokenBucket(self.endpoint_qps)
+            self._endpoint_buckets[(key, endpoint)] = bucket
+        return bucket
+
+    def _candidates(self, endpoint: str, exclude: Optional[str] = None):
+        now = time.monotonic()
+        for key in self.keys:
+            if key == exclude and len(self.keys) > 1:
+                continue
+            remaining = self.quota.remaining(self._fingerprints[key], endpoint)
+            if remaining == 0:
+                continue
+            wait = max(
+                self._key_buckets[key].wait_time(now),
+                self._endpoint_bucket(key, endpoint).wait_time(now),
+            )
+            # 等待时间相同时优先使用剩余配额多的密钥
+            yield wait, -(remaining if remaining is not None else float("inf")), key
+
+    async def acquire(self, endpoint: str, exclude: Optional[str] = None) -> str:
+        """
+        为一次请求获取可用密钥，必要时排队等待
+
+        Raises:
+            RateLimitExceeded: 所有密钥的配额均已用尽，或排队时间超过max_wait
+        """
+        candidates = sorted(self._candidates(endpoint, exclude))
+        if not candidates:
+            self.stats["rejected"] += 1
+            raise RateLimitExceeded(f"所有API密钥今日的{endpoint}配额均已用尽")
+        wait, _, key = candidates[0]
+        if wait > self.max_wait:
+            self.stats["rejected"] += 1
+            raise RateLimitExceeded(f"请求过于频繁，排队时间预计{wait:.1f}秒，超过上限{self.max_wait}秒")
+
+        now = time.monotonic()
+        wait = max(
+            self._key_buckets[key].reserve(now),
+            self._endpoint_bucket(key, endpoint).reserve(now),
+        )
+        self.stats["acquired"] += 1
+        if wait > 0:
+            self.stats["queued"] += 1
+            self.stats["wait_seconds"] += wait
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting -= 1
+        return key
+
+    def try_acquire(self, endpoint: str) -> Optional[str]:
+        """不排队地获取密钥，令牌不足或配额用尽时返回None"""
+        candidates = sorted(self._candidates(endpoint))
+        if not candidates or candidates[0][0] > 0:
+            return None
+        _, _, key = candidates[0]
+        now = time.monotonic()
+        self._key_buckets[key].reserve(now)
+        self._endpoint_bucket(key, endpoint).reserve(now)
+        self.stats["acquired"] += 1
+        return key
+
+    def release(self, key: str, endpoint: str):
+        """归还try_acquire取得但最终没有发出请求的令牌"""
+        self._key_buckets[key].refund()
+        self._endpoint_bucket(key, endpoint).refund()
+        self.stats["acquired"] -= 1
+
+    def record(self, key: str, endpoint: str, data: dict) -> bool:
+        """
+        记录一次上游调用结果
+
+        Returns:
+            bool: 上游是否报告了QPS/并发超限（调用方可换用其他密钥重试）
+        """
+        if "infocode" not in data:
+            # 请求没有到达高德（网络错误等），不计入配额
+            return False
+        fingerprint = self._fingerprints[key]
+        self.quota.add(fingerprint, endpoint)
+        infocode = str(data["infocode"])
+        if infocode in DAILY_LIMIT_INFOCODES:
+            self.quota.exhaust(fingerprint, endpoint)
+        elif infocode in QPS_LIMIT_INFOCODES:
+            self.stats["upstream_throttled"] += 1
+            self._endpoint_bucket(key, endpoint).penalize()
+            return True
+        return False
+
+    def snapshot(self) -> dict:
+        quota = self.quota.snapshot()
+        keys = []
+        for key in self.keys:
+            fingerprint = self._fingerprints[key]
+            keys.append({
+                "key_id": fingerprint,
+                "usage": quota["usage"].get(fingerprint, {}),
+            })
+        stats = dict(self.stats)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        return {
+            "date": quota["date"],
+            "endpoint_qps": self.endpoint_qps,
+            "key_qps": self.key_qps,
+            "daily_quota_per_endpoint": self.quota.daily_quota,
+            "max_queue_wait": self.max_wait,
+            "waiting": self.waiting,
+            "stats": stats,
+            "keys": keys,
+        }
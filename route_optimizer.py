@@ -0,0 +1,71 @@
+"""
+访问顺序优化
+
+基于距离/时间矩阵求解小规模的旅行商问题：先用最近邻法构造初始路线，再用2-opt迭代改进。
+矩阵可以是非对称的（驾车时间通常如此），因此2-opt每次都重新计算候选路线的完整代价。
+矩阵中的None表示该点对不可达，按一个很大的代价处理。
+"""
+
+from typing import List, Optional, Sequence
+
+UNREACHABLE = float("inf")
+
+Matrix = Sequence[Sequence[Optional[float]]]
+
+
+def _cost(matrix: Matrix, i: int, j: int) -> float:
+    value = matrix[i][j]
+    return UNREACHABLE if value is None else value
+
+
+def route_cost(matrix: Matrix, order: Sequence[int], closed: bool = False) -> float:
+    """计算按order访问的总代价，closed为True时包含回到起点的一段"""
+    total = 0.0
+    for a, b in zip(order, order[1:]):
+        total += _cost(matrix, a, b)
+    if closed and len(order) > 1:
+        total += _cost(matrix, order[-1], order[0])
+    return total
+
+
+def nearest_neighbour(matrix: Matrix, start: int = 0) -> List[int]:
+    """最近邻法：从start出发，每次前往代价最小的未访问点"""
+    n = len(matrix)
+    order = [start]
+    unvisited = set(range(n)) - {start}
+    while unvisited:
+        current = order[-1]
+        nxt = min(unvisited, key=lambda j: (_cost(matrix, current, j), j))
+        order.append(nxt)
+        unvisited.remove(nxt)
+    return order
+
+
+def two_opt(matrix: Matrix, order: Sequence[int], closed: bool = False, max_passes: int = 50) -> List[int]:
+    """
+    2-opt改进：反转路线中的一段，只要总代价下降就接受，直到没有改进或达到max_passes
+
+    起点（order[0]）始终固定不动。
+    """
+    best = list(order)
+    best_cost = route_cost(matrix, best, closed)
+    n = len(best)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                candidate = best[:i] + best[i:j + 1][::-1] + best[j + 1:]
+                cost = route_cost(matrix, candidate, closed)
+                if cost < best_cost - 1e-9:
+                    best, best_cost = candidate, cost
+                    improved = True
+        if not improved:
+            break
+    return best
+
+
+def optimize_order(matrix: Matrix, start: int = 0, closed: bool = False) -> List[int]:
+    """最近邻 + 2-opt 求近似最优访问顺序"""
+    if len(matrix) <= 2:
+        return [start] + [i for i in range(len(matrix)) if i != start]
+    return two_opt(matrix, nearest_neighbour(matrix, start), closed)
@@ -0,0 +1,192 @@
+"""
+高德工具调用的预测预取（speculative prefetch）
+
+代理的工具调用有明显的先后规律：geocoding之后通常是同一城市的weather_query或poi_search，
+reverse_geocoding之后通常是附近的POI搜索。Speculator根据上一次工具调用的参数和结果（"上下文"，
+如city、adcode、longitude、latitude）预测接下来的调用，由服务器在后台提前执行，结果进入响应缓存，
+代理真正发起第二步调用时直接命中缓存。
+
+跟随规则有两个来源：
+- 配置规则: 工具名 -> [{"tool": 后续工具, "args": {参数: 值}}]，值为"{adcode}"形式时替换为上下文中的值
+- 学习规则: 观察实际的调用序列，后一次调用的参数中与前一次上下文相同的值被替换为占位符，
+  同一模板出现次数达到min_support、且占前一工具调用次数的比例达到min_ratio后参与预测
+
+预取的上游请求受每分钟预算限制（budget），预算用尽时跳过，不会挤占正常请求的限流令牌和配额。
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from rate_limiter import TokenBucket
+
+# 默认的跟随规则
+DEFAULT_RULES: Dict[str, List[dict]] = {
+    # weather_query按adcode查询，使用地理编码结果的adcode（县级地址的city是所属地级市）
+    "geocoding": [{"tool": "weather_query", "args": {"city": "{adcode}"}}],
+    "reverse_geocoding": [{"tool": "poi_nearby", "args": {"longitude": "{longitude}", "latitude": "{latitude}"}}],
+}
+
+_PLACEHOLDER = re.compile(r"^\{(\w+)\}$")
+# 每个工具最多保留的学习模板数
+MAX_TEMPLATES_PER_TOOL = 50
+# 学习时回看的最近调用数（如geocoding -> weather_query -> poi_search中，poi_search同时跟随前两次调用）
+HISTORY_SIZE = 4
+
+
+def _same(a: Any, b: Any) -> bool:
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) < 1e-9
+    return str(a).strip() == str(b).strip()
+
+
+def generalize(args: Dict[str, Any], context: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """把参数中与上下文相同的值替换为占位符，返回(模板, 是否有替换)"""
+    template, linked = {}, False
+    for name, value in args.items():
+        if value is None:
+            continue
+        match = next((key for key, known in context.items() if known is not None and _same(value, known)), None)
+        if match is not None:
+            template[name], linked = f"{{{match}}}", True
+        else:
+            template[name] = value
+    return template, linked
+
+
+def instantiate(template: Dict[str, Any], context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """用上下文替换模板中的占位符，上下文中缺少对应值时返回None"""
+    args = {}
+    for name, value in template.items():
+        match = _PLACEHOLDER.match(value) if isinstance(value, str) else None
+        if match is None:
+            args[name] = value
+        elif context.get(match.group(1)) is None:
+            return None
+        else:
+            args[name] = context[match.group(1)]
+    return args
+
+
+def load_rules(path: Optional[str]) -> Dict[str, List[dict]]:
+    """读取配置规则文件，未设置时返回默认规则"""
+    if not path:
+        return DEFAULT_RULES
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    if not isinstance(rules, dict) or not all(
+        isinstance(items, list) and all(isinstance(item, dict) and "tool" in item for item in items)
+        for items in rules.values()
+    ):
+        raise ValueError(f"预取规则文件格式错误: {path}")
+    return rules
+
+
+class Speculator:
+    """
+    根据工具调用序列预测后续调用（线程安全）
+
+    observe()记录每次实际调用，predict()返回应当预取的(工具名, 参数)，
+    try_spend()在发起预取的上游请求前检查每分钟预算。
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[str, List[dict]]] = None,
+        per_minute: float = 20,
+        learn: bool = True,
+        min_support: int = 3,
+        min_ratio: float = 0.3,
+        window: float = 120,
+        max_followups: int = 2,
+    ):
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.learn = learn
+        self.min_support = min_support
+        self.min_ratio = min_ratio
+        self.window = window
+        self.max_followups = max_followups
+        self._budget = TokenBucket(per_minute / 60, capacity=max(1.0, per_minute / 6))
+        self._lock = threading.Lock()
+        # 最近的调用: (时间, 工具名, 上下文)
+        self._recent: deque = deque(maxlen=HISTORY_SIZE)
+        self._calls: Counter = Counter()
+        # 前一工具 -> Counter((后续工具, 模板JSON))
+        self._templates: Dict[str, Counter] = defaultdict(Counter)
+        self.stats = {"predicted": 0, "spent": 0, "over_budget": 0}
+
+    def observe(self, tool: str, args: Dict[str, Any], context: Dict[str, Any]):
+        """记录一次实际的工具调用，context为从该调用的参数和结果中提取的值"""
+        now = time.monotonic()
+        with self._lock:
+            seen = set()
+            for called, previous, previous_context in reversed(self._recent if self.learn else ()):
+                # 每个工具只与其最近一次调用关联
+                if now - called > self.window or previous in seen:
+                    continue
+                seen.add(previous)
+                template, linked = generalize(args, previous_context)
+                if not linked:
+                    continue
+                counter = self._templates[previous]
+                counter[(tool, json.dumps(template, sort_keys=True, ensure_ascii=False))] += 1
+                if len(counter) > MAX_TEMPLATES_PER_TOOL:
+                    for key, _ in counter.most_common()[MAX_TEMPLATES_PER_TOOL:]:
+                        del counter[key]
+            self._calls[tool] += 1
+            self._recent.append((now, tool, context))
+
+    def _learned(self, tool: str) -> List[Tuple[str, dict]]:
+        calls = self._calls[tool]
+        return [
+            (next_tool, json.loads(template))
+            for (next_tool, template), count in self._templates[tool].most_common()
+            if count >= self.min_support and count >= self.min_ratio * calls
+        ]
+
+    def predict(self, tool: str, context: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """预测tool之后的调用，最多返回max_followups个"""
+        with self._lock:
+            candidates = [(rule["tool"], rule.get("args", {})) for rule in self.rules.get(tool, [])]
+            candidates += self._learned(tool)
+        predictions, seen = [], set()
+        for next_tool, template in candidates:
+            args = instantiate(template, context)
+            if args is None:
+                continue
+            key = (next_tool, json.dumps(args, sort_keys=True, ensure_ascii=False, default=str))
+            if key in seen:
+                continue
+            seen.add(key)
+            predictions.append((next_tool, args))
+            if len(predictions) >= self.max_followups:
+                break
+        with self._lock:
+            self.stats["predicted"] += len(predictions)
+        return predictions
+
+    def try_spend(self) -> bool:
+        """预算中还有余量时扣除一次上游请求并返回True"""
+        with self._lock:
+            if self._budget.wait_time() > 0:
+                self.stats["over_budget"] += 1
+                return False
+            self._budget.reserve()
+            self.stats["spent"] += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            learned = {
+                tool: [
+                    {"tool": next_tool, "args": json.loads(template), "count": count}
+                    for (next_tool, template), count in counter.most_common(5)
+                ]
+                for tool, counter in self._templates.items() if counter
+            }
+            return {**self.stats, "calls": dict(self._calls), "learned": learned}
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, Gate
+
+
+def test_admits_up_to_limit_without_queueing():
+    gate = Gate("test", limit=2, max_queue=0)
+    assert gate.try_acquire()
+    assert gate.try_acquire()
+    assert not gate.try_acquire()
+    gate.release()
+    assert gate.try_acquire()
+    assert gate.snapshot()["active"] == 2
+
+
+def test_unlimited_gate():
+    gate = Gate("test", limit=0, max_queue=0)
+    assert all(gate.try_acquire() for _ in range(100))
+
+
+def test_queue_full_is_rejected():
+    gate = Gate("test", limit=1, max_queue=0)
+
+    async def run():
+        async with gate.slot():
+            with pytest.raises(AdmissionRejected) as excinfo:
+                await gate.acquire()
+            assert excinfo.value.gate == "test"
+
+    asyncio.run(run())
+    assert gate.snapshot()["rejected"] == 1
+    assert gate.snapshot()["active"] == 0
+
+
+def test_queue_timeout_is_rejected():
+    gate = Gate("test", limit=1, max_queue=4, max_wait=0.2)
+
+    async def run():
+        async with gate.slot():
+            with pytest.raises(AdmissionRejected):
+                await gate.acquire()
+        # 超时的请求已从队列中移除，不会占用之后释放的名额
+        assert gate.snapshot()["waiting"] == 0
+        assert gate.try_acquire()
+
+    asyncio.run(run())
+
+
+def test_waiters_are_admitted_in_order():
+    gate = Gate("test", limit=1, max_queue=8)
+    order = []
+    positions = []
+
+    async def worker(index):
+        async with gate.slot(on_queue=lambda position: positions.append((index, position))):
+            order.append(index)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(worker(index) for index in range(4)))
+
+    asyncio.run(run())
+    assert order == [0, 1, 2, 3]
+    assert (1, 1) in positions and (3, 3) in positions
+    assert gate.snapshot()["active"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    gate = Gate("test", limit=1, max_queue=8)
+
+    async def run():
+        assert gate.try_acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0.01)
+        assert gate.snapshot()["waiting"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.snapshot()["waiting"] == 0
+        gate.release()
+        assert gate.snapshot()["active"] == 0
+
+    asyncio.run(run())
+
+
+def test_shared_between_threads_and_event_loops():
+    gate = Gate("test", limit=2, max_queue=64)
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def enter():
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+
+    def leave():
+        with lock:
+            active.pop()
+
+    async def async_turn():
+        async with gate.slot():
+            enter()
+            await asyncio.sleep(0.005)
+            leave()
+
+    def loop_thread():
+        async def run():
+            await asyncio.gather(*(async_turn() for _ in range(5)))
+
+        asyncio.run(run())
+
+    def sync_thread():
+        for _ in range(5):
+            with gate.hold():
+                enter()
+                time.sleep(0.005)
+                leave()
+
+    threads = [threading.Thread(target=loop_thread) for _ in range(3)]
+    threads += [threading.Thread(target=sync_thread) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+    snapshot = gate.snapshot()
+    assert snapshot["active"] == 0 and snapshot["admitted"] == 25
+
+
+def test_raising_limit_admits_waiters():
+    gate = Gate("test", limit=1, max_queue=8)
+
+    async def run():
+        assert gate.try_acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0.01)
+        gate.configure(limit=2)
+        await asyncio.wait_for(waiter, 1)
+        assert gate.snapshot()["active"] == 2
+
+    asyncio.run(run())
+
+
+def test_controller_uses_prefix_defaults():
+    controller = AdmissionController({"tool": (3, 5), "turns": (1, 2)})
+    assert controller.gate("tool:amap").limit == 3
+    assert controller.gate("tool:amap") is controller.gate("tool:amap")
+    assert controller.gate("turns").max_queue == 2
+    assert controller.gate("other").limit == 0
@@ -0,0 +1,123 @@
+import threading
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.types import Send
+
+from checkpoint_dedup import MESSAGES_TYPE, NESTED_PREFIX, DedupMemorySaver, DedupSerializer
+
+
+def conversation(n, tag=""):
+    messages = []
+    for i in range(n):
+        messages.append(HumanMessage(f"{tag}问题{i}", id=f"{tag}h{i}"))
+        messages.append(AIMessage(f"{tag}回答{i}", id=f"{tag}a{i}"))
+    return messages
+
+
+def put_checkpoint(saver, thread_id, messages, step, config=None):
+    config = config or {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": messages}
+    checkpoint["channel_versions"] = {"messages": str(step)}
+    return saver.put(config, checkpoint, {"step": step}, {"messages": str(step)})
+
+
+def latest_messages(saver, thread_id):
+    saved = saver.get_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}})
+    return saved.checkpoint["channel_values"]["messages"] if saved else None
+
+
+def test_messages_round_trip():
+    serde = DedupSerializer()
+    messages = conversation(3) + [ToolMessage("结果", tool_call_id="call_1", id="t0")]
+    kind, data = serde.dumps_typed(messages)
+    assert kind == MESSAGES_TYPE
+    assert serde.loads_typed((kind, data)) == messages
+    assert serde.loads_typed(serde.dumps_typed(messages[0])) == messages[0]
+
+
+def test_round_trip_of_other_values_is_unchanged():
+    serde = DedupSerializer()
+    for value in ({"a": 1, "b": [1, 2]}, "text", 3, None, []):
+        assert serde.loads_typed(serde.dumps_typed(value)) == value
+
+
+def test_send_payload_round_trip():
+    serde = DedupSerializer()
+    messages = conversation(2)
+    tasks = [Send("tools", {"messages": messages, "remaining_steps": 3}), Send("tools", {"messages": messages})]
+    kind, data = serde.dumps_typed(tasks)
+    assert kind.startswith(NESTED_PREFIX)
+    restored = serde.loads_typed((kind, data))
+    assert [(task.node, task.arg) for task in restored] == [(task.node, task.arg) for task in tasks]
+
+
+def test_repeated_messages_are_stored_once():
+    serde = DedupSerializer()
+    messages = conversation(5)
+    serde.dumps_typed(messages[:4])
+    serde.dumps_typed(messages)
+    # 每条消息只保存外壳和内容两份数据，前一个检查点中的消息不再重复保存
+    stats = serde.table.snapshot()
+    assert stats["blobs"] == 2 * len(messages)
+    serde.dumps_typed(messages)
+    again = serde.table.snapshot()
+    assert again["stored_bytes"] == stats["stored_bytes"]
+    assert again["logical_bytes"] > stats["logical_bytes"]
+
+
+def test_delete_thread_keeps_other_threads():
+    saver = DedupMemorySaver()
+    shared = conversation(2, "shared")
+    put_checkpoint(saver, "a", shared + conversation(2, "a"), 1)
+    put_checkpoint(saver, "b", shared + conversation(2, "b"), 1)
+
+    saver.delete_thread("a")
+
+    assert latest_messages(saver, "a") is None
+    # b与a共用的消息数据仍然保留
+    assert latest_messages(saver, "b") == shared + conversation(2, "b")
+
+
+def test_delete_thread_releases_unreferenced_blobs():
+    saver = DedupMemorySaver()
+    put_checkpoint(saver, "b", conversation(1, "b"), 1)
+    before = saver.snapshot()["blobs"]
+    put_checkpoint(saver, "a", conversation(3, "a"), 1)
+    saver.delete_thread("a")
+    assert saver.snapshot()["blobs"] == before
+
+
+def test_writes_racing_garbage_collection():
+    saver = DedupMemorySaver()
+    errors = []
+    done = threading.Event()
+
+    def writer():
+        messages = []
+        config = None
+        try:
+            for step in range(200):
+                messages = messages + [HumanMessage(f"q{uuid.uuid4()}"), AIMessage(f"a{uuid.uuid4()}")]
+                config = put_checkpoint(saver, "job", messages, step, config)
+                saver.put_writes(config, [("messages", [AIMessage(f"w{uuid.uuid4()}")])], f"task{step}")
+                saved = saver.get_tuple({"configurable": {"thread_id": "job", "checkpoint_ns": ""}})
+                assert len(saved.checkpoint["channel_values"]["messages"]) == len(messages)
+                assert all(value for _, _, value in saved.pending_writes)
+        except Exception as e:  # noqa: BLE001 - 线程中的异常交给主线程断言
+            errors.append(e)
+        finally:
+            done.set()
+
+    def collector():
+        while not done.is_set():
+            saver.delete_thread("other")
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=collector)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
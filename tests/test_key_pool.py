@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from rate_limiter import KeyPool, QuotaTracker, RateLimitExceeded, TokenBucket, key_fingerprint, today
+
+
+def test_token_bucket_queues_in_arrival_order():
+    bucket = TokenBucket(rate=10, capacity=1)
+    now = time.monotonic()
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == pytest.approx(0.1)
+    assert bucket.reserve(now) == pytest.approx(0.2)
+
+
+def test_new_endpoint_bucket_is_full():
+    pool = KeyPool(["a"], endpoint_qps=1, key_qps=1)
+    assert pool.try_acquire("geo") == "a"
+    assert pool.try_acquire("geo") is None
+
+
+def test_release_returns_the_token():
+    pool = KeyPool(["a"], endpoint_qps=1, key_qps=1)
+    key = pool.try_acquire("geo")
+    pool.release(key, "geo")
+    assert pool.try_acquire("geo") == "a"
+    assert pool.stats["acquired"] == 1
+
+
+def test_rotates_to_key_with_free_tokens():
+    pool = KeyPool(["a", "b"], endpoint_qps=1, key_qps=10)
+    assert {pool.try_acquire("geo"), pool.try_acquire("geo")} == {"a", "b"}
+    assert pool.try_acquire("geo") is None
+    # 端点之间的令牌桶相互独立
+    assert pool.try_acquire("weatherInfo") is not None
+
+
+def test_acquire_waits_instead_of_failing():
+    pool = KeyPool(["a"], endpoint_qps=20, key_qps=20, max_wait=1)
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(25):
+            await pool.acquire("geo")
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.2
+    assert pool.stats["queued"] > 0 and pool.stats["rejected"] == 0
+
+
+def test_acquire_rejects_when_wait_exceeds_limit():
+    pool = KeyPool(["a"], endpoint_qps=1, key_qps=1, max_wait=0.5)
+
+    async def run():
+        await pool.acquire("geo")
+        with pytest.raises(RateLimitExceeded):
+            await pool.acquire("geo")
+
+    asyncio.run(run())
+
+
+def test_exhausted_key_is_skipped():
+    pool = KeyPool(["a", "b"], endpoint_qps=100, key_qps=100, daily_quota=10)
+    pool.record("a", "geo", {"status": "0", "infocode": "10003"})
+    assert pool.quota.remaining(key_fingerprint("a"), "geo") == 0
+    assert all(pool.try_acquire("geo") == "b" for _ in range(5))
+    pool.record("b", "geo", {"status": "0", "infocode": "10044"})
+
+    async def run():
+        with pytest.raises(RateLimitExceeded):
+            await pool.acquire("geo")
+
+    asyncio.run(run())
+
+
+def test_upstream_throttling_is_retryable():
+    pool = KeyPool(["a"], endpoint_qps=10, key_qps=10)
+    assert pool.record("a", "geo", {"status": "0", "infocode": "10004"})
+    assert pool.try_acquire("geo") is None
+    # 没有到达高德的请求不计入配额
+    assert not pool.record("a", "geo", {"status": "0", "info": "网络错误"})
+    assert pool.quota.used(key_fingerprint("a"), "geo") == 1
+
+
+def test_quota_file_merges_counts_of_processes(tmp_path):
+    path = str(tmp_path / "quota.json")
+    first = QuotaTracker(path, daily_quota=100)
+    second = QuotaTracker(path, daily_quota=100)
+    for _ in range(3):
+        first.add("k", "geo")
+    for _ in range(5):
+        second.add("k", "geo")
+    first.flush()
+    second.flush()
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {today(): {"k": {"geo": 8}}}
+    # 写盘后各进程的本地计数也包含其他进程的用量
+    assert second.used("k", "geo") == 8
+    assert QuotaTracker(path, daily_quota=100).used("k", "geo") == 8
+
+
+def test_quota_exhaustion_survives_merge(tmp_path):
+    path = str(tmp_path / "quota.json")
+    first = QuotaTracker(path, daily_quota=100)
+    second = QuotaTracker(path, daily_quota=100)
+    first.exhaust("k", "geo")
+    first.flush()
+    second.add("k", "geo")
+    second.flush()
+    assert QuotaTracker(path, daily_quota=100).remaining("k", "geo") == 0
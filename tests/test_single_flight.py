@@ -0,0 +1,97 @@
+import asyncio
+import os
+
+import pytest
+
+# mcp_server_amap在导入时读取密钥；测试不访问网络，也不写配额文件
+os.environ.setdefault("AMAP_API_KEY", "test-key")
+os.environ.setdefault("AMAP_QUOTA_FILE", "")
+
+from mcp_server_amap import SingleFlight  # noqa: E402
+
+
+def test_concurrent_calls_share_one_request():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"status": "1"}
+
+    async def run():
+        return await asyncio.gather(*(flight.do("geo?address=西湖", fetch) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats == {"calls": 5, "upstream": 1, "coalesced": 4}
+    assert flight.inflight == 0
+
+
+def test_different_keys_are_not_merged():
+    flight = SingleFlight()
+
+    async def fetch(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def run():
+        return await asyncio.gather(flight.do("a", lambda: fetch(1)), flight.do("b", lambda: fetch(2)))
+
+    assert asyncio.run(run()) == [1, 2]
+    assert flight.stats["upstream"] == 2
+
+
+def test_results_are_not_cached():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        return [await flight.do("key", fetch), await flight.do("key", fetch)]
+
+    assert asyncio.run(run()) == [1, 2]
+
+
+def test_errors_are_shared_and_forgotten():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert not flight.running("key")
+
+    asyncio.run(run())
+    assert flight.stats["upstream"] == 1
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    flight = SingleFlight()
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def fetch():
+            await gate.wait()
+            return "ok"
+
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        assert flight.running("key")
+        first.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second == "ok"
+
+    asyncio.run(run())
@@ -0,0 +1,370 @@
+"""
+工具输出大小限制
+
+部分MCP服务器（filesystem、github、browser-tools、context7等）一次可能返回数MB的结果，
+这些结果原样写入ToolMessage，进入对话记忆（checkpointer），并出现在之后每一轮的提示词中。
+这里在工具结果返回给代理之前按服务器的策略（OutputPolicy）检查大小：
+
+- 超过字节上限（max_bytes）或估算token上限（max_tokens）时截断: JSON按层级缩减（列表只保留前几项、
+  长字符串截短、字段过多的对象只保留前几个字段）并保持为合法JSON，普通文本保留开头和结尾、省略中间部分
+- 开启spill时完整内容写入本地按内容寻址的存储（BlobStore，相同内容只保存一份），截断结果中附带句柄，
+  代理可以调用 read_tool_output 工具按偏移分页读取或搜索完整内容
+- 过大的图片等非文本内容块和结构化结果（artifact）直接丢弃，只保留说明
+
+未超过上限的结果原样返回，只做一次长度检查。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from usage_tracker import estimate_tokens
+
+# 单次工具结果的默认上限: 字节数，以及估算token数（0表示不限制）
+TOOL_OUTPUT_MAX_BYTES = int(os.getenv("TOOL_OUTPUT_MAX_BYTES", "32768"))
+TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("TOOL_OUTPUT_MAX_TOKENS", "0"))
+# 截断时是否把完整内容保存到本地存储（0为不保存）
+TOOL_OUTPUT_SPILL = os.getenv("TOOL_OUTPUT_SPILL", "1") != "0"
+TOOL_OUTPUT_DIR = os.getenv("TOOL_OUTPUT_DIR", ".tool_outputs")
+# 本地存储的总大小上限（MB），超过时删除最久未访问的内容
+TOOL_OUTPUT_STORE_LIMIT_MB = float(os.getenv("TOOL_OUTPUT_STORE_LIMIT_MB", "512"))
+# read_tool_output每页返回的字符数
+TOOL_OUTPUT_PAGE_CHARS = int(os.getenv("TOOL_OUTPUT_PAGE_CHARS", "8000"))
+
+PAGE_TOOL_NAME = "read_tool_output"
+
+# JSON逐级缩减的参数: (列表/对象保留的项数, 字符串保留的字符数)
+_JSON_LEVELS = ((50, 2000), (20, 500), (10, 200), (5, 100), (3, 50), (1, 20))
+# 超过该大小的文本不尝试按JSON解析
+_JSON_PARSE_LIMIT = 20 * 1024 * 1024
+_HANDLE_PATTERN = re.compile(r"^[0-9a-f]{24}$")
+
+
+@dataclass(frozen=True)
+class OutputPolicy:
+    """单个服务器的工具输出策略"""
+
+    max_bytes: int = TOOL_OUTPUT_MAX_BYTES
+    max_tokens: int = TOOL_OUTPUT_MAX_TOKENS
+    spill: bool = TOOL_OUTPUT_SPILL
+
+    @classmethod
+    def for_spec(cls, spec) -> "OutputPolicy":
+        """由ServerSpec中的max_output_bytes / max_output_tokens / spill_output覆盖默认值"""
+        return cls(
+            max_bytes=spec.max_output_bytes or TOOL_OUTPUT_MAX_BYTES,
+            max_tokens=spec.max_output_tokens or TOOL_OUTPUT_MAX_TOKENS,
+            spill=TOOL_OUTPUT_SPILL if spec.spill_output is None else spec.spill_output,
+        )
+
+    def fits(self, text: str) -> bool:
+        if len(text.encode("utf-8")) > self.max_bytes:
+            return False
+        # 每个字符最多0.6个token，字符数足够少时不必逐字符估算
+        if self.max_tokens and len(text) * 0.6 > self.max_tokens:
+            return estimate_tokens(text) <= self.max_tokens
+        return True
+
+
+class BlobStore:
+    """按内容寻址的本地文本存储: 句柄为内容SHA-256的前24位，相同内容只保存一份"""
+
+    def __init__(self, root: str = TOOL_OUTPUT_DIR, limit_mb: float = TOOL_OUTPUT_STORE_LIMIT_MB):
+        self.root = root
+        self.limit_bytes = int(limit_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+
+    def _path(self, handle: str) -> str:
+        return os.path.join(self.root, handle[:2], f"{handle}.txt")
+
+    def put(self, text: str) -> str:
+        data = text.encode("utf-8")
+        handle = hashlib.sha256(data).hexdigest()[:24]
+        path = self._path(handle)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return handle
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._prune()
+        return handle
+
+    def _prune(self):
+        """持有锁时调用: 总大小超过上限时按最近访问时间从旧到新删除"""
+        if self.limit_bytes <= 0:
+            return
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def get(self, handle: str) -> Optional[str]:
+        if not _HANDLE_PATTERN.match(handle or ""):
+            return None
+        path = self._path(handle)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return text
+
+    def read(self, handle: str, offset: int = 0, length: int = TOOL_OUTPUT_PAGE_CHARS,
+             search: Optional[str] = None) -> Dict[str, Any]:
+        """
+        分页读取保存的内容
+
+        Args:
+            handle: put()返回的句柄
+            offset: 起始字符位置
+            length: 返回的字符数
+            search: 不为空时从offset开始查找该文本，返回以第一个匹配位置为起点的一页
+        """
+        text = self.get(handle)
+        if text is None:
+            return {"error": f"找不到句柄为 {handle} 的工具输出（可能已被清理），请重新调用原工具"}
+        offset = max(0, int(offset))
+        length = max(1, min(int(length), TOOL_OUTPUT_PAGE_CHARS))
+        if search:
+            found = text.find(search, offset)
+            if found < 0:
+                return {"handle": handle, "total": len(text), "error": f"从位置 {offset} 之后没有找到 '{search}'"}
+            offset = found
+        page = text[offset:offset + length]
+        end = offset + len(page)
+        return {
+            "handle": handle,
+            "total": len(text),
+            "offset": offset,
+            "next_offset": end if end < len(text) else None,
+            "text": page,
+        }
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> BlobStore:
+    """进程内共享的BlobStore"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+        return _store
+
+
+class GuardStats:
+    """截断次数和省略的字节数（在系统详情中显示）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Dict[str, int]] = {}
+
+    def record(self, server: str, original: int, kept: int, spilled: bool):
+        with self._lock:
+            item = self._servers.setdefault(server, {"truncated": 0, "spilled": 0, "bytes_in": 0, "bytes_out": 0})
+            item["truncated"] += 1
+            item["spilled"] += int(spilled)
+            item["bytes_in"] += original
+            item["bytes_out"] += kept
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {server: dict(item) for server, item in sorted(self._servers.items())}
+
+
+stats = GuardStats()
+
+
+# ----- 截断 -----
+
+
+def _prune_json(value: Any, items: int, chars: int) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= chars else f"{value[:chars]}…（共{len(value)}字符）"
+    if isinstance(value, list):
+        kept = [_prune_json(item, items, chars) for item in value[:items]]
+        if len(value) > items:
+            kept.append(f"…省略 {len(value) - items} 项")
+        return kept
+    if isinstance(value, dict):
+        keys = list(value)
+        # 对象的字段通常是不同含义的数据，至少保留10个
+        limit = max(items, 10)
+        kept = {key: _prune_json(value[key], items, chars) for key in keys[:limit]}
+        if len(keys) > limit:
+            kept["…"] = f"省略 {len(keys) - limit} 个字段"
+        return kept
+    return value
+
+
+def _truncate_json(text: str, policy: OutputPolicy) -> Optional[str]:
+    """按_JSON_LEVELS逐级缩减JSON，返回第一个满足上限的结果；不是JSON或无法缩减到上限时返回None"""
+    if text[:1024].lstrip()[:1] not in ("{", "[") or len(text) > _JSON_PARSE_LIMIT:
+        return None
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    for items, chars in _JSON_LEVELS:
+        candidate = json.dumps(_prune_json(value, items, chars), ensure_ascii=False)
+        if policy.fits(candidate):
+            return candidate
+    return None
+
+
+def _cut(text: str, keep: int) -> str:
+    """保留开头约3/4和结尾约1/4共keep个字符，开头部分尽量在换行处截断"""
+    head_len = keep * 3 // 4
+    head = text[:head_len]
+    newline = head.rfind("\n")
+    if newline > head_len * 0.8:
+        head = head[:newline + 1]
+    tail = text[len(text) - (keep - head_len):] if keep > head_len else ""
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}\n[... 省略 {omitted} 个字符 ...]\n{tail}"
+
+
+def _truncate_text(text: str, policy: OutputPolicy) -> str:
+    """二分查找满足上限的最大保留字符数"""
+    low, high = 0, min(len(text), policy.max_bytes)
+    best = _cut(text, 0)
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = _cut(text, middle)
+        if policy.fits(candidate):
+            best, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    return best
+
+
+# 为截断说明预留的字节数，上限较小时最多预留上限的四分之一，保证截断后仍保留大部分内容
+_NOTE_RESERVE = 400
+
+
+def truncate(text: str, policy: OutputPolicy) -> str:
+    """把text缩减到策略上限（扣除说明文字的预留）以内: JSON保持合法，其他文本保留首尾"""
+    budget = OutputPolicy(
+        max(policy.max_bytes - min(_NOTE_RESERVE, policy.max_bytes // 4), 1),
+        policy.max_tokens - min(_NOTE_RESERVE // 3, policy.max_tokens // 4) if policy.max_tokens else 0,
+        policy.spill,
+    )
+    return _truncate_json(text, budget) or _truncate_text(text, budget)
+
+
+# ----- 工具结果 -----
+
+
+def _split_blocks(content: Any) -> Tuple[str, List[Any]]:
+    """把工具结果的内容拆分为文本和非文本内容块"""
+    if isinstance(content, str):
+        return content, []
+    if not isinstance(content, list):
+        return "", [content]
+    texts, others = [], []
+    for block in content:
+        if isinstance(block, str):
+            texts.append(block)
+        elif isinstance(block, dict) and block.get("type") == "text":
+            texts.append(block.get("text", ""))
+        else:
+            others.append(block)
+    return "\n".join(texts), others
+
+
+def _size(value: Any) -> int:
+    if value is None:
+        return 0
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def guard_result(result: Any, policy: OutputPolicy, server: str = "", tool: str = "") -> Any:
+    """
+    按策略检查工具结果，未超过上限时原样返回
+
+    Args:
+        result: MCP工具的返回值，(content, artifact) 或 content
+        policy: 输出策略
+        server: 服务器名称（用于统计）
+        tool: 工具名称（写入说明）
+    """
+    with_artifact = isinstance(result, tuple) and len(result) == 2
+    content, artifact = result if with_artifact else (result, None)
+    text, others = _split_blocks(content)
+    other_bytes = sum(_size(block) for block in others)
+    artifact_bytes = _size(artifact)
+    if policy.fits(text) and other_bytes <= policy.max_bytes and artifact_bytes <= policy.max_bytes:
+        return result
+
+    notes = []
+    original = len(text.encode("utf-8"))
+    kept_text = text
+    handle = None
+    if not policy.fits(text):
+        kept_text = truncate(text, policy)
+        if policy.spill:
+            handle = get_store().put(text)
+            notes.append(
+                f"[工具 {tool} 的输出共 {len(text)} 个字符（{original} 字节），以上为截断后的内容。"
+                f"完整内容已保存，可调用 {PAGE_TOOL_NAME}(handle=\"{handle}\", offset=0) 分页读取，"
+                f"或传入search参数查找指定文本]"
+            )
+        else:
+            notes.append(f"[工具 {tool} 的输出共 {len(text)} 个字符（{original} 字节），以上为截断后的内容]")
+    if others and other_bytes > policy.max_bytes:
+        kinds = ", ".join(sorted({str(block.get("type")) if isinstance(block, dict) else type(block).__name__
+                                  for block in others}))
+        notes.append(f"[省略了 {len(others)} 个非文本内容块（{kinds}，共 {other_bytes} 字节）]")
+        others = []
+    if artifact_bytes > policy.max_bytes:
+        artifact = None
+
+    stats.record(server, original + other_bytes, len(kept_text.encode("utf-8")), handle is not None)
+    guarded = "\n".join([kept_text, *notes]) if kept_text else "\n".join(notes)
+    if others:
+        guarded = [{"type": "text", "text": guarded}, *others]
+    return (guarded, artifact) if with_artifact else guarded
+
+
+async def aguard_result(result: Any, policy: OutputPolicy, server: str = "", tool: str = "") -> Any:
+    """guard_result的异步版本，截断和写入存储在线程池中执行，不阻塞事件循环"""
+    return await asyncio.to_thread(guard_result, result, policy, server, tool)
+
+
+def output_page_tool():
+    """分页读取被截断的工具输出的工具（read_tool_output）"""
+    from langchain_core.tools import StructuredTool
+
+    def read_tool_output(handle: str, offset: int = 0, length: int = TOOL_OUTPUT_PAGE_CHARS,
+                         search: str = "") -> str:
+        return json.dumps(get_store().read(handle, offset, length, search or None), ensure_ascii=False)
+
+    return StructuredTool.from_function(
+        func=read_tool_output,
+        name=PAGE_TOOL_NAME,
+        description=(
+            "读取被截断的工具输出的完整内容。handle为截断说明中给出的句柄；offset为起始字符位置，"
+            f"length为读取的字符数（最多{TOOL_OUTPUT_PAGE_CHARS}）；search不为空时从offset开始查找该文本，"
+            "返回从第一个匹配位置开始的一页。返回结果中的next_offset为下一页的起始位置，为null表示已读完。"
+        ),
+    )
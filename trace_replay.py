@@ -0,0 +1,390 @@
+"""
+代理调用的录制与回放
+
+线上变慢的问题很难复现：每次运行都要实时请求DeepSeek和高德。这里提供两种模式：
+
+- 录制（TraceRecorder）: 作为回调处理器加入调用配置的callbacks，记录每次模型调用的最终消息、
+  首个token时间和各文本片段的时间/长度，以及每次工具调用的参数、结果和耗时，逐行写入JSONL文件
+  （以.gz结尾时使用gzip压缩）。同一对话的多轮问题追加到同一个文件，每轮以一条turn记录开头
+- 回放（load_trace + build_replay_agent）: ReplayChatModel按顺序返回录制的模型输出（流式输出的片段
+  长度和时间间隔与录制时相同），回放工具按工具名和参数返回录制的结果。latency_scale为1时按原始耗时回放，
+  为0时不等待，可以在没有网络的机器上测量图执行、回调和渲染本身的开销
+
+benchmarks/replay.py 基于回放对比优化前后的性能。
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_VERSION = 1
+# 设置后每个对话的调用都录制到该目录下的 <thread_id>.jsonl
+TRACE_DIR = os.getenv("AGENT_TRACE_DIR", "")
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _jsonable(value: Any) -> Any:
+    """把工具结果（可能包含pydantic对象、元组等）转换为可以JSON序列化的值"""
+    if hasattr(value, "model_dump"):
+        return _jsonable(value.model_dump(mode="json"))
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _args_key(name: str, args: Any) -> str:
+    return name + ":" + json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+
+
+# ----- 录制 -----
+
+
+class TraceRecorder(BaseCallbackHandler):
+    """
+    把模型调用和工具调用记录到trace文件的回调处理器
+
+    Args:
+        path (str): trace文件路径，已存在时追加
+    """
+
+    # 在产生事件的事件循环中直接执行，记录的时间不受线程池调度影响
+    run_inline = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._runs: Dict[Any, dict] = {}
+        self._last_prefix: Optional[str] = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with _open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def start_turn(self, query: str, tools: Sequence[Any] = (), prefix_hash: Optional[str] = None,
+                   config: Optional[dict] = None):
+        """
+        开始记录新的一轮对话
+
+        工具定义只在提示词前缀（prefix_hash）变化时写入，回放时使用最近一次写入的工具定义。
+        """
+        entry = {"kind": "turn", "version": TRACE_VERSION, "time": time.time(), "query": query}
+        configurable = (config or {}).get("configurable") or {}
+        if configurable:
+            entry["configurable"] = {key: value for key, value in configurable.items() if isinstance(value, str)}
+        if prefix_hash is None or prefix_hash != self._last_prefix:
+            from prompt_cache import canonical_tools
+
+            entry["tools"] = canonical_tools(tools)
+            self._last_prefix = prefix_hash
+        self._write(entry)
+
+    # 模型调用
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = {"start": time.perf_counter(), "first": None, "chunks": []}
+
+    def on_llm_new_token(self, token, *, chunk=None, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        now = time.perf_counter() - run["start"]
+        if run["first"] is None:
+            run["first"] = now
+        text = token if isinstance(token, str) else ""
+        run["chunks"].append([round(now, 4), len(text)])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        from langchain_core.messages import message_to_dict
+
+        generation = response.generations[0][0]
+        self._write({
+            "kind": "llm",
+            "latency": round(time.perf_counter() - run["start"], 4),
+            "ttft": round(run["first"], 4) if run["first"] is not None else None,
+            "chunks": run["chunks"],
+            "message": message_to_dict(generation.message),
+        })
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        from model_router import Escalated
+
+        run = self._runs.pop(run_id, None)
+        # 路由升级时被丢弃的快速模型输出不录制，回放时代理只看到被采用的输出
+        if run is not None and not isinstance(error, Escalated):
+            self._write({
+                "kind": "llm",
+                "latency": round(time.perf_counter() - run["start"], 4),
+                "error": f"{type(error).__name__}: {error}",
+            })
+
+    # 工具调用
+
+    def on_tool_start(self, serialized, input_str, *, run_id, inputs=None, **kwargs):
+        if inputs is None:
+            try:
+                inputs = json.loads(input_str)
+            except (TypeError, ValueError):
+                inputs = {"input": input_str}
+        self._runs[run_id] = {
+            "start": time.perf_counter(),
+            "name": (serialized or {}).get("name") or kwargs.get("name"),
+            "args": _jsonable(inputs),
+        }
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        entry = {
+            "kind": "tool",
+            "name": run["name"],
+            "args": run["args"],
+            "latency": round(time.perf_counter() - run["start"], 4),
+        }
+        if hasattr(output, "content") and hasattr(output, "tool_call_id"):
+            entry["content"] = _jsonable(output.content)
+            entry["artifact"] = _jsonable(getattr(output, "artifact", None))
+            entry["status"] = getattr(output, "status", "success")
+        else:
+            entry["content"] = _jsonable(output)
+        self._write(entry)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self._write({
+                "kind": "tool",
+                "name": run["name"],
+                "args": run["args"],
+                "latency": round(time.perf_counter() - run["start"], 4),
+                "error": f"{type(error).__name__}: {error}",
+            })
+
+
+def trace_path(thread_id: str, directory: str = TRACE_DIR) -> str:
+    return os.path.join(directory, f"{thread_id}.jsonl")
+
+
+# ----- 回放 -----
+
+
+class Trace:
+    """解析后的trace: 各轮问题、工具定义、按顺序的模型调用和按工具名+参数分组的工具调用"""
+
+    def __init__(self, entries: Iterable[dict]):
+        self.turns: List[dict] = []
+        self.tools: Dict[str, dict] = {}
+        self.llm_calls: List[dict] = []
+        self.tool_calls: List[dict] = []
+        for entry in entries:
+            kind = entry.get("kind")
+            if kind == "turn":
+                self.turns.append(entry)
+                for schema in entry.get("tools") or []:
+                    self.tools[schema["function"]["name"]] = schema
+            elif kind == "llm":
+                self.llm_calls.append(entry)
+            elif kind == "tool":
+                self.tool_calls.append(entry)
+
+    @property
+    def recorded_latency(self) -> float:
+        """录制时模型调用和工具调用的总耗时（秒）"""
+        return sum(entry.get("latency", 0) for entry in self.llm_calls + self.tool_calls)
+
+    def summary(self) -> dict:
+        return {
+            "turns": len(self.turns),
+            "llm_calls": len(self.llm_calls),
+            "tool_calls": len(self.tool_calls),
+            "tools": len(self.tools),
+            "recorded_latency": round(self.recorded_latency, 3),
+        }
+
+
+def load_trace(path: str) -> Trace:
+    with _open(path, "r") as f:
+        return Trace(json.loads(line) for line in f if line.strip())
+
+
+class ReplayExhausted(RuntimeError):
+    """回放时的调用次数超过了录制的调用次数"""
+
+
+class _ReplayState:
+    """一次回放的进度（可重复创建，从头回放）"""
+
+    def __init__(self, trace: Trace, latency_scale: float):
+        self.latency_scale = latency_scale
+        self.llm = deque(trace.llm_calls)
+        self.tools: Dict[str, deque] = defaultdict(deque)
+        self.tools_by_name: Dict[str, deque] = defaultdict(deque)
+        for entry in trace.tool_calls:
+            self.tools[_args_key(entry["name"], entry["args"])].append(entry)
+            self.tools_by_name[entry["name"]].append(entry)
+
+    def next_llm(self) -> dict:
+        if not self.llm:
+            raise ReplayExhausted("trace中没有更多的模型调用")
+        return self.llm.popleft()
+
+    def next_tool(self, name: str, args: dict) -> dict:
+        """优先返回参数完全相同的录制结果，其次按顺序返回同名工具的结果"""
+        queue = self.tools.get(_args_key(name, args))
+        entry = queue.popleft() if queue else None
+        if entry is None:
+            by_name = self.tools_by_name.get(name)
+            if not by_name:
+                raise ReplayExhausted(f"trace中没有工具 {name} 的更多调用")
+            entry = by_name[0]
+        by_name = self.tools_by_name[name]
+        if entry in by_name:
+            by_name.remove(entry)
+        return entry
+
+    async def sleep(self, seconds: Optional[float]):
+        if seconds and self.latency_scale > 0:
+            await asyncio.sleep(seconds * self.latency_scale)
+
+
+def _replay_chat_model_class():
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk, messages_from_dict
+    from langchain_core.messages.tool import tool_call_chunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    class ReplayChatModel(BaseChatModel):
+        """按顺序返回录制的模型输出的聊天模型"""
+
+        state: Any
+
+        @property
+        def _llm_type(self) -> str:
+            return "trace-replay"
+
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        def _message(self, entry: dict):
+            if "error" in entry:
+                raise RuntimeError(entry["error"])
+            message = messages_from_dict([entry["message"]])[0]
+            return AIMessage(
+                content=message.content,
+                tool_calls=message.tool_calls,
+                invalid_tool_calls=message.invalid_tool_calls,
+                usage_metadata=message.usage_metadata,
+                response_metadata=message.response_metadata,
+                id=message.id,
+            )
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            return ChatResult(generations=[ChatGeneration(message=self._message(self.state.next_llm()))])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            entry = self.state.next_llm()
+            await self.state.sleep(entry.get("latency"))
+            return ChatResult(generations=[ChatGeneration(message=self._message(entry))])
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            entry = self.state.next_llm()
+            message = self._message(entry)
+            text = message.content if isinstance(message.content, str) else ""
+            elapsed, position = 0.0, 0
+            for offset, length in entry.get("chunks") or []:
+                await self.state.sleep(offset - elapsed)
+                elapsed = offset
+                piece = text[position:position + length]
+                position += length
+                # on_llm_new_token由BaseChatModel在流式调用时统一触发
+                yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            await self.state.sleep(entry.get("latency", elapsed) - elapsed)
+            rest = text[position:]
+            final = AIMessageChunk(
+                content=rest,
+                tool_call_chunks=[
+                    tool_call_chunk(
+                        name=call["name"],
+                        args=json.dumps(call["args"], ensure_ascii=False),
+                        id=call["id"],
+                        index=index,
+                    )
+                    for index, call in enumerate(message.tool_calls)
+                ],
+                usage_metadata=message.usage_metadata,
+                response_metadata=message.response_metadata,
+                chunk_position="last",
+            )
+            yield ChatGenerationChunk(message=final)
+
+    return ReplayChatModel
+
+
+def replay_tools(trace: Trace, state: _ReplayState) -> list:
+    """根据录制的工具定义创建回放工具"""
+    from langchain_core.tools import StructuredTool, ToolException
+
+    tools = []
+    for name, schema in sorted(trace.tools.items()):
+        function = schema["function"]
+
+        def make(tool_name: str):
+            async def call(**kwargs):
+                entry = state.next_tool(tool_name, _jsonable(kwargs))
+                await state.sleep(entry.get("latency"))
+                if "error" in entry:
+                    raise ToolException(entry["error"])
+                return entry.get("content"), entry.get("artifact")
+
+            return call
+
+        tools.append(StructuredTool.from_function(
+            coroutine=make(name),
+            name=name,
+            description=function.get("description", ""),
+            args_schema=function.get("parameters") or {"type": "object", "properties": {}},
+            response_format="content_and_artifact",
+        ))
+    return tools
+
+
+def build_replay_agent(trace: Trace, latency_scale: float = 1.0, prompt: Optional[Any] = None):
+    """
+    创建回放用的代理（create_react_agent + 回放模型 + 回放工具 + 与应用相同的DedupMemorySaver）
+
+    Args:
+        trace (Trace): load_trace()的结果
+        latency_scale (float): 录制耗时的缩放比例，1为原始耗时，0为不等待
+        prompt: 系统提示词（可选，只影响消息大小）
+    """
+    from langgraph.prebuilt import create_react_agent
+
+    from checkpoint_dedup import DedupMemorySaver
+
+    state = _ReplayState(trace, latency_scale)
+    model = _replay_chat_model_class()(state=state)
+    return create_react_agent(model, replay_tools(trace, state), checkpointer=DedupMemorySaver(), prompt=prompt)
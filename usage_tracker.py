@@ -0,0 +1,295 @@
+"""
+token用量与费用统计
+
+每轮对话结束后，根据本轮产生的消息统计（消息由usage_callback()在模型和工具调用结束时收集，
+包括模型路由升级时被丢弃的快速模型输出，以及超时或出错的轮次中已经完成的调用）：
+
+- 模型调用次数、输入/输出token数、缓存命中token数（来自AIMessage的usage_metadata，见prompt_cache）
+- 工具调用次数和工具输出回填给模型的token数（按工具分别统计）。DeepSeek不返回这部分的用量，
+  按官方给出的换算比例估算：1个英文字符约0.3个token，1个中文字符约0.6个token
+- 上下文大小: 本轮最后一次模型调用的输入和输出token数之和，即下一轮开始时对话历史已经占用的token数
+- 费用: 按 model_config.json 中 "pricing" 部分的单价（每百万token）逐次计算；启用模型路由时
+  每次调用的模型取响应中的model_name
+
+结果按轮次写入本地SQLite，可以按thread_id汇总，找出token用量大、上下文过长的对话。
+上下文大小超过 AGENT_CONTEXT_ALERT_TOKENS 时 alert() 返回提示信息。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from prompt_cache import token_usage
+
+USAGE_DB_PATH = os.getenv("AGENT_USAGE_DB", ".agent_usage.sqlite")
+# 对话上下文超过该token数时提示
+CONTEXT_ALERT_TOKENS = int(os.getenv("AGENT_CONTEXT_ALERT_TOKENS", "32000"))
+MODEL_CONFIG_PATH = os.getenv("MODEL_CONFIG_PATH", "model_config.json")
+
+# 每百万token的单价，model_config.json中没有pricing部分时使用
+DEFAULT_PRICING = {
+    "currency": "CNY",
+    "models": {
+        "deepseek-chat": {"input": 2.0, "cache_hit": 0.2, "output": 3.0},
+        "deepseek-reasoner": {"input": 2.0, "cache_hit": 0.2, "output": 3.0},
+    },
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    thread_id TEXT NOT NULL,
+    turn INTEGER NOT NULL,
+    time REAL NOT NULL,
+    model TEXT,
+    seconds REAL,
+    calls INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cache_read_tokens INTEGER NOT NULL,
+    tool_calls INTEGER NOT NULL,
+    tool_output_tokens INTEGER NOT NULL,
+    context_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    tools TEXT,
+    PRIMARY KEY (thread_id, turn)
+);
+"""
+
+_TOTAL_FIELDS = (
+    "calls", "input_tokens", "output_tokens", "cache_read_tokens", "tool_calls", "tool_output_tokens", "cost"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """按DeepSeek给出的换算比例估算token数（中文字符0.6，其他字符0.3）"""
+    wide = sum(1 for char in text if ord(char) > 0x2E7F)
+    return int(round(wide * 0.6 + (len(text) - wide) * 0.3))
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part) for part in content
+        )
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+def load_pricing(path: str = MODEL_CONFIG_PATH) -> dict:
+    """读取model_config.json中的pricing部分，不存在时使用DEFAULT_PRICING"""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            pricing = json.load(f).get("pricing")
+        if pricing:
+            return pricing
+    return DEFAULT_PRICING
+
+
+def turn_cost(usage: Dict[str, int], model: Optional[str], pricing: dict) -> float:
+    """按每百万token单价计算一次（或多次）调用的费用，未配置单价的模型计为0"""
+    price = (pricing.get("models") or {}).get(model or "")
+    if not price:
+        return 0.0
+    cache_hit = usage["cache_read_tokens"]
+    cost = (
+        (usage["input_tokens"] - cache_hit) * price.get("input", 0)
+        + cache_hit * price.get("cache_hit", price.get("input", 0))
+        + usage["output_tokens"] * price.get("output", 0)
+    )
+    return cost / 1_000_000
+
+
+def turn_usage(messages: Iterable[Any], model: Optional[str] = None, pricing: Optional[dict] = None) -> dict:
+    """
+    统计一轮对话的token用量
+
+    Args:
+        messages: 本轮产生的消息（模型响应和工具结果），通常为usage_callback()收集的消息
+        model: 本轮选择的模型，响应中没有model_name时用于计算费用
+        pricing: 单价配置，默认读取model_config.json
+    """
+    pricing = pricing if pricing is not None else load_pricing()
+    usage = {
+        "calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cache_read_tokens": 0,
+        "tool_calls": 0,
+        "tool_output_tokens": 0,
+        "context_tokens": 0,
+        "cost": 0.0,
+        "tools": {},
+    }
+    for message in messages:
+        kind = getattr(message, "type", None)
+        if kind == "ai":
+            usage["calls"] += 1
+            counts = token_usage(message)
+            for key, value in counts.items():
+                usage[key] += value
+            if counts["input_tokens"]:
+                usage["context_tokens"] = counts["input_tokens"] + counts["output_tokens"]
+            metadata = getattr(message, "response_metadata", None) or {}
+            usage["cost"] += turn_cost(counts, metadata.get("model_name") or model, pricing)
+        elif kind == "tool":
+            tokens = estimate_tokens(_content_text(message.content))
+            name = getattr(message, "name", None) or "unknown"
+            usage["tool_calls"] += 1
+            usage["tool_output_tokens"] += tokens
+            usage["tools"][name] = usage["tools"].get(name, 0) + tokens
+    usage["cost"] = round(usage["cost"], 6)
+    return usage
+
+
+def _usage_callback_class():
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.messages import BaseMessage, message_chunk_to_message
+
+    class UsageCallback(BaseCallbackHandler):
+        """收集本轮每次模型调用的响应和每次工具调用的结果"""
+
+        run_inline = True
+
+        def __init__(self):
+            self.messages: List[Any] = []
+            self._lock = threading.Lock()
+
+        def _add(self, message: Any):
+            if isinstance(message, BaseMessage):
+                with self._lock:
+                    self.messages.append(message_chunk_to_message(message))
+
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    self._add(getattr(generation, "message", None))
+
+        def on_llm_error(self, error, **kwargs):
+            from model_router import Escalated
+
+            # 被丢弃的快速模型输出同样计费
+            if isinstance(error, Escalated):
+                self._add(error.message)
+
+        def on_tool_end(self, output, **kwargs):
+            self._add(output)
+
+    return UsageCallback
+
+
+def usage_callback():
+    """返回新的用量回调处理器，加入调用配置的callbacks，本轮结束（含超时和出错）后把其messages传给turn_usage()"""
+    return _usage_callback_class()()
+
+
+class UsageTracker:
+    """按轮次持久化token用量，可在多个线程中共享"""
+
+    def __init__(self, path: str = USAGE_DB_PATH, alert_tokens: int = CONTEXT_ALERT_TOKENS):
+        self.path = path
+        self.alert_tokens = alert_tokens
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def record(self, thread_id: str, usage: dict, model: Optional[str] = None,
+               seconds: Optional[float] = None) -> int:
+        """记录一轮的用量（turn_usage()的结果），返回轮次序号"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(turn), 0) FROM turns WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            turn = row[0] + 1
+            self._conn.execute(
+                "INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id, turn, time.time(), model, seconds,
+                    usage["calls"], usage["input_tokens"], usage["output_tokens"], usage["cache_read_tokens"],
+                    usage["tool_calls"], usage["tool_output_tokens"], usage["context_tokens"], usage["cost"],
+                    json.dumps(usage.get("tools") or {}, ensure_ascii=False),
+                ),
+            )
+            return turn
+
+    def turns(self, thread_id: str, limit: int = 20) -> List[dict]:
+        """最近limit轮的用量（按时间倒序）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM turns WHERE thread_id = ? ORDER BY turn DESC LIMIT ?", (thread_id, limit)
+            ).fetchall()
+        result = []
+        for row in rows:
+            item = dict(row)
+            item["tools"] = json.loads(item["tools"] or "{}")
+            result.append(item)
+        return result
+
+    def thread_summary(self, thread_id: str) -> dict:
+        """一个对话的累计用量，context_tokens为最近一轮结束时的上下文大小"""
+        sums = ", ".join(f"COALESCE(SUM({field}), 0) AS {field}" for field in _TOTAL_FIELDS)
+        with self._lock:
+            total = dict(self._conn.execute(
+                f"SELECT COUNT(*) AS turns, {sums} FROM turns WHERE thread_id = ?", (thread_id,)
+            ).fetchone())
+            last = self._conn.execute(
+                "SELECT context_tokens FROM turns WHERE thread_id = ? ORDER BY turn DESC LIMIT 1", (thread_id,)
+            ).fetchone()
+            tool_rows = self._conn.execute("SELECT tools FROM turns WHERE thread_id = ?", (thread_id,)).fetchall()
+        tools: Dict[str, int] = {}
+        for row in tool_rows:
+            for name, tokens in json.loads(row["tools"] or "{}").items():
+                tools[name] = tools.get(name, 0) + tokens
+        total["context_tokens"] = last["context_tokens"] if last else 0
+        total["cost"] = round(total["cost"], 6)
+        total["tools"] = dict(sorted(tools.items(), key=lambda item: -item[1]))
+        return total
+
+    def top_threads(self, limit: int = 5, order_by: str = "cost") -> List[dict]:
+        """按累计费用（cost）、累计输入token（input_tokens）或最大上下文（context_tokens）排序的对话"""
+        column = {
+            "cost": "SUM(cost)",
+            "input_tokens": "SUM(input_tokens)",
+            "context_tokens": "MAX(context_tokens)",
+        }[order_by]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT thread_id, COUNT(*) AS turns, SUM(input_tokens) AS input_tokens, "
+                f"SUM(output_tokens) AS output_tokens, MAX(context_tokens) AS context_tokens, "
+                f"SUM(cost) AS cost FROM turns GROUP BY thread_id ORDER BY {column} DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def alert(self, thread_id: str) -> Optional[str]:
+        """对话上下文超过阈值时返回提示信息"""
+        if self.alert_tokens <= 0:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT context_tokens FROM turns WHERE thread_id = ? ORDER BY turn DESC LIMIT 1", (thread_id,)
+            ).fetchone()
+        if row is None or row["context_tokens"] < self.alert_tokens:
+            return None
+        return (
+            f"当前对话的上下文已达到 {row['context_tokens']} tokens（阈值 {self.alert_tokens}），"
+            f"后续每轮的延迟和费用都会增加，建议重置对话"
+        )
+
+
+_tracker: Optional[UsageTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker() -> UsageTracker:
+    """进程内共享的UsageTracker"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = UsageTracker()
+        return _tracker
@@ -1,322 +1,475 @@
-from typing import Any, Dict, List, Callable, Optional
-from langchain_core.messages import BaseMessage
+import json
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Optional, Sequence, Union
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
 from langchain_core.runnables import RunnableConfig
-from langgraph.graph.state import CompiledStateGraph
 import uuid
 
+if TYPE_CHECKING:
+    # 仅用于类型标注；运行时导入langgraph.graph会显著拖慢启动
+    from langgraph.graph.state import CompiledStateGraph
+
 
 def random_uuid():
     return str(uuid.uuid4())
 
 
+# ----- 流式事件 -----
+# 事件对象使用__slots__，每个数据块只创建必要的小对象，消费方按类型分派即可
+
+
+class StreamEvent:
+    """流式事件基类，node为产生该事件的图节点名称"""
+
+    __slots__ = ("node",)
+    kind = "event"
+
+    def __init__(self, node: str):
+        self.node = node
+
+    def __repr__(self):
+        fields = []
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                fields.append(f"{name}={getattr(self, name)!r}")
+        return f"{type(self).__name__}({', '.join(fields)})"
+
+
+class TokenEvent(StreamEvent):
+    """模型输出的文本片段"""
+
+    __slots__ = ("text", "message")
+    kind = "token"
+
+    def __init__(self, node: str, text: str, message: Any = None):
+        super().__init__(node)
+        self.text = text
+        self.message = message
+
+
+class ToolCallStartEvent(StreamEvent):
+    """工具调用开始，args为参数的第一个片段（非流式消息时为完整参数JSON）"""
+
+    __slots__ = ("index", "id", "name", "args")
+    kind = "tool_call_start"
+
+    def __init__(self, node: str, index: Optional[int], id: Optional[str], name: str, args: str = ""):
+        super().__init__(node)
+        self.index = index
+        self.id = id
+        self.name = name
+        self.args = args
+
+
+class ToolCallDeltaEvent(StreamEvent):
+    """工具调用参数的后续片段"""
+
+    __slots__ = ("index", "id", "args_delta")
+    kind = "tool_call_delta"
+
+    def __init__(self, node: str, index: Optional[int], id: Optional[str], args_delta: str):
+        super().__init__(node)
+        self.index = index
+        self.id = id
+        self.args_delta = args_delta
+
+
+class ToolResultEvent(StreamEvent):
+    """工具执行结果"""
+
+    __slots__ = ("tool_call_id", "name", "content", "message")
+    kind = "tool_result"
+
+    def __init__(self, node: str, tool_call_id: Optional[str], name: Optional[str], content: Any, message: Any = None):
+        super().__init__(node)
+        self.tool_call_id = tool_call_id
+        self.name = name
+        self.content = content
+        self.message = message
+
+
+class NodeChangeEvent(StreamEvent):
+    """当前输出的节点发生变化，namespace为子图命名空间（根图为空元组）"""
+
+    __slots__ = ("prev_node", "namespace")
+    kind = "node_change"
+
+    def __init__(self, node: str, prev_node: Optional[str], namespace: tuple = ()):
+        super().__init__(node)
+        self.prev_node = prev_node
+        self.namespace = namespace
+
+
+class NodeUpdateEvent(StreamEvent):
+    """节点执行完成后写入状态的完整更新（updates模式）"""
+
+    __slots__ = ("update", "namespace")
+    kind = "node_update"
+
+    def __init__(self, node: str, update: Any, namespace: tuple = ()):
+        super().__init__(node)
+        self.update = update
+        self.namespace = namespace
+
+    @property
+    def messages(self) -> list:
+        return _node_messages(self.update)
+
+
+class CustomEvent(StreamEvent):
+    """节点通过StreamWriter写出的自定义数据（custom模式）"""
+
+    __slots__ = ("data", "namespace")
+    kind = "custom"
+
+    def __init__(self, node: Optional[str], data: Any, namespace: tuple = ()):
+        super().__init__(node)
+        self.data = data
+        self.namespace = namespace
+
+
+class DebugEvent(StreamEvent):
+    """LangGraph的调试事件（debug模式），data包含type、step、payload等字段"""
+
+    __slots__ = ("data", "namespace")
+    kind = "debug"
+
+    def __init__(self, node: Optional[str], data: Any, namespace: tuple = ()):
+        super().__init__(node)
+        self.data = data
+        self.namespace = namespace
+
+
+class DoneEvent(StreamEvent):
+    """流结束，content为最后一个数据块的内容，metadata为messages模式的元数据或updates模式的命名空间"""
+
+    __slots__ = ("content", "metadata")
+    kind = "done"
+
+    def __init__(self, node: Optional[str], content: Any = None, metadata: Any = None):
+        super().__init__(node)
+        self.content = content
+        self.metadata = metadata
+
+
+def message_text(message: Any) -> str:
+    """提取消息中的文本，兼容字符串content和列表形式的content（Anthropic/Claude风格）"""
+    content = getattr(message, "content", message)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(item["text"] for item in content if isinstance(item, dict) and "text" in item)
+    return ""
+
+
+def message_events(node: str, message: Any) -> list:
+    """把一条消息（或消息块）转换为事件列表"""
+    if isinstance(message, ToolMessage):
+        return [ToolResultEvent(node, message.tool_call_id, message.name, message.content, message)]
+
+    events = []
+    text = message_text(message)
+    if text:
+        events.append(TokenEvent(node, text, message))
+
+    tool_call_chunks = getattr(message, "tool_call_chunks", None)
+    if tool_call_chunks:
+        for chunk in tool_call_chunks:
+            if chunk.get("name"):
+                events.append(ToolCallStartEvent(node, chunk.get("index"), chunk.get("id"), chunk["name"], chunk.get("args") or ""))
+            elif chunk.get("args"):
+                events.append(ToolCallDeltaEvent(node, chunk.get("index"), chunk.get("id"), chunk["args"]))
+    elif isinstance(message, AIMessage) and message.tool_calls:
+        # 非流式的完整消息（updates模式）
+        for index, call in enumerate(message.tool_calls):
+            events.append(ToolCallStartEvent(node, index, call.get("id"), call["name"], json.dumps(call["args"], ensure_ascii=False)))
+    return events
+
+
+def _node_messages(node_chunk: Any) -> list:
+    """取出updates模式下节点输出中的消息"""
+    if isinstance(node_chunk, dict):
+        messages = node_chunk.get("messages", [])
+        return messages if isinstance(messages, list) else [messages]
+    if isinstance(node_chunk, BaseMessage):
+        return [node_chunk]
+    return []
+
+
+class ToolCall:
+    """拼装完成（或正在拼装）的一次工具调用"""
+
+    __slots__ = ("index", "id", "name", "args_text", "args", "complete", "result")
+
+    def __init__(self, index: Optional[int], id: Optional[str], name: str, args_text: str = ""):
+        self.index = index
+        self.id = id
+        self.name = name
+        self.args_text = args_text
+        self.args = None
+        self.complete = False
+        self.result = None
+
+    def finish(self, args: Any = None):
+        """标记调用完成：优先使用给定的完整参数，否则把拼接的参数文本解析一次"""
+        if self.complete:
+            return
+        if args is not None:
+            self.args = args
+        elif self.args_text:
+            try:
+                self.args = json.loads(self.args_text)
+            except ValueError:
+                self.args = self.args_text
+        else:
+            self.args = {}
+        self.complete = True
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "args": self.args, "result": self.result}
+
+
+class ToolCallAssembler:
+    """
+    工具调用拼装器
+
+    按index/id把ToolCallDeltaEvent的参数片段拼接到对应的调用上，在调用结束时只解析一次JSON。
+    调用在以下情况视为结束：同一index开始了新的调用、节点发生变化、收到工具结果、
+    收到包含完整tool_calls的节点更新（此时以完整参数为准）、流结束。
+
+    feed()返回状态发生变化（完成或得到结果）的调用列表，调用方只需在列表非空时刷新显示。
+    """
+
+    def __init__(self):
+        self.calls: List[ToolCall] = []
+        self._open: dict = {}
+        self._by_id: dict = {}
+
+    def _close_open(self, changed: list):
+        for call in self._open.values():
+            call.finish()
+            changed.append(call)
+        self._open.clear()
+
+    def feed(self, event: StreamEvent) -> List[ToolCall]:
+        changed: List[ToolCall] = []
+        if isinstance(event, ToolCallStartEvent):
+            previous = self._open.pop(event.index, None)
+            if previous is not None:
+                previous.finish()
+                changed.append(previous)
+            call = ToolCall(event.index, event.id, event.name, event.args)
+            self.calls.append(call)
+            self._open[event.index] = call
+            if event.id:
+                self._by_id[event.id] = call
+        elif isinstance(event, ToolCallDeltaEvent):
+            call = self._open.get(event.index) or self._by_id.get(event.id)
+            if call is not None and not call.complete:
+                call.args_text += event.args_delta
+        elif isinstance(event, NodeUpdateEvent):
+            for message in event.messages:
+                for tool_call in getattr(message, "tool_calls", None) or ():
+                    call = self._by_id.get(tool_call.get("id"))
+                    if call is None:
+                        call = ToolCall(None, tool_call.get("id"), tool_call["name"])
+                        self.calls.append(call)
+                        if call.id:
+                            self._by_id[call.id] = call
+                    if not call.complete:
+                        call.finish(tool_call["args"])
+                        changed.append(call)
+            self._close_open(changed)
+        elif isinstance(event, ToolResultEvent):
+            self._close_open(changed)
+            call = self._by_id.get(event.tool_call_id)
+            if call is None:
+                call = ToolCall(None, event.tool_call_id, event.name or "")
+                call.finish()
+                self.calls.append(call)
+            call.result = message_text(event.message) if event.message is not None else str(event.content)
+            changed.append(call)
+        elif isinstance(event, (NodeChangeEvent, DoneEvent)):
+            self._close_open(changed)
+        return changed
+
+    def to_list(self) -> List[dict]:
+        return [call.to_dict() for call in self.calls]
+
+
+STREAM_MODES = ("messages", "updates", "custom", "debug")
+
+
+def _split_chunk(chunk: Any, multi_mode: bool, include_subgraphs: bool, stream_mode: str):
+    """把graph.astream产出的数据块统一拆分为(namespace, mode, data)"""
+    namespace = ()
+    if include_subgraphs:
+        namespace, chunk = chunk[0], chunk[1:]
+        chunk = chunk if multi_mode else chunk[0]
+    if multi_mode:
+        mode, data = chunk
+    else:
+        mode, data = stream_mode, chunk
+    return tuple(namespace), mode, data
+
+
 async def astream_graph(
-    graph: CompiledStateGraph,
+    graph: "CompiledStateGraph",
     inputs: dict,
     config: Optional[RunnableConfig] = None,
-    node_names: List[str] = [],
-    callback: Optional[Callable] = None,
-    stream_mode: str = "messages",
+    node_names: Sequence[str] = (),
+    stream_mode: Union[str, Sequence[str]] = "messages",
     include_subgraphs: bool = False,
-) -> Dict[str, Any]:
+) -> AsyncIterator[StreamEvent]:
     """
-    异步流式处理LangGraph执行结果并直接输出的函数。
+    异步流式执行LangGraph，并以事件的形式逐个产出结果。
+
+    stream_mode可以是单个模式，也可以是模式列表（如["messages", "updates"]），
+    多个模式在同一次graph.astream中完成，按模式分派为不同的事件：
+
+    - messages: TokenEvent、ToolCallStartEvent、ToolCallDeltaEvent、ToolResultEvent
+    - updates: NodeUpdateEvent（节点完成后的完整输出）；未同时请求messages模式时，
+      还会从节点输出的消息中产出上述消息事件
+    - custom: CustomEvent（节点通过StreamWriter写出的自定义数据）
+    - debug: DebugEvent
 
     Args:
         graph (CompiledStateGraph): 要执行的编译后的LangGraph对象
         inputs (dict): 传递给图的输入值字典
         config (Optional[RunnableConfig]): 执行配置（可选）
-        node_names (List[str], optional): 要输出的节点名称列表。默认值为空列表
-        callback (Optional[Callable], optional): 处理每个数据块的回调函数。默认值为None
-            回调函数接收{"node": str, "content": Any}形式的字典作为参数。
-        stream_mode (str, optional): 流模式（"messages"或"updates"）。默认值为"messages"
+        node_names (Sequence[str], optional): 要输出的节点名称列表。默认为空，即输出所有节点
+        stream_mode (Union[str, Sequence[str]], optional): 流模式，取值见STREAM_MODES。默认值为"messages"
         include_subgraphs (bool, optional): 是否包含子图。默认值为False
 
-    Returns:
-        Dict[str, Any]: 最终结果（可选）
+    Yields:
+        StreamEvent: 上述事件及NodeChangeEvent，最后总是产出一个DoneEvent
     """
     config = config or {}
-    final_result = {}
+    multi_mode = not isinstance(stream_mode, str)
+    modes = list(stream_mode) if multi_mode else [stream_mode]
+    invalid = [mode for mode in modes if mode not in STREAM_MODES]
+    if invalid or not modes:
+        raise ValueError(
+            f"Invalid stream_mode: {stream_mode}. Must be one or more of {', '.join(STREAM_MODES)}."
+        )
+    # 同时请求messages模式时，消息事件由messages模式产出，updates模式只产出节点更新
+    messages_from_updates = "messages" not in modes
 
-    def format_namespace(namespace):
-        return namespace[-1].split(":")[0] if len(namespace) > 0 else "root graph"
+    prev_node = None
+    last_node, last_content, last_metadata = None, None, None
 
-    prev_node = ""
+    async for chunk in graph.astream(
+        inputs, config, stream_mode=stream_mode, subgraphs=include_subgraphs
+    ):
+        namespace, mode, data = _split_chunk(chunk, multi_mode, include_subgraphs, stream_mode)
 
-    if stream_mode == "messages":
-        async for chunk_msg, metadata in graph.astream(
-            inputs, config, stream_mode=stream_mode
-        ):
+        if mode == "messages":
+            chunk_msg, metadata = data
             curr_node = metadata["langgraph_node"]
-            final_result = {
-                "node": curr_node,
-                "content": chunk_msg,
-                "metadata": metadata,
-            }
-
-            # node_names가 비어있거나 현재 노드가 node_names에 있는 경우에만 처리
-            if not node_names or curr_node in node_names:
-                # 콜백 함수가 있는 경우 실행
-                if callback:
-                    result = callback({"node": curr_node, "content": chunk_msg})
-                    if hasattr(result, "__await__"):
-                        await result
-                # 콜백이 없는 경우 기본 출력
-                else:
-                    # 노드가 변경된 경우에만 구분선 출력
-                    if curr_node != prev_node:
-                        print("\n" + "=" * 50)
-                        print(f"🔄 Node: \033[1;36m{curr_node}\033[0m 🔄")
-                        print("- " * 25)
-
-                    # Claude/Anthropic 모델의 토큰 청크 처리 - 항상 텍스트만 추출
-                    if hasattr(chunk_msg, "content"):
-                        # 리스트 형태의 content (Anthropic/Claude 스타일)
-                        if isinstance(chunk_msg.content, list):
-                            for item in chunk_msg.content:
-                                if isinstance(item, dict) and "text" in item:
-                                    print(item["text"], end="", flush=True)
-                        # 문자열 형태의 content
-                        elif isinstance(chunk_msg.content, str):
-                            print(chunk_msg.content, end="", flush=True)
-                    # 그 외 형태의 chunk_msg 처리
-                    else:
-                        print(chunk_msg, end="", flush=True)
+            last_node, last_content, last_metadata = curr_node, chunk_msg, metadata
 
+            if node_names and curr_node not in node_names:
+                continue
+            if curr_node != prev_node:
+                yield NodeChangeEvent(curr_node, prev_node, namespace)
                 prev_node = curr_node
+            for event in message_events(curr_node, chunk_msg):
+                yield event
 
-    elif stream_mode == "updates":
-        # 错误修复：更改解包方式
-        # REACT代理等部分图只返回单一字典
-        async for chunk in graph.astream(
-            inputs, config, stream_mode=stream_mode, subgraphs=include_subgraphs
-        ):
-            # 根据返回格式决定处理方法
-            if isinstance(chunk, tuple) and len(chunk) == 2:
-                # 原有预期格式：(namespace, chunk_dict)
-                namespace, node_chunks = chunk
-            else:
-                # 只返回单一字典的情况（REACT代理等）
-                namespace = []  # 空命名空间（根图）
-                node_chunks = chunk  # chunk本身就是节点块字典
-
-            # 确认是否为字典并处理项目
-            if isinstance(node_chunks, dict):
-                for node_name, node_chunk in node_chunks.items():
-                    final_result = {
-                        "node": node_name,
-                        "content": node_chunk,
-                        "namespace": namespace,
-                    }
-
-                    # 仅在node_names不为空时进行过滤
-                    if len(node_names) > 0 and node_name not in node_names:
-                        continue
-
-                    # 如果有回调函数则执行
-                    if callback is not None:
-                        result = callback({"node": node_name, "content": node_chunk})
-                        if hasattr(result, "__await__"):
-                            await result
-                    # 没有回调的情况下默认输出
-                    else:
-                        # 仅当节点变更时输出分隔线（与messages模式相同）
-                        if node_name != prev_node:
-                            print("\n" + "=" * 50)
-                            print(f"🔄 Node: \033[1;36m{node_name}\033[0m 🔄")
-                            print("- " * 25)
-
-                        # 输出节点的块数据 - 以文本为中心处理
-                        if isinstance(node_chunk, dict):
-                            for k, v in node_chunk.items():
-                                if isinstance(v, BaseMessage):
-                                    # BaseMessage의 content 속성이 텍스트나 리스트인 경우를 처리
-                                    if hasattr(v, "content"):
-                                        if isinstance(v.content, list):
-                                            for item in v.content:
-                                                if (
-                                                    isinstance(item, dict)
-                                                    and "text" in item
-                                                ):
-                                                    print(
-                                                        item["text"], end="", flush=True
-                                                    )
-                                        else:
-                                            print(v.content, end="", flush=True)
-                                    else:
-                                        v.pretty_print()
-                                elif isinstance(v, list):
-                                    for list_item in v:
-                                        if isinstance(list_item, BaseMessage):
-                                            if hasattr(list_item, "content"):
-                                                if isinstance(list_item.content, list):
-                                                    for item in list_item.content:
-                                                        if (
-                                                            isinstance(item, dict)
-                                                            and "text" in item
-                                                        ):
-                                                            print(
-                                                                item["text"],
-                                                                end="",
-                                                                flush=True,
-                                                            )
-                                                else:
-                                                    print(
-                                                        list_item.content,
-                                                        end="",
-                                                        flush=True,
-                                                    )
-                                            else:
-                                                list_item.pretty_print()
-                                        elif (
-                                            isinstance(list_item, dict)
-                                            and "text" in list_item
-                                        ):
-                                            print(list_item["text"], end="", flush=True)
-                                        else:
-                                            print(list_item, end="", flush=True)
-                                elif isinstance(v, dict) and "text" in v:
-                                    print(v["text"], end="", flush=True)
-                                else:
-                                    print(v, end="", flush=True)
-                        elif node_chunk is not None:
-                            if hasattr(node_chunk, "__iter__") and not isinstance(
-                                node_chunk, str
-                            ):
-                                for item in node_chunk:
-                                    if isinstance(item, dict) and "text" in item:
-                                        print(item["text"], end="", flush=True)
-                                    else:
-                                        print(item, end="", flush=True)
-                            else:
-                                print(node_chunk, end="", flush=True)
-
-                        # 这里不输出分隔线（与messages模式相同）
+        elif mode == "updates":
+            if not isinstance(data, dict):
+                if messages_from_updates:
+                    last_node, last_content, last_metadata = None, data, namespace
+                continue
+
+            for node_name, node_chunk in data.items():
+                if messages_from_updates:
+                    last_node, last_content, last_metadata = node_name, node_chunk, namespace
 
+                if node_names and node_name not in node_names:
+                    continue
+                if messages_from_updates:
+                    # updates模式下每个节点块都是一次完整的节点输出，因此每次都产出节点事件
+                    yield NodeChangeEvent(node_name, prev_node, namespace)
                     prev_node = node_name
-            else:
-                # 非字典情况输出整个块
-                print("\n" + "=" * 50)
-                print(f"🔄 Raw output 🔄")
-                print("- " * 25)
-                print(node_chunks, end="", flush=True)
-                # 这里不输出分隔线
-                final_result = {"content": node_chunks}
+                yield NodeUpdateEvent(node_name, node_chunk, namespace)
+                if messages_from_updates:
+                    for message in _node_messages(node_chunk):
+                        for event in message_events(node_name, message):
+                            yield event
 
-    else:
-        raise ValueError(
-            f"Invalid stream_mode: {stream_mode}. Must be 'messages' or 'updates'."
-        )
+        elif mode == "custom":
+            yield CustomEvent(prev_node, data, namespace)
+
+        elif mode == "debug":
+            payload = data.get("payload") if isinstance(data, dict) else None
+            node = payload.get("name") if isinstance(payload, dict) else prev_node
+            yield DebugEvent(node, data, namespace)
 
-    # 필요에 따라 최종 결과 반환
-    return final_result
+    yield DoneEvent(last_node, last_content, last_metadata)
 
 
 async def ainvoke_graph(
-    graph: CompiledStateGraph,
+    graph: "CompiledStateGraph",
     inputs: dict,
     config: Optional[RunnableConfig] = None,
-    node_names: List[str] = [],
-    callback: Optional[Callable] = None,
+    node_names: Sequence[str] = (),
     include_subgraphs: bool = True,
-) -> Dict[str, Any]:
+) -> AsyncIterator[StreamEvent]:
     """
-    异步流式输出LangGraph应用执行结果的函数。
+    以节点为单位（updates模式）流式执行LangGraph，默认包含子图的输出。
 
     Args:
         graph (CompiledStateGraph): 要执行的编译后的LangGraph对象
         inputs (dict): 传递给图的输入值字典
         config (Optional[RunnableConfig]): 执行配置（可选）
-        node_names (List[str], optional): 要输出的节点名称列表。默认值为空列表
-        callback (Optional[Callable], optional): 处理每个数据块的回调函数。默认值为None
-            回调函数接收{"node": str, "content": Any}形式的字典作为参数。
+        node_names (Sequence[str], optional): 要输出的节点名称列表。默认为空，即输出所有节点
         include_subgraphs (bool, optional): 是否包含子图。默认值为True
 
-    Returns:
-        Dict[str, Any]: 最终结果（最后一个节点的输出）
+    Yields:
+        StreamEvent: 与astream_graph相同的事件，最后一个为DoneEvent
     """
-    config = config or {}
-    final_result = {}
+    async for event in astream_graph(
+        graph,
+        inputs,
+        config,
+        node_names=node_names,
+        stream_mode="updates",
+        include_subgraphs=include_subgraphs,
+    ):
+        yield event
 
-    def format_namespace(namespace):
-        return namespace[-1].split(":")[0] if len(namespace) > 0 else "root graph"
 
-    # 通过subgraphs参数也包含子图的输出
-    async for chunk in graph.astream(
-        inputs, config, stream_mode="updates", subgraphs=include_subgraphs
-    ):
-        # 根据返回格式决定处理方法
-        if isinstance(chunk, tuple) and len(chunk) == 2:
-            # 原有预期格式：(namespace, chunk_dict)
-            namespace, node_chunks = chunk
-        else:
-            # 只返回单一字典的情况（REACT代理等）
-            namespace = []  # 空命名空间（根图）
-            node_chunks = chunk  # chunk本身就是节点块字典
-
-        # 确认是否为字典并处理项目
-        if isinstance(node_chunks, dict):
-            for node_name, node_chunk in node_chunks.items():
-                final_result = {
-                    "node": node_name,
-                    "content": node_chunk,
-                    "namespace": namespace,
-                }
-
-                # 仅在node_names不为空时进行过滤
-                if node_names and node_name not in node_names:
-                    continue
+def format_namespace(namespace) -> str:
+    return namespace[-1].split(":")[0] if len(namespace) > 0 else "root graph"
 
-                # 如果有回调函数则执行
-                if callback is not None:
-                    result = callback({"node": node_name, "content": node_chunk})
-                    # 如果是协程则await
-                    if hasattr(result, "__await__"):
-                        await result
-                # 没有回调的情况下默认输出
-                else:
-                    print("\n" + "=" * 50)
-                    formatted_namespace = format_namespace(namespace)
-                    if formatted_namespace == "root graph":
-                        print(f"🔄 Node: \033[1;36m{node_name}\033[0m 🔄")
-                    else:
-                        print(
-                            f"🔄 Node: \033[1;36m{node_name}\033[0m in [\033[1;33m{formatted_namespace}\033[0m] 🔄"
-                        )
-                    print("- " * 25)
-
-                    # 输出节点的块数据
-                    if isinstance(node_chunk, dict):
-                        for k, v in node_chunk.items():
-                            if isinstance(v, BaseMessage):
-                                v.pretty_print()
-                            elif isinstance(v, list):
-                                for list_item in v:
-                                    if isinstance(list_item, BaseMessage):
-                                        list_item.pretty_print()
-                                    else:
-                                        print(list_item)
-                            elif isinstance(v, dict):
-                                for node_chunk_key, node_chunk_value in v.items():
-                                    print(f"{node_chunk_key}:\n{node_chunk_value}")
-                            else:
-                                print(f"\033[1;32m{k}\033[0m:\n{v}")
-                    elif node_chunk is not None:
-                        if hasattr(node_chunk, "__iter__") and not isinstance(
-                            node_chunk, str
-                        ):
-                            for item in node_chunk:
-                                print(item)
-                        else:
-                            print(node_chunk)
-                    print("=" * 50)
-        else:
-            # 非字典情况输出整个块
+
+async def print_events(events: AsyncIterator[StreamEvent]) -> Optional[DoneEvent]:
+    """
+    标准输出消费者：把事件流打印到终端，返回最后的DoneEvent。
+
+    用法: await print_events(astream_graph(graph, inputs))
+    """
+    done = None
+    async for event in events:
+        if isinstance(event, TokenEvent):
+            print(event.text, end="", flush=True)
+        elif isinstance(event, NodeChangeEvent):
             print("\n" + "=" * 50)
-            print(f"🔄 Raw output 🔄")
+            formatted_namespace = format_namespace(event.namespace)
+            if formatted_namespace == "root graph":
+                print(f"🔄 Node: \033[1;36m{event.node}\033[0m 🔄")
+            else:
+                print(
+                    f"🔄 Node: \033[1;36m{event.node}\033[0m in [\033[1;33m{formatted_namespace}\033[0m] 🔄"
+                )
             print("- " * 25)
-            print(node_chunks)
-            print("=" * 50)
-            final_result = {"content": node_chunks}
-
-    # 返回最终结果
-    return final_result
+        elif isinstance(event, ToolCallStartEvent):
+            print(f"\n🔧 {event.name}: {event.args}", end="", flush=True)
+        elif isinstance(event, ToolCallDeltaEvent):
+            print(event.args_delta, end="", flush=True)
+        elif isinstance(event, ToolResultEvent):
+            print(f"\n📦 {event.name}: {event.content}", flush=True)
+        elif isinstance(event, DoneEvent):
+            print()
+            done = event
+    return done